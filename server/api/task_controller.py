@@ -1,74 +1,516 @@
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context, url_for
 from server.api_handler.analyze_sentiment import analyze_sentiment
+from server.api_handler.sentiment_cache import get_cached_response, cache_response
+from server.config.config import get_nlp_client, get_async_nlp_client, run_on_client_loop
+from server.api_handler.sentiment_backends import get_sentiment_backend
+from server.api_handler.resilience import (
+    request_deadline, clear_request_deadline,
+    nlp_breaker, deadline_kwargs, nlp_call_kwargs, remaining_time, fallback_sentiment_backend,
+    CircuitOpenError, NLP_CALL_TIMEOUT
+)
 from server.models.user_sqlalchemy_firestore_models import MoodUser
+from server.models.task_index import TaskIndex, StaleTaskIndexVersion
+from server.config.logging_config import payload
+from server.api_handler.job_queue import JobQueue, JobStore, JobQueueFull, JobFailed, FINISHED as JOB_FINISHED
+from server.api_handler.bulk_crypto import decrypt_many
+from server.api_handler.user_keys import master_cipher as cipher_suite
 from google.cloud import firestore, language_v1
-from cryptography.fernet import Fernet 
-import os
+import re
+import time
+import asyncio
+import heapq
+import json
 import logging
+import numpy as np
+from bisect import bisect_right
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
-encryption_key = os.getenv('ENCRYPTION_KEY')
-print(f"Loaded encryption key: {encryption_key}") 
-encryption_key = os.getenv('ENCRYPTION_KEY').encode()
-print(f"Encoded encryption key: {encryption_key}") 
-cipher_suite = Fernet(encryption_key)
 
 firestore_client = firestore.Client()
 
 def analyze_task_sentiment(task_text):
     """
     Analyzes the sentiment of a given task description using Google Cloud NLP API.
+    Falls back to the local scorer while the NLP circuit breaker is open or the call fails.
     """
-    client = language_v1.LanguageServiceClient()
-    document = language_v1.Document(content=task_text, type_=language_v1.Document.Type.PLAIN_TEXT)
-    
+    backend = get_sentiment_backend()
+    if not backend.remote:
+        return backend.analyze_sentiment(task_text).document_sentiment.score
+    cached_response = get_cached_response(task_text)
+    if cached_response is not None:
+        return cached_response.document_sentiment.score
     try:
-        sentiment = client.analyze_sentiment(request={"document": document}).document_sentiment
-        return sentiment.score
+        # The client is created inside the breaker call so credential and channel errors fall back too
+        response = nlp_breaker.call(
+            lambda: cache_response(task_text, backend.analyze_sentiment(
+                task_text, client=get_nlp_client(), **nlp_call_kwargs())),
+            fallback=lambda: fallback_sentiment_backend().analyze_sentiment(task_text),
+            fallback_on_error=True
+        )
+        return response.document_sentiment.score
     except Exception as e:
         return 0  
+
+# Limits for packing several short task descriptions into one analyze_sentiment document
+SENTIMENT_BATCH_MAX_TASKS = 25
+SENTIMENT_BATCH_MAX_CHARS = 1000
+PACKABLE_DESCRIPTION_MAX_CHARS = 200
+SENTENCE_END_PATTERN = re.compile(r'[.!?]')
+
+def is_packable_description(description):
+    """A description can share a document only if it reads as exactly one short sentence."""
+    body = description.strip()
+    return (0 < len(body) <= PACKABLE_DESCRIPTION_MAX_CHARS and '\n' not in body
+            and not SENTENCE_END_PATTERN.search(body.rstrip('.!?')))
+
+def pack_descriptions(descriptions):
+    """Groups descriptions into batches that each fit in one document."""
+    batch, batch_chars = [], 0
+    for description in descriptions:
+        if batch and (len(batch) >= SENTIMENT_BATCH_MAX_TASKS or batch_chars + len(description) > SENTIMENT_BATCH_MAX_CHARS):
+            yield batch
+            batch, batch_chars = [], 0
+        batch.append(description)
+        batch_chars += len(description) + 2
+    if batch:
+        yield batch
+
+def build_packed_request(descriptions):
+    """
+    Joins single-sentence descriptions into one analyze_sentiment request.
+    Returns the request and the [start, end) offsets of each description in the document.
+    """
+    parts, starts, ends = [], [], []
+    offset = 0
+    for description in descriptions:
+        body = description.strip()
+        if body[-1] not in '.!?':
+            body += '.'
+        parts.append(body)
+        starts.append(offset)
+        ends.append(offset + len(body))
+        offset += len(body) + 1
+
+    document = language_v1.Document(content=' '.join(parts), type_=language_v1.Document.Type.PLAIN_TEXT)
+    # UTF32 offsets count code points, which is what Python string indexes count
+    return {"document": document, "encoding_type": language_v1.EncodingType.UTF32}, starts, ends
+
+def assign_packed_sentences(descriptions, starts, ends, response):
+    """
+    Maps the sentence-level results of a packed request back to the descriptions by offset.
+    Descriptions that did not come back as exactly one sentence are left out
+    so the caller can score them alone. The scores are not cached: a sentence scored
+    in context isn't the response a request for the description alone would get.
+    """
+    sentences_by_description = [[] for _ in descriptions]
+    for sentence in response.sentences:
+        index = bisect_right(starts, sentence.text.begin_offset) - 1
+        if index >= 0 and sentence.text.begin_offset < ends[index]:
+            sentences_by_description[index].append(sentence)
+
+    scores = {}
+    for description, sentences in zip(descriptions, sentences_by_description):
+        if len(sentences) == 1:
+            scores[description] = sentences[0].sentiment.score
+    return scores
+
+def score_packed_descriptions(descriptions):
+    """Scores several single-sentence descriptions with one API call."""
+    request, starts, ends = build_packed_request(descriptions)
+    # As in analyze_task_sentiment, client errors count as failed calls and fall back
+    response = nlp_breaker.call(lambda: get_nlp_client().analyze_sentiment(request=request, **nlp_call_kwargs()))
+    return assign_packed_sentences(descriptions, starts, ends, response)
+
+def score_descriptions_locally(descriptions, backend):
+    """Scores the distinct descriptions in one vectorized batch with a local backend."""
+    distinct = [description for description in dict.fromkeys(descriptions)]
+    texts = [description if isinstance(description, str) else "" for description in distinct]
+    return dict(zip(distinct, backend.score_batch(texts)))
+
+def split_cached_descriptions(descriptions):
+    """
+    Returns (scores, pending): scores for distinct descriptions that need no API call
+    (cached or empty) and the distinct descriptions that still have to be scored.
+    """
+    scores = {}
+    pending = []
+    for description in dict.fromkeys(descriptions):
+        if not isinstance(description, str) or not description.strip():
+            # The API rejects empty documents, which analyze_task_sentiment turns into 0
+            scores[description] = 0
+            continue
+        cached_response = get_cached_response(description)
+        if cached_response is not None:
+            scores[description] = cached_response.document_sentiment.score
+        else:
+            pending.append(description)
+    return scores, pending
+
+def build_sentiment_plan(descriptions):
+    """
+    Scores every distinct task description exactly once for a request.
+    Cached descriptions cost nothing, short single-sentence ones are packed several
+    to a document, and the rest are scored one by one.
+    Returns a dict of description -> sentiment score.
+    """
+    backend = get_sentiment_backend()
+    if not backend.remote:
+        return score_descriptions_locally(descriptions, backend)
+    scores, pending = split_cached_descriptions(descriptions)
+
+    packable = [description for description in pending if is_packable_description(description)]
+    if len(packable) > 1 and nlp_breaker.state == nlp_breaker.CLOSED:
+        for batch in pack_descriptions(packable):
+            if len(batch) < 2:
+                continue
+            try:
+                scores.update(score_packed_descriptions(batch))
+            except Exception as e:
+                logger.error("Packed sentiment analysis failed, scoring tasks individually: %s", e)
+
+    for description in pending:
+        if description not in scores:
+            scores[description] = analyze_task_sentiment(description)
+    logger.debug("Sentiment plan scored %d distinct of %d descriptions", len(scores), len(descriptions))
+    return scores
+
+async def build_sentiment_plan_async(descriptions, concurrency=8, deadline=10.0):
+    """
+    Async version of build_sentiment_plan that sends all of its API calls concurrently,
+    at most `concurrency` at a time, and gives up on whatever is unfinished after
+    `deadline` seconds. Tasks that could not be scored in time get 0; tasks refused by
+    the open NLP circuit breaker are scored by the local fallback instead.
+    Must run on the client loop (see run_on_client_loop).
+    """
+    backend = get_sentiment_backend()
+    if not backend.remote:
+        return score_descriptions_locally(descriptions, backend)
+    scores, pending = split_cached_descriptions(descriptions)
+    if not pending:
+        return scores
+
+    client = get_async_nlp_client()
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    deadline_at = loop.time() + deadline
+
+    short_circuited = set()
+
+    async def analyze(request):
+        async with semaphore:
+            remaining = deadline_at - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            if not nlp_breaker.allow_request():
+                raise CircuitOpenError("NLP circuit breaker is open")
+            started = loop.time()
+            try:
+                response = await client.analyze_sentiment(request=request, timeout=min(remaining, NLP_CALL_TIMEOUT))
+            except asyncio.CancelledError:
+                # Still running at the request deadline
+                nlp_breaker.record_cancelled(loop.time() - started)
+                raise
+            except Exception:
+                nlp_breaker.record_failure()
+                raise
+            nlp_breaker.record_success(loop.time() - started)
+            return response
+
+    async def score_packed(batch):
+        request, starts, ends = build_packed_request(batch)
+        return assign_packed_sentences(batch, starts, ends, await analyze(request))
+
+    async def score_single(description):
+        document = language_v1.Document(content=description, type_=language_v1.Document.Type.PLAIN_TEXT)
+        response = cache_response(description, await analyze({"document": document}))
+        return {description: response.document_sentiment.score}
+
+    async def run_wave(coroutines):
+        jobs = {asyncio.ensure_future(coroutine): batch for batch, coroutine in coroutines}
+        if not jobs:
+            return
+        done, not_done = await asyncio.wait(jobs, timeout=max(0, deadline_at - loop.time()))
+        for job in not_done:
+            job.cancel()
+        for job in done:
+            if job.exception() is None:
+                scores.update(job.result())
+            elif isinstance(job.exception(), CircuitOpenError):
+                short_circuited.update(jobs[job])
+            else:
+                logger.error("Async sentiment analysis failed: %s", job.exception())
+
+    # First wave: packed batches plus every description that can't be packed
+    packable = [description for description in pending if is_packable_description(description)]
+    batches = [batch for batch in pack_descriptions(packable) if len(batch) > 1] if len(packable) > 1 else []
+    packed = {description for batch in batches for description in batch}
+    await run_wave([(batch, score_packed(batch)) for batch in batches] +
+                   [((description,), score_single(description)) for description in pending if description not in packed])
+    # Second wave: descriptions a packed request could not attribute, scored on their own
+    await run_wave([((description,), score_single(description))
+                    for description in packed if description not in scores and description not in short_circuited])
+
+    fallback = [description for description in short_circuited if description not in scores]
+    if fallback:
+        scores.update(score_descriptions_locally(fallback, fallback_sentiment_backend()))
+        nlp_breaker.record_fallback(len(fallback))
+    for description in pending:
+        scores.setdefault(description, 0)
+    return scores
     
-def reorganize_tasks_based_on_mood_and_sentiment(tasks, mood_score):
+# From this many tasks on, the ranking is computed with one stable NumPy lexsort
+RANKING_NUMPY_MIN_TASKS = 256
+
+def task_ranking_keys(priorities, sentiments, mood_score):
     """
-    Reorganizes tasks based on mood score and sentiment of each task.
-    Positive mood score -> prioritize tasks with higher priority and positive sentiment.
-    Negative mood score -> prioritize tasks with lower priority and negative sentiment.
+    Returns (keys, reverse): per-task sort keys and direction for the mood.
+    Positive mood score -> prioritize higher priority and positive sentiment.
+    Negative mood score -> prioritize lower priority and negative sentiment.
+    Neutral mood score -> prioritize tasks with priority regardless of sentiment.
+    """
+    if mood_score > 0:
+        return list(zip(priorities, sentiments)), True
+    elif mood_score < 0:
+        return [(priority, -sentiment) for priority, sentiment in zip(priorities, sentiments)], False
+    return list(priorities), True
+
+# Integers beyond this lose precision as float64, so they could rank differently than in sorted()
+MAX_EXACT_FLOAT_INTEGER = 2 ** 53
+
+def _is_number(value):
+    """True for plain numbers that float64 represents exactly enough to rank like sorted() does"""
+    if isinstance(value, (bool, np.bool_)):
+        return False
+    if isinstance(value, (int, np.integer)):
+        return -MAX_EXACT_FLOAT_INTEGER <= value <= MAX_EXACT_FLOAT_INTEGER
+    return isinstance(value, (float, np.floating))
+
+def rank_task_indices_numpy(priorities, sentiments, mood_score):
+    """
+    Task indices in ranking order, identical to sorting task_ranking_keys with sorted(),
+    ties included, since lexsort is stable. Returns None if the keys aren't plain numbers
+    or are integers too large for float64 to hold exactly.
+    """
+    # np.asarray would also parse numeric strings, which sorted() compares as strings
+    if not all(_is_number(key) for key in priorities) or not all(_is_number(key) for key in sentiments):
+        return None
+    try:
+        priorities = np.asarray(priorities, dtype=np.float64)
+        sentiments = np.asarray(sentiments, dtype=np.float64)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if priorities.ndim != 1 or np.isnan(priorities).any() or np.isnan(sentiments).any():
+        return None
+    # sorted(..., reverse=True) keeps ties in input order, and so does an ascending stable
+    # sort on the negated keys. The last lexsort key is the primary one.
+    if mood_score > 0:
+        return np.lexsort((-sentiments, -priorities))
+    elif mood_score < 0:
+        return np.lexsort((-sentiments, priorities))
+    return np.argsort(-priorities, kind='stable')
+
+def reorganize_tasks_based_on_mood_and_sentiment(tasks, mood_score, sentiment_scores=None, limit=None, offset=0):
+    """
+    Reorganizes tasks based on mood score and sentiment of each task (see task_ranking_keys).
+    sentiment_scores can map descriptions to already computed scores (see build_sentiment_plan).
+    With limit and/or offset only that window of the ranking is returned; a limit picks the
+    top offset + limit tasks with a heap instead of sorting them all. Either way the result
+    is the same slice of the full ranking. Returned tasks get their 'sentiment_score' set.
     """
     if not tasks:
         return tasks  
 
-    # Analyze sentiment for each task
+    # Analyze sentiment for each distinct task description once
+    if sentiment_scores is None:
+        sentiment_scores = {}
+    task_scores = []
     for task in tasks:
-        task['sentiment_score'] = analyze_task_sentiment(task['description'])
+        description = task['description']
+        if description not in sentiment_scores:
+            sentiment_scores[description] = analyze_task_sentiment(description)
+        task_scores.append(sentiment_scores[description])
+    priorities = [task.get('priority', 0) for task in tasks]
+    stop = None if limit is None else offset + limit
 
-    if mood_score > 0:
-        # Positive mood score: prioritize higher priority and positive sentiment
-        tasks_sorted = sorted(
-            tasks,
-            key=lambda x: (x.get('priority', 0), x.get('sentiment_score', 0)),
-            reverse=True
-        )
-    elif mood_score < 0:
-        # Negative mood score: prioritize lower priority and negative sentiment
-        tasks_sorted = sorted(
-            tasks,
-            key=lambda x: (x.get('priority', 0), -x.get('sentiment_score', 0)),
-            reverse=False
-        )
-    else:
-        # Neutral mood score: prioritize tasks with priority regardless of sentiment
-        tasks_sorted = sorted(
-            tasks,
-            key=lambda x: x.get('priority', 0),
-            reverse=True
-        )
+    ranked = None
+    if len(tasks) >= RANKING_NUMPY_MIN_TASKS:
+        order = rank_task_indices_numpy(priorities, task_scores, mood_score)
+        if order is not None:
+            ranked = order[offset:stop].tolist()
+    if ranked is None:
+        keys, reverse = task_ranking_keys(priorities, task_scores, mood_score)
+        if stop is not None and stop < len(tasks):
+            # nlargest/nsmallest are documented to equal sorted(...)[:n], ties included
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            ranked = select(stop, range(len(tasks)), key=keys.__getitem__)[offset:]
+        else:
+            ranked = sorted(range(len(tasks)), key=keys.__getitem__, reverse=reverse)[offset:stop]
+
+    tasks_sorted = []
+    for index in ranked:
+        task = tasks[index]
+        task['sentiment_score'] = task_scores[index]
+        tasks_sorted.append(task)
     return tasks_sorted
 
+class _Descending:
+    """Sort key wrapper that orders keys from largest to smallest."""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+class StreamingTaskRanker:
+    """
+    Ranks tasks as they stream in while holding at most offset + limit of them per mood
+    direction (positive, negative, neutral), so the window can be cut once the mood is known.
+    finish(mood_score) returns the same tasks as
+    reorganize_tasks_based_on_mood_and_sentiment(all_tasks, mood_score, limit=limit, offset=offset).
+    """
+    MOODS = (1, -1, 0)
+
+    def __init__(self, limit, offset=0):
+        self.limit = limit
+        self.offset = offset
+        self.count = 0
+        self._heaps = {mood: [] for mood in self.MOODS}
+
+    def add(self, task, sentiment_score):
+        position = self.count
+        self.count += 1
+        stop = self.offset + self.limit
+        if stop == 0:
+            return
+        priority = task.get('priority', 0)
+        for mood, heap in self._heaps.items():
+            keys, reverse = task_ranking_keys([priority], [sentiment_score], mood)
+            # Each heap keeps its worst entry on top: the lowest-ranked key, then the latest task
+            entry = (keys[0] if reverse else _Descending(keys[0]), -position, task, sentiment_score)
+            if len(heap) < stop:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+    def finish(self, mood_score):
+        mood = 1 if mood_score > 0 else -1 if mood_score < 0 else 0
+        ranked = sorted(self._heaps[mood], key=lambda entry: entry[:2], reverse=True)[self.offset:]
+        tasks_sorted = []
+        for _, _, task, sentiment_score in ranked:
+            task['sentiment_score'] = sentiment_score
+            tasks_sorted.append(task)
+        return tasks_sorted
+
+def read_ndjson_line(stream, max_line_bytes):
+    """Reads the next non-empty line of an NDJSON stream as JSON, or returns None at the end."""
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return None
+        if len(line) > max_line_bytes and not line.endswith(b'\n'):
+            raise ValueError(f"NDJSON lines are limited to {max_line_bytes} bytes")
+        if line.strip():
+            try:
+                return json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid NDJSON line: {e}")
+
+def iter_ndjson_tasks(stream, max_line_bytes):
+    while True:
+        task = read_ndjson_line(stream, max_line_bytes)
+        if task is None:
+            return
+        if not isinstance(task, dict) or not isinstance(task.get('description'), str):
+            raise ValueError("Each task must be a JSON object with a 'description' string")
+        yield task
+
+def iter_task_chunks(tasks, chunk_size):
+    chunk = []
+    for task in tasks:
+        chunk.append(task)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def stream_analyze_tasks():
+    """
+    NDJSON mode of analyze_tasks (Content-Type: application/x-ndjson) for very long task lists.
+    The first line holds the request options ({"user_id": ..., optional "limit", "offset" and
+    "mood_score"}), every further line one task. Tasks are read and scored a chunk at a time,
+    and each chunk's {"type": "taskSentiment"} lines are sent as soon as it is scored.
+    After the last task come one {"type": "mood"} line, the {"type": "recommendedTask"} lines
+    and a closing {"type": "done"} line (or {"type": "error"} if the stream fails midway).
+    Without a mood_score the mood is the mean task sentiment, since the full text is never
+    held at once; without a limit at most TASK_STREAM_MAX_RECOMMENDATIONS tasks are returned.
+    """
+    config = current_app.config
+    max_line_bytes = config.get('TASK_STREAM_MAX_LINE_BYTES', 64 * 1024)
+    options = read_ndjson_line(request.stream, max_line_bytes)
+    if not isinstance(options, dict):
+        raise ValueError("The first NDJSON line must be an object with the request options")
+    user_id = options.get('user_id', '')
+    if not user_id:
+        raise ValueError("User ID is required")
+    limit = options.get('limit', config.get('TASK_STREAM_MAX_RECOMMENDATIONS', 100))
+    offset = options.get('offset', 0)
+    mood_score = options.get('mood_score')
+    if not isinstance(limit, int) or limit < 0:
+        raise ValueError("limit should be a non-negative integer")
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("offset should be a non-negative integer")
+    if mood_score is not None and (not isinstance(mood_score, (int, float)) or isinstance(mood_score, bool)):
+        raise ValueError("mood_score should be a number")
+
+    chunk_size = config.get('TASK_STREAM_CHUNK_SIZE', 100)
+    chunk_deadline = config.get('TASK_SENTIMENT_DEADLINE', 10.0)
+    mood_user = MoodUser(user_id=user_id)
+
+    def generate():
+        # A stream has no fixed length, so each chunk gets its own deadline instead of the request's
+        clear_request_deadline()
+        ranker = StreamingTaskRanker(limit, offset)
+        sentiment_total = 0.0
+        try:
+            for chunk in iter_task_chunks(iter_ndjson_tasks(request.stream, max_line_bytes), chunk_size):
+                with request_deadline(chunk_deadline):
+                    sentiment_scores = build_sentiment_plan([task['description'] for task in chunk])
+                lines = []
+                for task in chunk:
+                    sentiment_score = sentiment_scores[task['description']]
+                    sentiment_total += sentiment_score
+                    ranker.add(task, sentiment_score)
+                    lines.append(json.dumps({"type": "taskSentiment", "task": task['description'], "sentimentScore": sentiment_score}))
+                yield '\n'.join(lines) + '\n'
+
+            overall = mood_score if mood_score is not None else (sentiment_total / ranker.count if ranker.count else 0.0)
+            yield json.dumps({"type": "mood", "userMoodCategory": mood_user.classify_mood(overall), "moodScore": overall}) + '\n'
+            for task in ranker.finish(overall):
+                yield json.dumps({"type": "recommendedTask", "task": task}) + '\n'
+            yield json.dumps({"type": "done", "totalTasks": ranker.count, "status": "success"}) + '\n'
+        except ValueError as ve:
+            logger.error("ValueError: %s", ve)
+            yield json.dumps({"type": "error", "error": str(ve)}) + '\n'
+        except Exception as e:
+            logger.error("Exception: %s", e)
+            yield json.dumps({"type": "error", "error": "An error occurred while processing the request."}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Tasks stored server side, scored once when they are written
+task_index = TaskIndex(score_descriptions=build_sentiment_plan, db=firestore_client)
+
 task_controller = Blueprint('task_controller', __name__)
-@task_controller.route('/analyze_tasks', methods=['POST'])
-def analyze_tasks():
+
+@task_controller.route('/index', methods=['POST'])
+def update_task_index():
     try:
         request_data = request.get_json()
         if not request_data:
@@ -76,34 +518,188 @@ def analyze_tasks():
 
         user_id = request_data.get('user_id', '')
         tasks = request_data.get('tasks', [])
-
-        if not isinstance(tasks, list):
-            raise ValueError("Tasks should be a list")
+        delete_ids = request_data.get('delete', [])
 
         if not user_id:
             raise ValueError("User ID is required")
+        if not isinstance(tasks, list) or not isinstance(delete_ids, list):
+            raise ValueError("Tasks and delete should be lists")
 
-        logger.debug(f"Received request JSON: {request_data}")
-        logger.debug(f"Received user_id: {user_id}")
-        logger.debug(f"Received tasks: {tasks}")
+        task_ids, version = task_index.upsert(user_id, tasks, delete_ids)
+        # Scoring happens in the background; analyze_tasks picks the results up once ready
+        return jsonify({"taskIds": task_ids, "version": version, "status": "accepted"}), 202
 
-        # Fetch user mood
-        mood_user = MoodUser(user_id=user_id)
-        combined_tasks_text = ' '.join(task.get('description', '') for task in tasks if 'description' in task)
-        sentiment_score = analyze_sentiment(combined_tasks_text)
-        user_mood_category = mood_user.classify_mood(sentiment_score)
-        reorganized_tasks = reorganize_tasks_based_on_mood_and_sentiment(tasks, sentiment_score)
-        
-        # Analyze sentiment for each task individually
-        task_sentiments = [{"task": task.get("description", ""), "sentimentScore": analyze_task_sentiment(task.get("description", ""))} for task in tasks]
+    except ValueError as ve:
+        logger.error("ValueError: %s", ve)
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        logger.error("Exception: %s", e)
+        return jsonify({"error": "An error occurred while processing the request."}), 500
+
+async def rank_indexed_tasks(request_data, user_id, limit, offset):
+    """
+    analyze_tasks for tasks already in the task index: the client sends task_ids and/or the
+    version token it last saw, and an optional mood_score. Nothing is sent to the sentiment
+    API: the tasks are ranked on the sentiment stored with them, and without a mood_score
+    the mood is the mean of those stored scores.
+    """
+    task_ids = request_data.get('task_ids')
+    if task_ids is not None and not isinstance(task_ids, list):
+        raise ValueError("task_ids should be a list")
+    tasks, sentiment_scores, version = await asyncio.to_thread(
+        task_index.ranking_input, user_id, task_ids, request_data.get('version'))
+
+    sentiment_score = request_data.get('mood_score')
+    if sentiment_score is None:
+        stored_scores = [sentiment_scores[task['description']] for task in tasks]
+        sentiment_score = sum(stored_scores) / len(stored_scores) if stored_scores else 0
+    elif not isinstance(sentiment_score, (int, float)) or isinstance(sentiment_score, bool):
+        raise ValueError("mood_score should be a number")
+
+    user_mood_category = MoodUser(user_id=user_id).classify_mood(sentiment_score)
+    reorganized_tasks = reorganize_tasks_based_on_mood_and_sentiment(
+        tasks, sentiment_score, sentiment_scores=sentiment_scores, limit=limit, offset=offset)
+    task_sentiments = [{"taskId": task["id"], "task": task["description"], "sentimentScore": sentiment_scores[task["description"]]}
+                       for task in tasks]
+    result = {
+        "userMoodCategory": user_mood_category,
+        "recommendedTasks": reorganized_tasks,
+        "taskSentiments": task_sentiments,
+        "version": version,
+        "status": "success"
+    }
+    if limit is not None or offset:
+        result["totalTasks"] = len(tasks)
+    return result
+
+def validate_analysis_request(request_data):
+    """Checks the parts of an analyze_tasks body every mode needs; raises ValueError otherwise."""
+    if not request_data:
+        raise ValueError("No data provided")
+    if not isinstance(request_data, dict):
+        raise ValueError("Request body should be a JSON object")
+    if not isinstance(request_data.get('tasks', []), list):
+        raise ValueError("Tasks should be a list")
+    if not request_data.get('user_id', ''):
+        raise ValueError("User ID is required")
+
+async def run_task_analysis(request_data, concurrency=8, deadline=10.0):
+    """
+    The body of analyze_tasks, shared by the view and background jobs.
+    Returns the response dict; raises ValueError for a bad request and
+    StaleTaskIndexVersion for an outdated task index version.
+    """
+    validate_analysis_request(request_data)
+    user_id = request_data['user_id']
+    tasks = request_data.get('tasks', [])
 
-        return jsonify({
-            "userMoodCategory": user_mood_category,
-            "recommendedTasks": reorganized_tasks,
-            "taskSentiments": task_sentiments,
-            "status": "success"
-        })
+    # Optional window of the ranking, e.g. just the first few recommendations
+    limit = request_data.get('limit')
+    offset = request_data.get('offset', 0)
+    if limit is not None and (not isinstance(limit, int) or limit < 0):
+        raise ValueError("limit should be a non-negative integer")
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("offset should be a non-negative integer")
 
+    if 'tasks' not in request_data and ('task_ids' in request_data or 'version' in request_data):
+        return await rank_indexed_tasks(request_data, user_id, limit, offset)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Analyzing %d tasks for user %s: %s", len(tasks), user_id, payload(tasks))
+
+    # Fetch user mood
+    mood_user = MoodUser(user_id=user_id)
+    combined_tasks_text = ' '.join(task.get('description', '') for task in tasks if 'description' in task)
+
+    # Score the combined text and each distinct description concurrently; the per-task
+    # scores are shared between ranking and the per-task report. The client loop does not
+    # see the caller's deadline, so it gets whatever is left of it explicitly.
+    descriptions = [task.get("description", "") for task in tasks]
+    remaining = remaining_time()
+    if remaining is not None:
+        deadline = max(0.0, min(deadline, remaining))
+    sentiment_score, sentiment_scores = await asyncio.gather(
+        asyncio.to_thread(analyze_sentiment, combined_tasks_text),
+        run_on_client_loop(build_sentiment_plan_async(descriptions, concurrency=concurrency, deadline=deadline))
+    )
+    user_mood_category = mood_user.classify_mood(sentiment_score)
+    reorganized_tasks = reorganize_tasks_based_on_mood_and_sentiment(
+        tasks, sentiment_score, sentiment_scores=sentiment_scores, limit=limit, offset=offset)
+    task_sentiments = [{"task": description, "sentimentScore": sentiment_scores[description]} for description in descriptions]
+
+    result = {
+        "userMoodCategory": user_mood_category,
+        "recommendedTasks": reorganized_tasks,
+        "taskSentiments": task_sentiments,
+        "status": "success"
+    }
+    if limit is not None or offset:
+        result["totalTasks"] = len(tasks)
+    return result
+
+def run_analysis_job(job):
+    """
+    Job function for analyze_tasks?async=1. Runs on a job worker thread or process with
+    the settings captured from the app config when the job was queued.
+    """
+    try:
+        with request_deadline(job['timeout']):
+            return asyncio.run(run_task_analysis(job['request'], concurrency=job['concurrency'], deadline=job['deadline']))
+    except StaleTaskIndexVersion as stale:
+        raise JobFailed(str(stale), 409, {"version": stale.current_version})
+    except ValueError as ve:
+        raise JobFailed(str(ve), 400)
+
+def get_job_queue():
+    """The app's analysis job queue, created on first use from its JOB_* settings."""
+    queue = current_app.extensions.get('task_jobs')
+    if queue is None:
+        config = current_app.config
+        queue = JobQueue(
+            run_analysis_job,
+            workers=config.get('JOB_WORKERS', 4),
+            mode=config.get('JOB_WORKER_MODE', 'thread'),
+            max_pending=config.get('JOB_MAX_PENDING', 100),
+            store=JobStore(max_jobs=config.get('JOB_MAX_STORED', 1000), ttl=config.get('JOB_RESULT_TTL', 600.0))
+        )
+        queue = current_app.extensions.setdefault('task_jobs', queue)
+    return queue
+
+def job_response(job):
+    """A job record as returned to clients."""
+    return {key: value for key, value in job.items() if key != 'revision'}
+
+@task_controller.route('/analyze_tasks', methods=['POST'])
+async def analyze_tasks():
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            return stream_analyze_tasks()
+
+        request_data = request.get_json()
+        config = current_app.config
+        if request.args.get('async') in ('1', 'true'):
+            validate_analysis_request(request_data)
+            job = get_job_queue().submit({
+                'request': request_data,
+                'concurrency': config.get('TASK_SENTIMENT_CONCURRENCY', 8),
+                'deadline': config.get('TASK_SENTIMENT_DEADLINE', 10.0),
+                'timeout': config.get('JOB_TIMEOUT', 300.0)
+            })
+            response = jsonify(job_response(job))
+            response.headers['Location'] = url_for('task_controller.get_analysis_job', job_id=job['jobId'])
+            return response, 202
+
+        result = await run_task_analysis(
+            request_data,
+            concurrency=config.get('TASK_SENTIMENT_CONCURRENCY', 8),
+            deadline=config.get('TASK_SENTIMENT_DEADLINE', 10.0)
+        )
+        return jsonify(result)
+
+    except JobQueueFull as full:
+        return jsonify({"error": str(full)}), 503, {'Retry-After': '5'}
+    except StaleTaskIndexVersion as stale:
+        return jsonify({"error": str(stale), "version": stale.current_version}), 409
     except ValueError as ve:
         logger.error(f"ValueError: {ve}")
         return jsonify({"error": str(ve)}), 400
@@ -111,7 +707,47 @@ def analyze_tasks():
         logger.error(f"Exception: {e}")
         return jsonify({"error": "An error occurred while processing the request."}), 500
 
-    
+def stream_job_events(queue, job):
+    """
+    Server-sent events for a job: a 'status' event on every change and a final 'result'
+    event with the finished job; a comment line keeps idle connections open.
+    """
+    keepalive = current_app.config.get('JOB_SSE_KEEPALIVE', 15.0)
+    max_wait = current_app.config.get('JOB_SSE_MAX_WAIT', 600.0)
+
+    def generate():
+        current = job
+        started = time.monotonic()
+        yield f"event: status\ndata: {json.dumps(job_response(current))}\n\n"
+        while current['status'] not in JOB_FINISHED:
+            if time.monotonic() - started > max_wait:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            changed = queue.store.wait_for_change(current['jobId'], current['revision'], keepalive)
+            if changed is None:
+                yield "event: expired\ndata: {}\n\n"
+                return
+            if changed['revision'] == current['revision']:
+                yield ": keep-alive\n\n"
+                continue
+            current = changed
+            if current['status'] not in JOB_FINISHED:
+                yield f"event: status\ndata: {json.dumps(job_response(current))}\n\n"
+        yield f"event: result\ndata: {json.dumps(job_response(current))}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@task_controller.route('/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    queue = get_job_queue()
+    job = queue.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    if request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream':
+        return stream_job_events(queue, job)
+    return jsonify(job_response(job))
+
 def recommend_tasks_based_on_analysis(task_sentiments):
     """
     Recommends tasks based on their sentiment scores.
@@ -170,10 +806,10 @@ def store_user_data_securely(collection_name, document_id, data):
         if not all(field in encrypted_data for field in fields_to_encrypt):
             raise ValueError("Encryption failed for some required fields")
 
-        firestore_client.collection(collection_name).document(document_id).set(encrypted_data)
-        print(f"Document {document_id} successfully written to {collection_name} collection.")
+        firestore_client.collection(collection_name).document(document_id).set(encrypted_data, **deadline_kwargs())
+        logger.info("Document %s successfully written to %s collection.", document_id, collection_name)
     except Exception as e:
-        print(f"An error occurred while writing to Firestore: {e}")
+        logger.error("An error occurred while writing to Firestore: %s", e)
 
 
 def decrypt_data(encrypted_data):
@@ -193,22 +829,42 @@ def decrypt_data(encrypted_data):
 
 def retrieve_user_data_securely(collection_name, document_id):
     try:
-        doc = firestore_client.collection(collection_name).document(document_id).get()
+        doc = firestore_client.collection(collection_name).document(document_id).get(**deadline_kwargs())
         if doc.exists:
             decrypted_data = {k: decrypt_data(v) for k, v in doc.to_dict().items()}
-            print(f"Document {document_id} successfully retrieved and decrypted.")
+            logger.info("Document %s successfully retrieved and decrypted.", document_id)
             return decrypted_data
         else:
-            print(f"No document found for ID {document_id} in {collection_name} collection.")
+            logger.info("No document found for ID %s in %s collection.", document_id, collection_name)
             return None
     except Exception as e:
-        print(f"An error occurred while retrieving data from Firestore: {e}")
+        logger.error("An error occurred while retrieving data from Firestore: %s", e)
+        return None
+
+def retrieve_many_user_data_securely(collection_name, document_ids):
+    """
+    retrieve_user_data_securely for many documents: one batched read, then the documents are
+    decrypted in parallel. Returns a list in the order of document_ids with None for
+    documents that are missing or can't be decrypted.
+    """
+    try:
+        references = [firestore_client.collection(collection_name).document(document_id) for document_id in document_ids]
+        docs = {doc.id: doc for doc in firestore_client.get_all(references, **deadline_kwargs())}
+        found = [docs[document_id].to_dict() if document_id in docs and docs[document_id].exists else None
+                 for document_id in document_ids]
+        results = decrypt_many(found, lambda data: {k: decrypt_data(v) for k, v in data.items()} if data is not None else None)
+        failed = sum(1 for result in results if not result.ok)
+        if failed:
+            logger.error("Could not decrypt %d of %d documents from %s collection.", failed, len(results), collection_name)
+        return [result.value for result in results]
+    except Exception as e:
+        logger.error("An error occurred while retrieving data from Firestore: %s", e)
         return None
 
 def delete_no_longer_needed_data(collection_name, document_id):
     try:
-        firestore_client.collection(collection_name).document(document_id).delete()
-        print(f"Document {document_id} successfully deleted from {collection_name} collection.")
+        firestore_client.collection(collection_name).document(document_id).delete(**deadline_kwargs())
+        logger.info("Document %s successfully deleted from %s collection.", document_id, collection_name)
     except Exception as e:
-        print(f"An error occurred while deleting from Firestore: {e}")
+        logger.error("An error occurred while deleting from Firestore: %s", e)
 
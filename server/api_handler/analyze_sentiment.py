@@ -1,17 +1,34 @@
-from google.cloud import language_v1
+import logging
 import os
+from server.api_handler.sentiment_cache import get_cached_response, cache_response
+from server.config.config import get_nlp_client
+from server.config.logging_config import payload
+from server.api_handler.sentiment_backends import get_sentiment_backend
+from server.api_handler.resilience import nlp_breaker, nlp_call_kwargs, fallback_sentiment_backend
+
+logger = logging.getLogger(__name__)
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "C:/Users/eghaz/Downloads/ProductivePandaDoingAgain/server/config/productivepandacredentials.json"
 
 def analyze_sentiment(text_content):
-    client = language_v1.LanguageServiceClient()
-    document = {"content": text_content, "type_": language_v1.Document.Type.PLAIN_TEXT}
-    response = client.analyze_sentiment(request={'document': document})
-    print(f"Overall Sentiment: score = {response.document_sentiment.score}, magnitude = {response.document_sentiment.magnitude}")
-
-    for sentence in response.sentences:
-        print(f"Sentence: {sentence.text.content}")
-        print(f"Sentiment: score = {sentence.sentiment.score}, magnitude = {sentence.sentiment.magnitude}")
+    backend = get_sentiment_backend()
+    if not backend.remote:
+        return backend.analyze_sentiment(text_content).document_sentiment.score
+    response = get_cached_response(text_content)
+    if response is not None:
+        return response.document_sentiment.score
+    response = nlp_breaker.call(
+        lambda: cache_response(text_content, backend.analyze_sentiment(
+            text_content, client=get_nlp_client(), **nlp_call_kwargs())),
+        fallback=lambda: fallback_sentiment_backend().analyze_sentiment(text_content),
+        fallback_on_error=True
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Overall Sentiment: score = %s, magnitude = %s",
+                     response.document_sentiment.score, response.document_sentiment.magnitude)
+        for sentence in response.sentences:
+            logger.debug("Sentence %s: score = %s, magnitude = %s",
+                         payload(sentence.text.content), sentence.sentiment.score, sentence.sentiment.magnitude)
 
     return response.document_sentiment.score
 
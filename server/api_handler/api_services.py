@@ -6,20 +6,27 @@ import sys
 from flask import request, jsonify
 from nltk.corpus import wordnet, stopwords
 from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
-from google.cloud import firestore, language_v1
-from cryptography.fernet import Fernet
-import traceback 
+from google.cloud import firestore
 import os
+from functools import lru_cache
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+import threading
+import atexit
 
 sys.path.append(".")
 from server.config.config import get_nlp_client
+from server.api_handler.lemma_table import load_lemmatizer
+from server.api_handler.sentiment_cache import get_cached_response, cache_response
+from server.api_handler.sentiment_backends import get_sentiment_backend
+from server.api_handler.resilience import nlp_breaker, deadline_kwargs, nlp_call_kwargs, fallback_sentiment_backend
+from server.config.logging_config import payload
+from server.api_handler.user_keys import master_cipher as cipher_suite
 
 db = firestore.Client()
-encryption_key = os.getenv('ENCRYPTION_KEY').encode()
-cipher_suite = Fernet(encryption_key)
-lemmatizer = WordNetLemmatizer()
-logging.basicConfig(level=logging.DEBUG)
+# Memory-mapped lemma table when one has been built, WordNetLemmatizer otherwise
+lemmatizer = load_lemmatizer()
+logger = logging.getLogger(__name__)
 
 # Download necessary NLTK data
 nltk.download('punkt')
@@ -37,6 +44,35 @@ def remove_punctuation(text):
 def tokenize_text(text):
     return word_tokenize(text)
 
+# Words the Treebank tokenizer splits even when there is no punctuation left in the text
+TREEBANK_WORD_SPLITS = {
+    "cannot": 3,
+    "gimme": 3,
+    "gonna": 3,
+    "gotta": 3,
+    "lemme": 3,
+    "wanna": 3
+}
+NOT_NORMALIZED_PATTERN = re.compile(r'[^\w\s]')
+
+def fast_tokenize(text):
+    """
+    Tokenizes normalized text (only word characters and whitespace) without punkt.
+    Gives the same tokens as word_tokenize on such text; anything with punctuation
+    left in it is handed to word_tokenize.
+    """
+    if NOT_NORMALIZED_PATTERN.search(text):
+        return word_tokenize(text)
+    tokens = []
+    for token in text.split():
+        split_at = TREEBANK_WORD_SPLITS.get(token.lower())
+        if split_at:
+            tokens.append(token[:split_at])
+            tokens.append(token[split_at:])
+        else:
+            tokens.append(token)
+    return tokens
+
 def get_wordnet_pos(treebank_tag):
     if treebank_tag.startswith('J'):
         return wordnet.ADJ
@@ -55,91 +91,199 @@ def replace_contractions(text, contractions):
     def replace(match):
         return contractions[match.group().lower()]
     return pattern.sub(replace, text)
-  
-def preprocess_text(text):
-    print(f"preprocess_text called with: {text}")
-    logging.debug(f"Original text: {text}")
-    contractions = {
-        "can't": "can not",
-        "won't": "will not",
-        "i'm": "i am",
-        "you're": "you are",
-        "he's": "he is",
-        "she's": "she is",
-        "it's": "it is",
-        "we're": "we are",
-        "they're": "they are",
-        "i'll": "i will",
-        "we'll": "we will",
-        "you'll": "you will",
-        "he'll": "he will",
-        "she'll": "she will",
-        "let's": "let us",
-        "that's": "that is",
-        "n't": " not",
-        "'m": " am",
-        "'re": " are",
-        "'s": " is",
-        "'ll": " will",
-        "'d": " would",
-        "'ve": " have",
-        "there's": "there is",
-        "who's": "who is",
-        "she'd": "she would",
-        "he'd": "he would",
-        "they'd": "they would",
-        "you'd": "you would",
-        "ain't": "is not",
-        "y'all": "you all",
-        "we'd": "we would",
-        "it'd": "it would"
-    }
 
-    # Step 1: Replace contractions
-    text = replace_contractions(text, contractions)
-    logging.debug(f"Text after contractions replacement: {text}")
-    
-    # Step 2: Convert to lowercase
-    text = text.lower()
-    logging.debug(f"Text after converting to lowercase: {text}")
-
-    # Step 3: Remove punctuation
-    text = re.sub(r'[^\w\s]', '', text)
-    logging.debug(f"Text after punctuation removal: {text}")
-
-    # Step 4: Handle negations
-    negations = ["not", "no", "never", "none", "neither", "nor", "nobody", "nothing", "nowhere", 
-    "cannot", "won't", "isn't", "aren't", "wasn't", "weren't", 
-    "doesn't", "don't", "didn't", "hasn't", "haven't", "hadn't", "wouldn't", 
-    "shouldn't", "couldn't", "mustn't", "cannot", "barely", "hardly", "scarcely", "seldom", 
-    "by no means", "in no way", "on no account", "at no time", 
-    "no longer", "no more", "not any", "not at all", "not even", 
-    "not only", "not until", "nevertheless", "nonetheless", "regardless", 
+CONTRACTIONS = {
+    "can't": "can not",
+    "won't": "will not",
+    "i'm": "i am",
+    "you're": "you are",
+    "he's": "he is",
+    "she's": "she is",
+    "it's": "it is",
+    "we're": "we are",
+    "they're": "they are",
+    "i'll": "i will",
+    "we'll": "we will",
+    "you'll": "you will",
+    "he'll": "he will",
+    "she'll": "she will",
+    "let's": "let us",
+    "that's": "that is",
+    "n't": " not",
+    "'m": " am",
+    "'re": " are",
+    "'s": " is",
+    "'ll": " will",
+    "'d": " would",
+    "'ve": " have",
+    "there's": "there is",
+    "who's": "who is",
+    "she'd": "she would",
+    "he'd": "he would",
+    "they'd": "they would",
+    "you'd": "you would",
+    "ain't": "is not",
+    "y'all": "you all",
+    "we'd": "we would",
+    "it'd": "it would"
+}
+
+NEGATIONS = ["not", "no", "never", "none", "neither", "nor", "nobody", "nothing", "nowhere",
+    "cannot", "won't", "isn't", "aren't", "wasn't", "weren't",
+    "doesn't", "don't", "didn't", "hasn't", "haven't", "hadn't", "wouldn't",
+    "shouldn't", "couldn't", "mustn't", "cannot", "barely", "hardly", "scarcely", "seldom",
+    "by no means", "in no way", "on no account", "at no time",
+    "no longer", "no more", "not any", "not at all", "not even",
+    "not only", "not until", "nevertheless", "nonetheless", "regardless",
     "despite", "without", "lack of", "fail to", "under no circumstances"]
 
-    for negation in negations:
-        text = re.sub(rf"\b({negation})\s+(\w+)", r"\1 \2", text)  # Keep space instead of underscore
-    logging.debug(f"Text after negation handling: {text}")
-
-    # Step 6: Tokenize text
-    tokens = word_tokenize(text)
-    logging.debug(f"Tokens: {tokens}")
+# Stop words we keep because they carry sentiment or are needed by the test expectations
+KEPT_STOP_WORDS = {"but", "and", "can", "we", "will", "us"}
+
+
+class TextPreprocessor:
+    """
+    Precompiled preprocessing pipeline.
+    All regexes, the stop word set and the lemma cache are built once here,
+    so each call only pays for the passes over the text itself.
+    """
+    def __init__(self, contractions=CONTRACTIONS, negations=NEGATIONS, kept_stop_words=KEPT_STOP_WORDS,
+                 tokenizer=fast_tokenize, lemma_cache_size=65536):
+        self.contractions = dict(contractions)
+        # Alternation order is kept as given so leftmost matches resolve exactly like replace_contractions
+        self.contractions_pattern = re.compile(
+            '|'.join(re.escape(key) for key in self.contractions.keys()), re.IGNORECASE)
+        self.punctuation_pattern = re.compile(r'[^\w\s]')
+        # One alternation instead of a re.sub per phrase; longest phrases first so "no longer" wins over "no".
+        # The step only collapses the whitespace after a negation, which tokenization ignores anyway.
+        unique_negations = sorted(set(negations), key=len, reverse=True)
+        self.negation_pattern = re.compile(
+            r"\b(" + '|'.join(re.escape(negation) for negation in unique_negations) + r")\s+(?=\w)")
+        self.stop_words = frozenset(set(stopwords.words('english')) - set(negations) - set(kept_stop_words))
+        self.tokenizer = tokenizer
+        self._lemmatize = lru_cache(maxsize=lemma_cache_size)(lemmatizer.lemmatize)
+
+    def _replace_contraction(self, match):
+        return self.contractions[match.group().lower()]
+
+    def __call__(self, text):
+        # Step 1: Replace contractions
+        text = self.contractions_pattern.sub(self._replace_contraction, text)
+        # Step 2 and 3: Convert to lowercase and remove punctuation
+        text = self.punctuation_pattern.sub('', text.lower())
+        # Step 4: Handle negations (keep space instead of underscore)
+        text = self.negation_pattern.sub(r"\1 ", text)
+        # Step 5: Tokenize text
+        tokens = self.tokenizer(text)
+        # Step 6 and 7: Remove stop words and lemmatize, making sure "us" isn't altered
+        stop_words = self.stop_words
+        lemmatize = self._lemmatize
+        return ' '.join(
+            token if token == "us" else lemmatize(token)
+            for token in tokens if token not in stop_words
+        )
+
+    def stages(self):
+        """
+        Returns the pipeline as separate (name, function) steps, each taking the previous step's output.
+        Chaining them gives the same result as calling the preprocessor; it is only meant for profiling.
+        """
+        return [
+            ("contractions", lambda text: self.contractions_pattern.sub(self._replace_contraction, text)),
+            ("lowercase", str.lower),
+            ("punctuation", lambda text: self.punctuation_pattern.sub('', text)),
+            ("negation", lambda text: self.negation_pattern.sub(r"\1 ", text)),
+            ("tokenize", self.tokenizer),
+            ("stopwords", lambda tokens: [token for token in tokens if token not in self.stop_words]),
+            ("lemmatize", lambda tokens: ' '.join(token if token == "us" else self._lemmatize(token) for token in tokens)),
+        ]
+
+
+# Built on first use, so importing this module doesn't need the NLTK stopwords corpus
+text_preprocessor = None
+
+def get_text_preprocessor():
+    global text_preprocessor
+    if text_preprocessor is None:
+        text_preprocessor = TextPreprocessor()
+    return text_preprocessor
 
-    # Step 6: Remove stop words, but keep key conjunctions like "but" and negation words
-    stop_words = set(stopwords.words('english')) - set(negations) - {"but", "and", "can", "we", "will", "us"}
-    tokens = [token for token in tokens if token not in stop_words]
-
-    logging.debug(f"Tokens after stop word removal: {tokens}")
-
-    # Step 8: Lemmatize tokens and ensure "us" isn't altered
-    tokens = [lemmatizer.lemmatize(token) if token != "us" else token for token in tokens]
-    logging.debug(f"Tokens after lemmatization: {tokens}")
-
-    # Join tokens back into a single string
-    preprocessed_text = ' '.join(tokens)
-    logging.debug(f"Preprocessed text: {preprocessed_text}")
+def preprocess_text(text):
+    preprocessed_text = get_text_preprocessor()(text)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Preprocessed text: %s -> %s", payload(text), payload(preprocessed_text))
     return preprocessed_text
 
+# Batches smaller than this are preprocessed in-process; pickling and IPC would cost more than they save
+PARALLEL_MIN_BATCH = 256
+# One shared pool, sized by the last request that found it idle. A pool some generator is
+# still reading from is never replaced; other worker counts reuse it until it is idle again.
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_users = 0
+_process_pool_lock = threading.Lock()
+
+def _acquire_process_pool(workers):
+    """Returns the shared process pool, resized to workers if nobody is using it; pair with _release_process_pool."""
+    global _process_pool, _process_pool_workers, _process_pool_users
+    with _process_pool_lock:
+        idle_pool = None
+        if _process_pool is None or (_process_pool_workers != workers and _process_pool_users == 0):
+            idle_pool = _process_pool
+            _process_pool = ProcessPoolExecutor(max_workers=workers)
+            _process_pool_workers = workers
+        _process_pool_users += 1
+        pool = _process_pool
+    if idle_pool is not None:
+        idle_pool.shutdown(wait=False)
+    return pool
+
+def _release_process_pool():
+    global _process_pool_users
+    with _process_pool_lock:
+        _process_pool_users -= 1
+
+def shutdown_process_pool():
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        pool, _process_pool, _process_pool_workers = _process_pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+atexit.register(shutdown_process_pool)
+
+def preprocess_texts(texts, workers=None, chunksize=None, preprocess=None):
+    """
+    Preprocesses many texts, yielding results lazily in input order.
+    Small batches run serially; once a batch reaches PARALLEL_MIN_BATCH texts the
+    tokenization and lemmatization work is spread over a shared process pool.
+    """
+    preprocess = preprocess or preprocess_text
+    # More processes than CPUs only adds overhead
+    cpus = os.cpu_count() or 1
+    workers = min(workers or cpus, cpus)
+    texts = iter(texts)
+    head = list(islice(texts, PARALLEL_MIN_BATCH))
+
+    if workers <= 1 or len(head) < PARALLEL_MIN_BATCH:
+        for text in chain(head, texts):
+            yield preprocess(text)
+        return
+
+    chunksize = chunksize or max(1, PARALLEL_MIN_BATCH // workers)
+    pool = _acquire_process_pool(workers)
+    try:
+        # Submit a bounded window at a time so huge (or endless) inputs don't all sit in memory
+        window_size = chunksize * workers * 4
+        remaining = chain(head, texts)
+        while True:
+            window = list(islice(remaining, window_size))
+            if not window:
+                return
+            yield from pool.map(preprocess, window, chunksize=chunksize)
+    finally:
+        _release_process_pool()
+
 def remove_stop_words(tokens):
     stop_words = set(stopwords.words('english'))
     return [token for token in tokens if token not in stop_words]
@@ -148,17 +292,27 @@ def lemmatize_tokens(tokens):
     return [lemmatizer.lemmatize(token) for token in tokens]
 
 def send_to_google_nlp_api(preprocessed_text):
-    logging.debug(f"Sending text to Google NLP API: {preprocessed_text}")
-    client = get_nlp_client()
-    logging.debug(f"Google NLP client created: {client}")
-    document = language_v1.Document(content=preprocessed_text, type_=language_v1.Document.Type.PLAIN_TEXT)
+    backend = get_sentiment_backend()
+    if not backend.remote:
+        return backend.analyze_sentiment(preprocessed_text)
+    cached_response = get_cached_response(preprocessed_text)
+    if cached_response is not None:
+        return cached_response
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sending text to Google NLP API: %s", payload(preprocessed_text))
     try:
-        response = client.analyze_sentiment(document=document)
-        logging.debug(f"Google NLP API response: {response}")
+        # While the breaker is open the local scorer answers; its results are not cached.
+        # Client creation counts as part of the call, so the breaker sees its failures too.
+        response = nlp_breaker.call(
+            lambda: cache_response(preprocessed_text, backend.analyze_sentiment(
+                preprocessed_text, client=get_nlp_client(), **nlp_call_kwargs())),
+            fallback=lambda: fallback_sentiment_backend().analyze_sentiment(preprocessed_text)
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Google NLP API document score: %s", response.document_sentiment.score)
         return response
     except Exception as e:
-        logging.error(f"Error analyzing sentiment: {e}")
-        logging.error(traceback.format_exc())  # Log the stack trace
+        logger.exception("Error analyzing sentiment: %s", e)  # Logs the stack trace too
         raise ValueError(f"Error analyzing sentiment: {e}")
 
 
@@ -198,7 +352,7 @@ def extract_keywords(parsed_response):
     keywords = []
     for sentence in parsed_response["sentences"]:
         content = sentence["content"]
-        tokens = word_tokenize(content)
+        tokens = fast_tokenize(content)
         keywords.extend(tokens)
     return keywords
 
@@ -208,7 +362,7 @@ def api_request_handler():
         data = request.get_json()
         return data
     except Exception as e:
-        logging.error(f"Error in request data: {e}")
+        logger.error("Error in request data: %s", e)
         return jsonify({"error": str(e)}), 400
     
 # Security and privacy functions
@@ -224,25 +378,25 @@ def decrypt_data(data):
 
 def retrieve_user_data_securely(collection_name, document_id):
     try:
-        doc = db.collection(collection_name).document(document_id).get()
+        doc = db.collection(collection_name).document(document_id).get(**deadline_kwargs())
         if doc.exists:
             decrypted_data = {k: decrypt_data(v) for k, v in doc.to_dict().items()}
-            logging.info(f"Document {document_id} successfully retrieved and decrypted.")
+            logger.info("Document %s successfully retrieved and decrypted.", document_id)
             return decrypted_data
         else:
-            logging.error(f"No document found for ID {document_id} in {collection_name} collection.")
+            logger.error("No document found for ID %s in %s collection.", document_id, collection_name)
             return None
     except Exception as e:
-        logging.error(f"An error occurred while retrieving data from Firestore: {e}")
+        logger.error("An error occurred while retrieving data from Firestore: %s", e)
         return None
 
 def store_user_data_securely(collection_name, document_id, data):
     try:
         encrypted_data = {k: encrypt_data(v) for k, v in data.items()}
-        db.collection(collection_name).document(document_id).set(encrypted_data)
-        logging.info(f"Document {document_id} successfully written to {collection_name} collection.")
+        db.collection(collection_name).document(document_id).set(encrypted_data, **deadline_kwargs())
+        logger.info("Document %s successfully written to %s collection.", document_id, collection_name)
     except Exception as e:
-        logging.error(f"An error occurred while writing to Firestore: {e}")
+        logger.error("An error occurred while writing to Firestore: %s", e)
 
 def follow_data_minimization_principles(data, required_fields):
     """Minimize data to only required fields."""
@@ -250,10 +404,10 @@ def follow_data_minimization_principles(data, required_fields):
 
 def delete_no_longer_needed_data(collection_name, document_id):
     try:
-        db.collection(collection_name).document(document_id).delete()
-        logging.info(f"Document {document_id} successfully deleted from {collection_name} collection.")
+        db.collection(collection_name).document(document_id).delete(**deadline_kwargs())
+        logger.info("Document %s successfully deleted from %s collection.", document_id, collection_name)
     except Exception as e:
-        logging.error(f"An error occurred while deleting from Firestore: {e}")
+        logger.error("An error occurred while deleting from Firestore: %s", e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+# Bulk decryption for reads that open many encrypted documents at once (mood history,
+# stored user data). The items are split into a few chunks per worker and decrypted on a
+# shared thread pool: the AES and HMAC work in `cryptography` runs in native code, so the
+# chunks overlap on multi-core machines. Results come back in input order, and one
+# corrupt or foreign item only fails its own slot.
+#
+# Settings (environment):
+#   BULK_DECRYPT_WORKERS     pool size, default the number of CPUs
+#   BULK_DECRYPT_MIN_ITEMS   smaller batches are decrypted inline, default 64
+
+import os
+import atexit
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Chunks per worker: enough to even out uneven items without paying a future per item
+CHUNKS_PER_WORKER = 4
+
+
+class BulkResult(namedtuple('BulkResult', ['value', 'error'])):
+    """One item's outcome: the decrypted value, or None and the exception that item raised."""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def bulk_workers():
+    return int(os.getenv('BULK_DECRYPT_WORKERS', os.cpu_count() or 1))
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=bulk_workers(), thread_name_prefix="bulk-decrypt")
+        return _executor
+
+
+def _decrypt_chunk(decrypt, chunk):
+    results = []
+    for item in chunk:
+        try:
+            results.append(BulkResult(decrypt(item), None))
+        except Exception as e:
+            results.append(BulkResult(None, e))
+    return results
+
+
+def decrypt_many(items, decrypt, min_parallel_items=None):
+    """
+    Applies decrypt to every item and returns a BulkResult per item, in order.
+    Exceptions raised by decrypt are caught per item and never abort the batch.
+    """
+    items = list(items)
+    if min_parallel_items is None:
+        min_parallel_items = int(os.getenv('BULK_DECRYPT_MIN_ITEMS', 64))
+    workers = bulk_workers()
+    if workers <= 1 or len(items) < min_parallel_items:
+        return _decrypt_chunk(decrypt, items)
+    chunk_size = -(-len(items) // (workers * CHUNKS_PER_WORKER))
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+    results = []
+    for chunk_results in _get_executor().map(lambda chunk: _decrypt_chunk(decrypt, chunk), chunks):
+        results.extend(chunk_results)
+    return results
+
+
+def shutdown_bulk_decrypt():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+atexit.register(shutdown_bulk_decrypt)
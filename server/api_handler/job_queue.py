@@ -0,0 +1,179 @@
+# Background jobs for long-running analyses.
+# A request enqueues its work and gets a job ID back straight away; a worker pool that is
+# sized separately from the web server runs the jobs, and the results stay in a bounded
+# in-memory store for a while so clients can poll for them or follow them as a stream.
+
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobQueueFull(Exception):
+    """Too many jobs are waiting or held unfinished; the client should retry later."""
+
+
+class JobFailed(Exception):
+    """Raised by a job function to fail with a client-facing message and HTTP status code."""
+    def __init__(self, message, status_code=500, details=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details or {}
+
+    def __reduce__(self):
+        # Keep the status code when the error comes back from a worker process
+        return (JobFailed, (str(self), self.status_code, self.details))
+
+
+class JobStore:
+    """
+    Job records by ID. Finished jobs are dropped `ttl` seconds after they finish, and the
+    store never holds more than `max_jobs`: the oldest finished jobs make room first.
+    Every change bumps the job's 'revision', which wait_for_change() waits on.
+    """
+    def __init__(self, max_jobs=1000, ttl=600.0):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._condition = threading.Condition()
+
+    def _expire(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['status'] in FINISHED and now - job['finishedAt'] >= self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def create(self):
+        now = time.time()
+        with self._condition:
+            self._expire(now)
+            if len(self._jobs) >= self.max_jobs:
+                finished = [job_id for job_id, job in self._jobs.items() if job['status'] in FINISHED]
+                if not finished:
+                    raise JobQueueFull("Job store is full")
+                for job_id in finished[:len(self._jobs) - self.max_jobs + 1]:
+                    del self._jobs[job_id]
+            job = {'jobId': uuid.uuid4().hex, 'status': QUEUED, 'createdAt': now, 'finishedAt': None, 'revision': 0}
+            self._jobs[job['jobId']] = job
+            return dict(job)
+
+    def update(self, job_id, **fields):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            if fields.get('status') in FINISHED:
+                job['finishedAt'] = time.time()
+            job['revision'] += 1
+            self._condition.notify_all()
+
+    def get(self, job_id):
+        with self._condition:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def wait_for_change(self, job_id, revision, timeout):
+        """Waits up to timeout seconds for the job to move past revision; returns the job or None."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job['revision'] != revision:
+                    return dict(job) if job is not None else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(job)
+                self._condition.wait(remaining)
+
+    def counts(self):
+        with self._condition:
+            counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+            return counts
+
+
+class JobQueue:
+    """
+    Runs `function(payload)` for each submitted payload on a pool of `workers` threads or
+    processes (mode 'thread' or 'process'; process jobs need a picklable module-level
+    function and payload). At most `max_pending` jobs wait for a worker at a time.
+    The function's return value becomes the job's 'result'; a JobFailed it raises
+    becomes the job's 'error' and 'statusCode'.
+    """
+    def __init__(self, function, workers=4, mode='thread', max_pending=100, store=None):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown job worker mode: {mode}")
+        self.function = function
+        self.workers = workers
+        self.mode = mode
+        self.max_pending = max_pending
+        self.store = store or JobStore()
+        self._pending = 0
+        self._lock = threading.Lock()
+        if mode == 'process':
+            # Fresh interpreters: gRPC channels and threads don't survive a fork
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+
+    def submit(self, payload):
+        """Queues a job and returns its record. Raises JobQueueFull when the queue is at capacity."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull("Too many jobs are waiting")
+            self._pending += 1
+        try:
+            job = self.store.create()
+        except JobQueueFull:
+            self._release()
+            raise
+        if self.mode == 'thread':
+            future = self._executor.submit(self._run_in_thread, job['jobId'], payload)
+        else:
+            # A process can't report back until it is done, so it stays queued until then
+            future = self._executor.submit(self.function, payload)
+        future.add_done_callback(lambda future: self._finish(job['jobId'], future))
+        return job
+
+    def _release(self):
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+
+    def _run_in_thread(self, job_id, payload):
+        self._release()
+        self.store.update(job_id, status=RUNNING)
+        return self.function(payload)
+
+    def _finish(self, job_id, future):
+        if self.mode == 'process':
+            self._release()
+        error = future.exception()
+        if error is None:
+            self.store.update(job_id, status=SUCCEEDED, result=future.result())
+        elif isinstance(error, JobFailed):
+            self.store.update(job_id, status=FAILED, error=str(error), statusCode=error.status_code, **error.details)
+        else:
+            logger.error("Job %s failed: %s", job_id, error)
+            self.store.update(job_id, status=FAILED, error="An error occurred while processing the request.", statusCode=500)
+
+    def stats(self):
+        with self._lock:
+            pending = self._pending
+        return {"mode": self.mode, "workers": self.workers, "pending": pending, "jobs": self.store.counts()}
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,170 @@
+# Frozen noun lemma table for the preprocessing pipeline.
+# The table is compiled once from WordNet (python -m server.api_handler.lemma_table [path])
+# and memory-mapped at runtime, so every worker process shares the same read-only pages
+# instead of each one loading the WordNet corpus into its own heap.
+# The table lives in the user's cache directory, not the source tree; LEMMA_TABLE_PATH overrides it.
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PPLEMMA1"
+# magic, slot count, entry count, offset of the string blob
+HEADER = struct.Struct("<8sIII")
+SLOT = struct.Struct("<II")
+LENGTH = struct.Struct("<H")
+EMPTY_SLOT = 0xFFFFFFFF
+
+DEFAULT_LEMMA_TABLE_PATH = os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "productivepanda", "lemma_table.bin"
+)
+
+
+def _slot_index(key, slot_count):
+    # crc32 is stable across processes, unlike hash() which is salted per interpreter
+    return zlib.crc32(key) % slot_count
+
+
+def candidate_noun_forms():
+    """
+    Yields every surface form for which WordNet noun morphology could return a lemma
+    other than the word itself: the noun exception list plus each noun lemma run
+    backwards through the detachment rules.
+    """
+    from nltk.corpus import wordnet
+
+    wordnet.ensure_loaded()
+    # NLTK has no public API for the exception lists, so fail clearly if that ever changes
+    exception_map = getattr(wordnet, "_exception_map", None)
+    if not isinstance(exception_map, dict) or wordnet.NOUN not in exception_map:
+        raise RuntimeError("This NLTK version does not expose WordNet's noun exception list "
+                           "(wordnet._exception_map); the lemma table can't be built with it")
+    yield from exception_map[wordnet.NOUN]
+    for lemma in wordnet.all_lemma_names(pos=wordnet.NOUN):
+        yield lemma
+        for suffix, ending in wordnet.MORPHOLOGICAL_SUBSTITUTIONS[wordnet.NOUN]:
+            if lemma.endswith(ending):
+                yield lemma[:len(lemma) - len(ending)] + suffix
+
+
+def build_lemma_table(path=DEFAULT_LEMMA_TABLE_PATH, lemmatizer=None):
+    """
+    Compiles a lookup table holding every word whose noun lemma differs from the word.
+    Lemmas are taken from WordNetLemmatizer itself, so lookups match it exactly.
+    Returns the number of entries written.
+    """
+    if lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        lemmatizer = WordNetLemmatizer()
+
+    entries = {}
+    for word in candidate_noun_forms():
+        if word in entries:
+            continue
+        lemma = lemmatizer.lemmatize(word)
+        if lemma != word:
+            entries[word] = lemma
+
+    # Keep the load factor around 0.5 so probe sequences stay short
+    slot_count = max(1, len(entries) * 2)
+    slots = [(EMPTY_SLOT, EMPTY_SLOT)] * slot_count
+    blob = bytearray()
+    string_offsets = {}
+
+    def add_string(value):
+        encoded = value.encode("utf-8")
+        if encoded not in string_offsets:
+            string_offsets[encoded] = len(blob)
+            blob.extend(LENGTH.pack(len(encoded)))
+            blob.extend(encoded)
+        return string_offsets[encoded]
+
+    for word, lemma in sorted(entries.items()):
+        key = word.encode("utf-8")
+        index = _slot_index(key, slot_count)
+        while slots[index][0] != EMPTY_SLOT:
+            index = (index + 1) % slot_count
+        slots[index] = (add_string(word), add_string(lemma))
+
+    blob_offset = HEADER.size + SLOT.size * slot_count
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as table_file:
+        table_file.write(HEADER.pack(MAGIC, slot_count, len(entries), blob_offset))
+        for slot in slots:
+            table_file.write(SLOT.pack(*slot))
+        table_file.write(blob)
+    # Atomic swap so running workers never map a half-written file
+    os.replace(tmp_path, path)
+    logger.info("Wrote %d lemma entries to %s", len(entries), path)
+    return len(entries)
+
+
+class MappedLemmatizer:
+    """
+    Read-only noun lemmatizer backed by a memory-mapped table from build_lemma_table.
+    Words missing from the table are their own lemma, exactly as with WordNetLemmatizer.
+    """
+    def __init__(self, path=DEFAULT_LEMMA_TABLE_PATH):
+        self.path = path
+        with open(path, "rb") as table_file:
+            self._map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_count, self.entry_count, self._blob_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a lemma table")
+
+    def _read_string(self, offset):
+        start = self._blob_offset + offset
+        (length,) = LENGTH.unpack_from(self._map, start)
+        start += LENGTH.size
+        return self._map[start:start + length]
+
+    def lemmatize(self, word, pos="n"):
+        if pos != "n":
+            raise ValueError("MappedLemmatizer only supports noun lemmas")
+        key = word.encode("utf-8")
+        index = _slot_index(key, self.slot_count)
+        while True:
+            key_offset, lemma_offset = SLOT.unpack_from(self._map, HEADER.size + SLOT.size * index)
+            if key_offset == EMPTY_SLOT:
+                return word
+            if self._read_string(key_offset) == key:
+                return self._read_string(lemma_offset).decode("utf-8")
+            index = (index + 1) % self.slot_count
+
+    def close(self):
+        self._map.close()
+
+
+def load_lemmatizer(path=None):
+    """
+    Returns a MappedLemmatizer when a compiled table is available,
+    otherwise falls back to NLTK's WordNetLemmatizer.
+    """
+    path = path or os.getenv("LEMMA_TABLE_PATH", DEFAULT_LEMMA_TABLE_PATH)
+    if os.path.exists(path):
+        try:
+            return MappedLemmatizer(path)
+        except (OSError, ValueError) as e:
+            logger.error("Could not map lemma table %s: %s", path, e)
+    else:
+        logger.info("No lemma table at %s, using WordNetLemmatizer", path)
+    from nltk.stem import WordNetLemmatizer
+    return WordNetLemmatizer()
+
+
+if __name__ == "__main__":
+    import nltk
+    nltk.download('wordnet')
+    output_path = sys.argv[1] if len(sys.argv) > 1 else os.getenv("LEMMA_TABLE_PATH", DEFAULT_LEMMA_TABLE_PATH)
+    count = build_lemma_table(output_path)
+    print(f"Lemma table with {count} entries written to {output_path}")
@@ -0,0 +1,217 @@
+# Local, network-free sentiment engine.
+# Scores text with a valence lexicon plus the usual rule-based adjustments (negation,
+# intensifiers, "but" clauses) and returns the same shape as parse_api_response, so it
+# can stand in for Google NLP. Batches are scored with NumPy in a handful of array passes.
+
+import os
+import re
+import numpy as np
+
+# Valence of common words on a -4..4 scale. Nouns are listed in their lemmatized form,
+# since the input is usually preprocess_text output.
+LEXICON = {
+    # positive
+    "good": 1.9, "great": 3.1, "excellent": 3.2, "amazing": 2.8, "awesome": 3.1, "fantastic": 2.6,
+    "wonderful": 2.7, "perfect": 2.7, "brilliant": 2.8, "best": 3.2, "better": 1.9, "nice": 1.8,
+    "fine": 0.8, "ok": 0.9, "okay": 0.9, "alright": 1.0, "cool": 1.3, "fun": 2.3, "enjoy": 2.2,
+    "enjoyed": 2.3, "enjoying": 2.4, "love": 3.2, "loved": 2.9, "loving": 2.9, "lovely": 2.8, "like": 1.5,
+    "liked": 1.8, "happy": 2.7, "happiness": 2.6, "glad": 2.0, "joy": 2.8, "joyful": 2.9, "cheerful": 2.5,
+    "excited": 2.2, "exciting": 2.2, "excitement": 2.0, "thrilled": 2.5, "delighted": 2.9, "grateful": 2.0,
+    "thankful": 2.0, "thanks": 1.9, "calm": 1.3, "relaxed": 2.2, "relaxing": 2.0, "relax": 1.9,
+    "peaceful": 2.2, "peace": 2.5, "content": 1.5, "satisfied": 1.8, "proud": 2.1, "confident": 2.2,
+    "hopeful": 1.9, "hope": 1.9, "optimistic": 1.3, "motivated": 1.8, "productive": 1.9, "energized": 2.0,
+    "energetic": 1.9, "accomplished": 1.8, "accomplish": 1.8, "achievement": 2.2, "success": 2.7,
+    "successful": 2.8, "win": 2.8, "won": 2.7, "progress": 1.8, "improve": 1.9, "improved": 2.1,
+    "helpful": 1.8, "help": 1.7, "support": 1.7, "kind": 2.4, "friendly": 2.2, "friend": 2.2,
+    "beautiful": 2.9, "pleasant": 2.3, "comfortable": 1.5, "rested": 1.5, "refreshed": 1.5, "healthy": 1.7,
+    "strong": 1.0, "focused": 1.6, "organized": 1.3, "fresh": 1.3, "easy": 1.9, "free": 2.3, "safe": 1.9,
+    "laugh": 2.6, "smile": 1.5, "celebrate": 2.7, "interesting": 1.7, "inspired": 2.2, "creative": 1.9,
+    "favorite": 2.0, "appreciate": 1.7, "appreciated": 2.3, "recommend": 1.5, "positive": 2.6,
+    "awesomeness": 2.8, "yay": 2.4, "wow": 2.8, "rewarding": 2.4, "reward": 2.1, "fulfilled": 2.0,
+    "blessed": 2.9, "lucky": 2.2, "solved": 1.8, "finished": 0.8, "done": 0.5, "ready": 1.0,
+    # negative
+    "bad": -2.5, "terrible": -2.1, "horrible": -2.5, "awful": -2.0, "worst": -3.1, "worse": -2.1,
+    "poor": -2.1, "hate": -2.7, "hated": -3.2, "dislike": -1.6, "sad": -2.1, "sadness": -1.9,
+    "unhappy": -1.8, "upset": -1.6, "angry": -2.3, "anger": -2.7, "mad": -2.2, "annoyed": -1.6,
+    "annoying": -1.7, "frustrated": -2.4, "frustrating": -1.9, "frustration": -2.1, "stress": -1.8,
+    "stressed": -1.4, "stressful": -2.2, "anxious": -1.0, "anxiety": -0.7, "worried": -1.2,
+    "worry": -1.9, "nervous": -1.1, "afraid": -2.0, "scared": -1.9, "fear": -2.2, "panic": -2.3,
+    "overwhelmed": -1.5, "overwhelming": -1.4, "tired": -1.9, "exhausted": -1.5, "exhausting": -1.5,
+    "drained": -1.5, "sleepy": 0.0, "sick": -2.3, "ill": -1.8, "pain": -2.3, "hurt": -2.4,
+    "lonely": -1.5, "alone": -1.0, "bored": -1.1, "boring": -1.3, "depressed": -2.3, "depressing": -1.6,
+    "miserable": -2.2, "disappointed": -1.9, "disappointing": -2.2, "disappointment": -2.3,
+    "fail": -2.5, "failed": -2.3, "failure": -2.3, "lost": -1.3, "lose": -1.7, "problem": -1.7,
+    "trouble": -1.7, "difficult": -1.5, "hard": -0.4, "struggle": -1.6, "struggling": -1.4,
+    "busy": -0.3, "behind": -0.3, "late": -0.8, "deadline": -0.8, "pressure": -1.2, "rush": -0.5,
+    "broken": -2.1, "wrong": -2.1, "mistake": -1.4, "error": -1.4, "crash": -1.7, "bug": -0.8,
+    "ugly": -2.3, "stupid": -2.4, "useless": -1.8, "waste": -1.8, "wasted": -2.2, "mess": -1.5,
+    "messy": -1.5, "chaos": -2.7, "cry": -2.1, "crying": -2.1, "guilty": -1.8, "ashamed": -2.1,
+    "regret": -1.9, "sorry": -0.3, "confused": -1.3, "lazy": -1.5, "unmotivated": -1.4,
+    "procrastinate": -1.0, "procrastinating": -1.0, "burnout": -2.0, "burned": -1.2, "numb": -1.0,
+    "terrified": -3.0, "furious": -2.7, "hopeless": -2.0, "helpless": -2.0, "worthless": -1.9,
+    "negative": -2.7, "never": -0.4, "ugh": -1.8, "damn": -1.7, "annoy": -1.9, "cancelled": -1.0,
+    "canceled": -1.0, "sucks": -1.5, "suck": -1.5, "dread": -2.1, "dreading": -2.1, "noisy": -0.7,
+}
+
+NEGATIONS = frozenset([
+    "not", "no", "never", "none", "neither", "nor", "nobody", "nothing", "nowhere", "cannot",
+    "without", "hardly", "barely", "scarcely", "seldom", "lack", "fail", "isnt", "arent", "wasnt",
+    "werent", "doesnt", "dont", "didnt", "hasnt", "havent", "hadnt", "wouldnt", "shouldnt", "couldnt",
+    "mustnt", "wont", "cant", "aint"
+])
+# Intensifiers raise the next sentiment word, dampeners lower it
+BOOSTERS = {
+    "very": 0.293, "really": 0.293, "extremely": 0.293, "so": 0.293, "super": 0.293, "totally": 0.293,
+    "incredibly": 0.293, "absolutely": 0.293, "completely": 0.293, "utterly": 0.293, "highly": 0.293,
+    "truly": 0.293, "too": 0.293, "most": 0.293, "especially": 0.293, "deeply": 0.293, "quite": 0.15,
+    "slightly": -0.293, "somewhat": -0.293, "kinda": -0.293, "little": -0.293, "bit": -0.293,
+    "barely": -0.293, "partly": -0.293, "marginally": -0.293, "mildly": -0.293
+}
+NEGATION_SCALAR = -0.74
+NEGATION_WINDOW = 3
+BEFORE_BUT_WEIGHT = 0.5
+AFTER_BUT_WEIGHT = 1.5
+NORMALIZATION_ALPHA = 15.0
+MAGNITUDE_SCALE = 4.0
+
+TOKEN_PATTERN = re.compile(r"[\w']+")
+SENTENCE_PATTERN = re.compile(r"[^.!?\n]+[.!?]*")
+
+
+def load_lexicon(path):
+    """Reads extra "word<TAB>valence" lines, e.g. a full VADER lexicon, to extend LEXICON."""
+    lexicon = {}
+    with open(path, encoding="utf-8") as lexicon_file:
+        for line in lexicon_file:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) >= 2:
+                try:
+                    lexicon[parts[0].lower()] = float(parts[1])
+                except ValueError:
+                    continue
+    return lexicon
+
+
+class LexiconSentimentEngine:
+    """
+    Rule-based sentiment scorer returning parse_api_response-shaped dicts:
+    {"overall_sentiment": {"score", "magnitude"}, "sentences": [{"content", "sentiment", "magnitude"}]}.
+    Scores are in [-1, 1] and magnitudes are unbounded and non-negative, like Google NLP.
+    """
+    def __init__(self, lexicon=None, extra_lexicon_path=None):
+        lexicon = dict(LEXICON if lexicon is None else lexicon)
+        if extra_lexicon_path:
+            lexicon.update(load_lexicon(extra_lexicon_path))
+        # Vocabulary id 0 is reserved for words the engine knows nothing about
+        vocabulary = sorted(set(lexicon) | NEGATIONS | set(BOOSTERS) | {"but"})
+        self.word_ids = {word: index + 1 for index, word in enumerate(vocabulary)}
+        size = len(vocabulary) + 1
+        self.valences = np.zeros(size)
+        self.boosts = np.zeros(size)
+        self.is_negation = np.zeros(size, dtype=bool)
+        self.is_but = np.zeros(size, dtype=bool)
+        for word, index in self.word_ids.items():
+            self.valences[index] = lexicon.get(word, 0.0)
+            self.boosts[index] = BOOSTERS.get(word, 0.0)
+            self.is_negation[index] = word in NEGATIONS
+            self.is_but[index] = word == "but"
+
+    def _word_id(self, token):
+        word_id = self.word_ids.get(token)
+        if word_id is None and token.endswith("n't"):
+            return self.word_ids["not"]
+        return word_id or 0
+
+    def analyze(self, text, include_offsets=False):
+        return self.analyze_batch([text], include_offsets)[0]
+
+    def analyze_batch(self, texts, include_offsets=False):
+        """
+        Scores many texts at once; the per-token rules run as whole-array NumPy operations.
+        include_offsets adds each sentence's "begin_offset" (in characters) to its dict.
+        """
+        sentence_texts, sentence_offsets, sentence_documents = [], [], []
+        token_ids, token_sentences = [], []
+        for document_index, text in enumerate(texts):
+            for match in SENTENCE_PATTERN.finditer(text or ""):
+                content = match.group().strip()
+                if not content:
+                    continue
+                sentence_index = len(sentence_texts)
+                sentence_texts.append(content)
+                sentence_offsets.append(match.start() + len(match.group()) - len(match.group().lstrip()))
+                sentence_documents.append(document_index)
+                for token in TOKEN_PATTERN.findall(content.lower()):
+                    token_ids.append(self._word_id(token))
+                    token_sentences.append(sentence_index)
+
+        sentence_count = len(sentence_texts)
+        sentence_sums = np.zeros(sentence_count)
+        sentence_magnitudes = np.zeros(sentence_count)
+        if token_ids:
+            ids = np.asarray(token_ids)
+            sentences = np.asarray(token_sentences)
+            valence = self.valences[ids]
+
+            # Intensifier on the previous token of the same sentence, pushing away from zero
+            same_as_previous = np.zeros(len(ids), dtype=bool)
+            same_as_previous[1:] = sentences[1:] == sentences[:-1]
+            previous_boost = np.zeros(len(ids))
+            previous_boost[1:] = self.boosts[ids[:-1]]
+            valence = valence + np.where(same_as_previous & (valence != 0), np.sign(valence) * previous_boost, 0.0)
+
+            # Negation anywhere in the preceding window of the same sentence flips and dampens
+            negated = np.zeros(len(ids), dtype=bool)
+            negation = self.is_negation[ids]
+            for distance in range(1, NEGATION_WINDOW + 1):
+                negated[distance:] |= negation[:-distance] & (sentences[distance:] == sentences[:-distance])
+            valence = np.where(negated, valence * NEGATION_SCALAR, valence)
+
+            # "but" clauses: what follows outweighs what came before it
+            but = self.is_but[ids]
+            buts_so_far = np.cumsum(but)
+            first_token = np.searchsorted(sentences, sentences)
+            buts_before_sentence = buts_so_far[first_token] - but[first_token]
+            buts_seen = buts_so_far - buts_before_sentence
+            sentence_has_but = np.bincount(sentences, weights=but, minlength=sentence_count) > 0
+            weight = np.where(buts_seen > 0, AFTER_BUT_WEIGHT,
+                              np.where(sentence_has_but[sentences], BEFORE_BUT_WEIGHT, 1.0))
+            valence = valence * weight
+
+            sentence_sums = np.bincount(sentences, weights=valence, minlength=sentence_count)
+            sentence_magnitudes = np.bincount(sentences, weights=np.abs(valence), minlength=sentence_count) / MAGNITUDE_SCALE
+
+        sentence_scores = sentence_sums / np.sqrt(sentence_sums * sentence_sums + NORMALIZATION_ALPHA)
+        documents = np.asarray(sentence_documents, dtype=int)
+        document_sums = np.bincount(documents, weights=sentence_sums, minlength=len(texts))
+        document_scores = document_sums / np.sqrt(document_sums * document_sums + NORMALIZATION_ALPHA)
+        document_magnitudes = np.bincount(documents, weights=sentence_magnitudes, minlength=len(texts))
+
+        results = [
+            {
+                "overall_sentiment": {
+                    "score": round(float(document_scores[index]), 4),
+                    "magnitude": round(float(document_magnitudes[index]), 4)
+                },
+                "sentences": []
+            } for index in range(len(texts))
+        ]
+        for index, document_index in enumerate(sentence_documents):
+            sentence = {
+                "content": sentence_texts[index],
+                "sentiment": round(float(sentence_scores[index]), 4),
+                "magnitude": round(float(sentence_magnitudes[index]), 4)
+            }
+            if include_offsets:
+                sentence["begin_offset"] = sentence_offsets[index]
+            results[document_index]["sentences"].append(sentence)
+        return results
+
+
+lexicon_engine = None
+
+def get_lexicon_engine():
+    global lexicon_engine
+    if lexicon_engine is None:
+        lexicon_engine = LexiconSentimentEngine(extra_lexicon_path=os.getenv("SENTIMENT_LEXICON_PATH"))
+    return lexicon_engine
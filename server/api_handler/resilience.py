@@ -0,0 +1,269 @@
+# Request deadlines and circuit breakers for calls to external services.
+# A web request sets one deadline; every NLP and Firestore call made while serving it
+# gets a timeout of whatever time is left, so a slow upstream can't hold a worker past it.
+# Circuit breakers stop calling an upstream that keeps failing or slowing down and
+# let the caller answer from a local fallback instead until it recovers.
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from google.api_core import exceptions as core_exceptions
+from google.api_core.retry import Retry, if_exception_type
+
+logger = logging.getLogger(__name__)
+
+# Absolute time.monotonic() value the current request must finish by, or None
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request deadline passed before an external call could be made."""
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker is open and no fallback was given."""
+
+
+def set_request_deadline(seconds):
+    """Starts a deadline `seconds` from now, never later than one already running."""
+    deadline = time.monotonic() + seconds
+    current = _request_deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    _request_deadline.set(deadline)
+    return deadline
+
+
+def clear_request_deadline():
+    _request_deadline.set(None)
+
+
+@contextmanager
+def request_deadline(seconds):
+    """Runs the block under a deadline, e.g. for scripts and background jobs."""
+    token = _request_deadline.set(_request_deadline.get())
+    try:
+        set_request_deadline(seconds)
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left before the current deadline (possibly negative), or None without one."""
+    deadline = _request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def deadline_kwargs(cap=None):
+    """
+    Keyword arguments that bound a Google client call by the current deadline,
+    e.g. doc_ref.get(**deadline_kwargs()). Without a deadline the client defaults apply.
+    Raises DeadlineExceeded if there is no time left at all.
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return {}
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return {"timeout": min(remaining, cap) if cap else remaining}
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of the last `window_size` calls. Once at least `min_calls` have been
+    seen and the share of failed or slow ones (slower than `slow_call_threshold` seconds)
+    reaches `failure_rate_threshold`, the breaker opens and calls are refused for
+    `open_duration` seconds. After that, up to `half_open_max_calls` trial calls are let
+    through: one success closes the breaker again, one failure reopens it.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, window_size=20, min_calls=5, failure_rate_threshold=0.5,
+                 slow_call_threshold=2.0, open_duration=30.0, half_open_max_calls=1):
+        self.name = name
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "successes": 0,
+            "failures": 0,
+            "slow_calls": 0,
+            "short_circuits": 0,
+            "fallbacks": 0,
+            "opened": 0
+        }
+
+    def _transition(self, state):
+        if state != self.state:
+            logger.warning("Circuit breaker %s: %s -> %s", self.name, self.state, state)
+            self.state = state
+            if state == self.OPEN:
+                self._opened_at = time.monotonic()
+                self.counters["opened"] += 1
+            elif state == self.CLOSED:
+                self._outcomes.clear()
+            self._half_open_calls = 0
+
+    def allow_request(self):
+        """Whether a call may go to the upstream now. Refusals count as short circuits."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_duration:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return True
+            if self.state == self.CLOSED:
+                return True
+            self.counters["short_circuits"] += 1
+            return False
+
+    def record_success(self, latency):
+        slow = latency > self.slow_call_threshold
+        with self._lock:
+            self.counters["successes"] += 1
+            if slow:
+                self.counters["slow_calls"] += 1
+            self._record(slow)
+
+    def record_failure(self):
+        with self._lock:
+            self.counters["failures"] += 1
+            self._record(True)
+
+    def record_cancelled(self, latency):
+        """A call abandoned by its caller counts as a failure only if it was already slow."""
+        if latency > self.slow_call_threshold:
+            self.record_failure()
+        else:
+            self._release_trial()
+
+    def record_fallback(self, count=1):
+        with self._lock:
+            self.counters["fallbacks"] += count
+
+    def _record(self, bad):
+        if self.state == self.HALF_OPEN:
+            self._transition(self.OPEN if bad else self.CLOSED)
+            return
+        if self.state == self.OPEN:
+            return
+        self._outcomes.append(bad)
+        if len(self._outcomes) >= self.min_calls and \
+                sum(self._outcomes) / len(self._outcomes) >= self.failure_rate_threshold:
+            self._transition(self.OPEN)
+
+    def call(self, function, fallback=None, fallback_on_error=False):
+        """
+        Calls function() through the breaker. While the breaker is open, fallback() is
+        returned instead (or CircuitOpenError raised without one). With fallback_on_error
+        a failed call is answered by fallback() too; otherwise its exception propagates.
+        """
+        if not self.allow_request():
+            if fallback is None:
+                raise CircuitOpenError(f"Circuit breaker {self.name} is open")
+            self.record_fallback()
+            return fallback()
+        started = time.monotonic()
+        try:
+            result = function()
+        except DeadlineExceeded:
+            # Out of our own time budget before calling; says nothing about the upstream
+            self._release_trial()
+            if not (fallback_on_error and fallback is not None):
+                raise
+            self.record_fallback()
+            return fallback()
+        except Exception:
+            self.record_failure()
+            if not (fallback_on_error and fallback is not None):
+                raise
+            logger.exception("Call through circuit breaker %s failed, using fallback", self.name)
+            self.record_fallback()
+            return fallback()
+        self.record_success(time.monotonic() - started)
+        return result
+
+    def _release_trial(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def reset(self):
+        with self._lock:
+            self._transition(self.CLOSED)
+            self._outcomes.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["state"] = self.state
+            stats["window_calls"] = len(self._outcomes)
+            stats["window_failure_rate"] = sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+        return stats
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(name, **kwargs):
+    """Returns the process-wide breaker called name, creating it with kwargs on first use."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **kwargs)
+        return breaker
+
+def circuit_breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+# Longest a single NLP call may take even when the request has more time left
+NLP_CALL_TIMEOUT = float(os.getenv("NLP_CALL_TIMEOUT", 5.0))
+# Same policy as the client's default retry. The default one gives up only after 600s no
+# matter what timeout is passed, so under a deadline it is swapped for this one, cut to fit.
+NLP_RETRY = Retry(
+    initial=0.1, maximum=1.0, multiplier=1.3,
+    predicate=if_exception_type(core_exceptions.DeadlineExceeded, core_exceptions.ServiceUnavailable)
+)
+
+
+def nlp_call_kwargs():
+    """deadline_kwargs for LanguageService calls: retries included, capped at NLP_CALL_TIMEOUT."""
+    kwargs = deadline_kwargs(NLP_CALL_TIMEOUT)
+    if kwargs:
+        kwargs["retry"] = NLP_RETRY.with_timeout(kwargs["timeout"])
+    return kwargs
+
+nlp_breaker = get_circuit_breaker(
+    "google-nlp",
+    window_size=int(os.getenv("NLP_BREAKER_WINDOW", 20)),
+    min_calls=int(os.getenv("NLP_BREAKER_MIN_CALLS", 5)),
+    failure_rate_threshold=float(os.getenv("NLP_BREAKER_FAILURE_RATE", 0.5)),
+    slow_call_threshold=float(os.getenv("NLP_BREAKER_SLOW_CALL", 2.0)),
+    open_duration=float(os.getenv("NLP_BREAKER_OPEN_SECONDS", 30.0))
+)
+
+
+def fallback_sentiment_backend():
+    """The local scorer used while the NLP breaker is open."""
+    from server.api_handler.sentiment_backends import get_sentiment_backend
+    return get_sentiment_backend("lexicon")
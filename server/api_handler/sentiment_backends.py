@@ -0,0 +1,93 @@
+# Pluggable sentiment backends.
+# Every backend answers analyze_sentiment(text) with a language_v1.AnalyzeSentimentResponse,
+# so parse_api_response and the rest of the pipeline work the same whichever one is selected.
+# Callers put the sentiment cache and the NLP circuit breaker around remote backends' calls
+# (see send_to_google_nlp_api); the backend itself only talks to its service.
+# Pick one with the SENTIMENT_BACKEND environment variable ("google" or "lexicon").
+
+import os
+from google.cloud import language_v1
+from server.api_handler.lexicon_sentiment import get_lexicon_engine
+
+
+def to_response(parsed):
+    """Builds an AnalyzeSentimentResponse from a parse_api_response-shaped dict."""
+    return language_v1.AnalyzeSentimentResponse(
+        document_sentiment={
+            "score": parsed["overall_sentiment"]["score"],
+            "magnitude": parsed["overall_sentiment"]["magnitude"]
+        },
+        sentences=[
+            {
+                "text": {"content": sentence["content"], "begin_offset": sentence.get("begin_offset", -1)},
+                "sentiment": {"score": sentence["sentiment"], "magnitude": sentence["magnitude"]}
+            } for sentence in parsed["sentences"]
+        ]
+    )
+
+
+class SentimentBackend:
+    """Interface for sentiment backends."""
+    name = None
+    version = None
+    # Remote backends go through the sentiment cache, request packing and the async client
+    remote = True
+
+    def analyze_sentiment(self, text):
+        raise NotImplementedError
+
+    def analyze_batch(self, texts):
+        return [self.analyze_sentiment(text) for text in texts]
+
+
+class GoogleNLPBackend(SentimentBackend):
+    name = "google-nlp"
+    version = "language_v1"
+    remote = True
+
+    def analyze_sentiment(self, text, client=None, **call_kwargs):
+        """One analyze_sentiment call; call_kwargs (retry, timeout) go to the client as they are."""
+        if client is None:
+            from server.config.config import get_nlp_client
+            client = get_nlp_client()
+        document = language_v1.Document(content=text, type_=language_v1.Document.Type.PLAIN_TEXT)
+        return client.analyze_sentiment(request={"document": document}, **call_kwargs)
+
+
+class LexiconSentimentBackend(SentimentBackend):
+    name = "lexicon"
+    version = "1"
+    remote = False
+
+    def __init__(self, engine=None):
+        self.engine = engine or get_lexicon_engine()
+
+    def analyze(self, text):
+        return self.engine.analyze(text)
+
+    def analyze_sentiment(self, text):
+        return to_response(self.engine.analyze(text, include_offsets=True))
+
+    def analyze_batch(self, texts):
+        return [to_response(parsed) for parsed in self.engine.analyze_batch(list(texts), include_offsets=True)]
+
+    def score_batch(self, texts):
+        """Document scores only, skipping the response objects."""
+        return [parsed["overall_sentiment"]["score"] for parsed in self.engine.analyze_batch(list(texts))]
+
+
+SENTIMENT_BACKENDS = {
+    "google": GoogleNLPBackend,
+    "lexicon": LexiconSentimentBackend
+}
+_backends = {}
+
+def get_sentiment_backend(name=None):
+    """Returns the shared instance of the configured (or named) backend."""
+    name = name or os.getenv("SENTIMENT_BACKEND", "google")
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in SENTIMENT_BACKENDS:
+            raise ValueError(f"Unknown sentiment backend: {name}")
+        backend = _backends[name] = SENTIMENT_BACKENDS[name]()
+    return backend
@@ -0,0 +1,214 @@
+# Two-tier cache for sentiment analysis results.
+# Tier 1 is a bounded in-process LRU; tier 2 is a SQLite file that every worker on the host
+# shares, so a task description scored by one worker is a cache hit for all the others.
+# Only the document score and magnitude are stored, keyed by a hash of the text: the text
+# itself (mood journal entries, task descriptions) never reaches the disk. The SQLite tier
+# is off unless SENTIMENT_CACHE_PATH is set; the file is created readable by its owner only.
+
+import json
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from google.cloud import language_v1
+
+logger = logging.getLogger(__name__)
+
+# Memory only unless SENTIMENT_CACHE_PATH is set
+DEFAULT_CACHE_PATH = None
+# Bumped whenever the stored value format changes, so older rows are never read back
+CACHE_FORMAT = "scores-v1"
+DEFAULT_BACKEND = "google-nlp"
+DEFAULT_VERSION = "language_v1"
+
+
+class SentimentCache:
+    """
+    LRU memory cache in front of a SQLite store, keyed by a hash of the analyzed text
+    plus the backend name and version, so switching backends never serves stale scores.
+    Values are strings (serialized scores). Entries expire after ttl seconds.
+    With path None only the memory tier is used.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_memory_entries=4096, max_disk_entries=200000,
+                 ttl=7 * 24 * 3600, backend=DEFAULT_BACKEND, version=DEFAULT_VERSION):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.version = version
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes_since_trim = 0
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "disk_errors": 0
+        }
+
+    def key(self, text):
+        return hashlib.sha256(f"{CACHE_FORMAT}\0{self.backend}\0{self.version}\0{text}".encode("utf-8")).hexdigest()
+
+    def _create_private_file(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # SQLite gives its -wal and -shm files the permissions of the database file
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+
+    def _connection(self):
+        # One connection per thread and per process: SQLite handles must not cross a fork
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            self._create_private_file()
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sentiment_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS sentiment_cache_expires ON sentiment_cache (expires_at)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def get(self, text):
+        """Returns the cached value for text, or None on a miss."""
+        key = self.key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+                self.counters["expirations"] += 1
+
+        if self.path:
+            try:
+                row = self._connection().execute(
+                    "SELECT value, expires_at FROM sentiment_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error("Sentiment cache read failed: %s", e)
+                self._count("disk_errors")
+                row = None
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                self._count("disk_hits")
+                return row[0]
+
+        self._count("misses")
+        return None
+
+    def set(self, text, value):
+        key = self.key(text)
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        self._count("writes")
+        if not self.path:
+            return
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO sentiment_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+            with self._lock:
+                self._writes_since_trim += 1
+                should_trim = self._writes_since_trim >= 1000
+                if should_trim:
+                    self._writes_since_trim = 0
+            if should_trim:
+                self.trim()
+        except sqlite3.Error as e:
+            logger.error("Sentiment cache write failed: %s", e)
+            self._count("disk_errors")
+
+    def trim(self):
+        """Drops expired rows, then the soonest-to-expire rows beyond max_disk_entries."""
+        connection = self._connection()
+        with connection:
+            expired = connection.execute("DELETE FROM sentiment_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            (count,) = connection.execute("SELECT COUNT(*) FROM sentiment_cache").fetchone()
+            overflow = count - self.max_disk_entries
+            evicted = 0
+            if overflow > 0:
+                evicted = connection.execute(
+                    "DELETE FROM sentiment_cache WHERE key IN "
+                    "(SELECT key FROM sentiment_cache ORDER BY expires_at LIMIT ?)", (overflow,)
+                ).rowcount
+        with self._lock:
+            self.counters["expirations"] += max(expired, 0)
+            self.counters["evictions"] += max(evicted, 0)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            connection = self._connection()
+            with connection:
+                connection.execute("DELETE FROM sentiment_cache")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+sentiment_cache = SentimentCache(
+    path=os.getenv("SENTIMENT_CACHE_PATH") or DEFAULT_CACHE_PATH,
+    max_memory_entries=int(os.getenv("SENTIMENT_CACHE_MEMORY_ENTRIES", 4096)),
+    ttl=int(os.getenv("SENTIMENT_CACHE_TTL", 7 * 24 * 3600)),
+    version=os.getenv("SENTIMENT_MODEL_VERSION", DEFAULT_VERSION)
+)
+
+
+def get_cached_response(text, cache=None):
+    """
+    Returns an AnalyzeSentimentResponse rebuilt from the cached scores for text, or None.
+    It has the whole text as its single sentence, so keyword extraction still sees every word.
+    """
+    payload = (cache or sentiment_cache).get(text)
+    if payload is None:
+        return None
+    scores = json.loads(payload)
+    sentiment = {"score": scores["score"], "magnitude": scores["magnitude"]}
+    return language_v1.AnalyzeSentimentResponse(
+        document_sentiment=sentiment,
+        sentences=[{"text": {"content": text, "begin_offset": 0}, "sentiment": sentiment}] if text else []
+    )
+
+
+def cache_response(text, response, cache=None):
+    # Only real API responses are cached; anything else (e.g. test doubles) passes through untouched
+    if isinstance(response, language_v1.AnalyzeSentimentResponse):
+        sentiment = response.document_sentiment
+        (cache or sentiment_cache).set(text, json.dumps({"score": sentiment.score, "magnitude": sentiment.magnitude}))
+    return response
@@ -0,0 +1,223 @@
+# Per-user online sentiment model.
+# Hashed unigram/bigram features over preprocess_text output feed a linear model with a tanh
+# output in [-1, 1], trained online with SGD from Google NLP scores and the user's own labels.
+# Each user's model is persisted as a compact .npz holding only its non-zero weights.
+# Training happens in memory under the user's own lock; a background thread writes changed
+# models to disk every SENTIMENT_MODEL_SAVE_INTERVAL seconds (and at exit), so a request
+# never waits on a model file. Models live in SENTIMENT_MODEL_DIR, by default
+# $XDG_DATA_HOME/productivepanda/sentiment_models (~/.local/share/...), outside the source tree.
+
+import os
+import time
+import atexit
+import hashlib
+import threading
+import zlib
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_DIR = os.path.join(
+    os.getenv("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"),
+    "productivepanda", "sentiment_models"
+)
+DEFAULT_SAVE_INTERVAL = 5.0
+N_FEATURES = 2 ** 18
+# Below this many updates a personal model is too green to replace the remote scores
+MIN_TRAINED_UPDATES = 20
+
+
+@lru_cache(maxsize=200000)
+def _hash_feature(feature):
+    # crc32 is stable across processes; the top bit picks the sign to spread out collisions
+    value = zlib.crc32(feature.encode("utf-8"))
+    return value % N_FEATURES, (1.0 if value & 0x80000000 else -1.0)
+
+
+def featurize(text):
+    """Returns (indices, signs) of the hashed unigram and bigram features of text."""
+    tokens = text.split()
+    features = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+    if not features:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    hashed = [_hash_feature(feature) for feature in features]
+    indices = np.fromiter((index for index, _ in hashed), dtype=np.int64, count=len(hashed))
+    signs = np.fromiter((sign for _, sign in hashed), dtype=np.float32, count=len(hashed))
+    # Scale by 1/sqrt(n) so long entries don't saturate tanh
+    return indices, signs / np.float32(np.sqrt(len(features)))
+
+
+def featurize_batch(texts):
+    """Returns flat (indices, values, text_ids) arrays for a batch of texts."""
+    all_indices, all_values, all_ids = [], [], []
+    for text_id, text in enumerate(texts):
+        indices, values = featurize(text)
+        all_indices.append(indices)
+        all_values.append(values)
+        all_ids.append(np.full(len(indices), text_id, dtype=np.int64))
+    if not all_indices:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+    return np.concatenate(all_indices), np.concatenate(all_values), np.concatenate(all_ids)
+
+
+class OnlineSentimentModel:
+    """
+    Linear model over hashed features with prediction tanh(w.x + b),
+    fitted online by SGD on squared error with L2 regularization.
+    """
+    def __init__(self, learning_rate=0.5, l2=1e-6, weights=None, bias=0.0, updates=0):
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.weights = weights if weights is not None else np.zeros(N_FEATURES, dtype=np.float32)
+        self.bias = float(bias)
+        self.updates = int(updates)
+        # Held while training and while taking the snapshot that save() writes
+        self.lock = threading.Lock()
+
+    def is_trained(self):
+        return self.updates >= MIN_TRAINED_UPDATES
+
+    def predict(self, texts):
+        """Scores a batch of preprocessed texts, returning a NumPy array in [-1, 1]."""
+        texts = list(texts)
+        indices, values, text_ids = featurize_batch(texts)
+        margins = np.bincount(text_ids, weights=self.weights[indices] * values, minlength=len(texts))
+        return np.tanh(margins + self.bias)
+
+    def predict_one(self, text):
+        return float(self.predict([text])[0])
+
+    def partial_fit(self, texts, targets, sample_weights=None):
+        """One SGD step per example, in order. Targets are sentiment scores in [-1, 1]."""
+        texts = list(texts)
+        if sample_weights is None:
+            sample_weights = [1.0] * len(texts)
+        for text, target, sample_weight in zip(texts, targets, sample_weights):
+            indices, values = featurize(text)
+            prediction = np.tanh(float(np.dot(self.weights[indices], values)) + self.bias)
+            # d/dz of 0.5 * (tanh(z) - y)^2
+            gradient = (prediction - float(target)) * (1.0 - prediction * prediction) * sample_weight
+            step = self.learning_rate / np.sqrt(1.0 + self.updates / 100.0)
+            if len(indices):
+                self.weights[indices] *= np.float32(1.0 - step * self.l2)
+                np.add.at(self.weights, indices, np.float32(-step * gradient) * values)
+            self.bias -= step * gradient
+            self.updates += 1
+        return self
+
+    def save(self, path):
+        """Writes the non-zero weights to a compressed .npz, atomically replacing any old file."""
+        with self.lock:
+            nonzero = np.flatnonzero(self.weights)
+            values = self.weights[nonzero].astype(np.float16)
+            bias, updates = self.bias, self.updates
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            indices=nonzero.astype(np.uint32),
+            values=values,
+            bias=np.float32(bias),
+            updates=np.int64(updates)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with np.load(path) as data:
+            weights = np.zeros(N_FEATURES, dtype=np.float32)
+            weights[data["indices"].astype(np.int64)] = data["values"].astype(np.float32)
+            return cls(weights=weights, bias=float(data["bias"]), updates=int(data["updates"]), **kwargs)
+
+
+# Recently used user models stay in memory; the rest are reloaded from disk on demand
+MAX_CACHED_MODELS = 256
+_user_models = OrderedDict()
+# Models trained since they were last written: user ID -> (model, path)
+_dirty_models = {}
+# Guards the two dicts above only; training and saving use each model's own lock
+_user_models_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_saver = None
+
+
+def _model_dir():
+    return os.getenv("SENTIMENT_MODEL_DIR") or DEFAULT_MODEL_DIR
+
+
+def _model_path(user_id):
+    # A hash keeps distinct user IDs in distinct files whatever characters they contain
+    digest = hashlib.sha256(str(user_id).encode("utf-8")).hexdigest()
+    return os.path.join(_model_dir(), f"{digest}.npz")
+
+
+def _legacy_model_path(user_id):
+    # File name used before models were keyed by a hash of the user ID
+    safe_user_id = "".join(character for character in str(user_id) if character.isalnum() or character in "-_")
+    return os.path.join(_model_dir(), f"{safe_user_id}.npz")
+
+
+def get_user_sentiment_model(user_id):
+    with _user_models_lock:
+        model = _user_models.get(user_id)
+        if model is None and user_id in _dirty_models:
+            # Evicted from the cache before the saver got to it; the file would be stale
+            model = _dirty_models[user_id][0]
+            _user_models[user_id] = model
+        if model is not None:
+            _user_models.move_to_end(user_id)
+            return model
+    path = _model_path(user_id)
+    if not os.path.exists(path) and os.path.exists(_legacy_model_path(user_id)):
+        path = _legacy_model_path(user_id)
+    try:
+        model = OnlineSentimentModel.load(path) if os.path.exists(path) else OnlineSentimentModel()
+    except Exception as e:
+        logger.error("Could not load sentiment model for user %s: %s", user_id, e)
+        model = OnlineSentimentModel()
+    with _user_models_lock:
+        model = _user_models.setdefault(user_id, model)
+        while len(_user_models) > MAX_CACHED_MODELS:
+            _user_models.popitem(last=False)
+    return model
+
+
+def update_user_sentiment_model(user_id, texts, targets, sample_weights=None):
+    """Trains the user's model on new (preprocessed text, score) examples; it is saved in the background."""
+    global _saver
+    model = get_user_sentiment_model(user_id)
+    with model.lock:
+        model.partial_fit(texts, targets, sample_weights)
+    with _user_models_lock:
+        _dirty_models[user_id] = (model, _model_path(user_id))
+        # Threads don't survive a fork, so a child process starts its own saver
+        if _saver is None or not _saver.is_alive():
+            _saver = threading.Thread(target=_save_loop, name="sentiment-model-saver", daemon=True)
+            _saver.start()
+    return model
+
+
+def _save_loop():
+    while True:
+        time.sleep(float(os.getenv("SENTIMENT_MODEL_SAVE_INTERVAL", DEFAULT_SAVE_INTERVAL)))
+        flush_user_sentiment_models()
+
+
+def flush_user_sentiment_models():
+    """Writes every model trained since its last save; returns how many were written."""
+    with _flush_lock:
+        with _user_models_lock:
+            dirty = list(_dirty_models.items())
+            _dirty_models.clear()
+        for user_id, (model, path) in dirty:
+            try:
+                os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+                model.save(path)
+            except Exception as e:
+                logger.error("Could not save sentiment model for user %s: %s", user_id, e)
+        return len(dirty)
+
+
+atexit.register(flush_user_sentiment_models)
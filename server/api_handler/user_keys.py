@@ -0,0 +1,104 @@
+# Per-user data keys.
+# Every user's data is encrypted with its own Fernet key, derived with HKDF-SHA256 from the
+# master ENCRYPTION_KEY and the user ID, so no key material per user has to be stored.
+# Deriving a key (and building its Fernet) costs far more than using one, so ready-to-use
+# ciphers are kept in a bounded LRU with hit, miss and derivation-time counters.
+#
+# A user's cipher is a MultiFernet: it encrypts with the user's key and still decrypts
+# data written under the master key before per-user keys existed. The re-encryption tool
+# (python -m server.tools.reencrypt_user_data) moves such data to the user keys; once it
+# has run, USER_KEYS_MASTER_FALLBACK=0 stops the master key from opening user data.
+#
+# Settings (environment):
+#   ENCRYPTION_KEY              master Fernet key
+#   USER_KEY_CACHE_SIZE         ciphers kept in memory, default 10000
+#   USER_KEYS_MASTER_FALLBACK   0 to decrypt user data with the user's key only, default 1
+
+import os
+import time
+import base64
+import threading
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+USER_KEY_INFO_PREFIX = b'productivepanda user data key:'
+
+encryption_key = os.getenv('ENCRYPTION_KEY').encode()
+master_cipher = Fernet(encryption_key)
+
+
+def derive_user_key(master_key, user_id):
+    """The user's Fernet key (urlsafe base64 bytes), derived from the master key"""
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+               info=USER_KEY_INFO_PREFIX + str(user_id).encode('utf-8')).derive(base64.urlsafe_b64decode(master_key))
+    return base64.urlsafe_b64encode(key)
+
+
+class UserKeyring:
+    """
+    Bounded LRU of per-user ciphers. cipher(user_id) encrypts with the user's key and
+    decrypts with it or, if master_fallback is set, the master key; user_cipher(user_id)
+    only knows the user's key.
+    """
+    def __init__(self, master_key, max_users=10000, master_fallback=True):
+        self.master_key = master_key
+        self.master = Fernet(master_key)
+        self.max_users = max_users
+        self.master_fallback = master_fallback
+        self._ciphers = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._derive_seconds = 0.0
+
+    def _entry(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._ciphers.get(user_id)
+            if entry is not None:
+                self._ciphers.move_to_end(user_id)
+                self._hits += 1
+                return entry
+            self._misses += 1
+        # Derive outside the lock; two threads missing on the same user just both derive it
+        started = time.perf_counter()
+        user_cipher = Fernet(derive_user_key(self.master_key, user_id))
+        entry = (user_cipher, MultiFernet([user_cipher, self.master] if self.master_fallback else [user_cipher]))
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._derive_seconds += elapsed
+            self._ciphers[user_id] = entry
+            self._ciphers.move_to_end(user_id)
+            while len(self._ciphers) > self.max_users:
+                self._ciphers.popitem(last=False)
+                self._evictions += 1
+        return entry
+
+    def cipher(self, user_id):
+        return self._entry(user_id)[1]
+
+    def user_cipher(self, user_id):
+        return self._entry(user_id)[0]
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'cached': len(self._ciphers),
+                'maxCached': self.max_users,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hitRate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'derivations': self._misses,
+                'deriveMillisecondsTotal': round(self._derive_seconds * 1000, 3),
+                'deriveMillisecondsAverage': round(self._derive_seconds * 1000 / self._misses, 4) if self._misses else 0.0
+            }
+
+
+user_keyring = UserKeyring(encryption_key, max_users=int(os.getenv('USER_KEY_CACHE_SIZE', 10000)),
+                           master_fallback=os.getenv('USER_KEYS_MASTER_FALLBACK', '1') != '0')
@@ -1,32 +1,68 @@
 import os
-from flask import Flask, render_template, url_for, redirect, flash, request, jsonify
+import json
+import base64
+from datetime import datetime, timezone
+from flask import Flask, render_template, url_for, redirect, flash, request, jsonify, current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import tuple_
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired, Length, ValidationError
 from flask_bcrypt import Bcrypt
 from google.cloud import firestore
-from server.api.task_controller import task_controller
-from server.models.user_sqlalchemy_firestore_models import User as MoodUser
+from server.api.task_controller import task_controller, task_index
+from server.models.user_sqlalchemy_firestore_models import MoodUser
+from server.models.recommendations import get_recommendations
+from server.config.logging_config import configure_logging
+from server.api_handler.user_keys import user_keyring
+from server.api_handler.resilience import (
+    set_request_deadline, clear_request_deadline, deadline_kwargs, circuit_breaker_stats
+)
 
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 
-def create_app():
+def create_app(test_config=None):
+    # Log records are handed to a background listener thread; see server/config/logging_config.py
+    configure_logging()
     # Initialize Flask app
     app = Flask(__name__, template_folder='templates', static_folder='frontend')
     app.config['SQLALCHEMY_DATABASE_URI'] = r'sqlite:///C:\Users\eghaz\Downloads\ProductivePandaDoingAgain\server\database.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = 'authenticationsecretkey'
+    # Per-request limits for scoring task sentiment concurrently in /tasks/analyze_tasks
+    app.config['TASK_SENTIMENT_CONCURRENCY'] = int(os.getenv('TASK_SENTIMENT_CONCURRENCY', 8))
+    app.config['TASK_SENTIMENT_DEADLINE'] = float(os.getenv('TASK_SENTIMENT_DEADLINE', 10.0))
+    # NDJSON streaming mode of /tasks/analyze_tasks: tasks scored per chunk, recommendations kept
+    app.config['TASK_STREAM_CHUNK_SIZE'] = int(os.getenv('TASK_STREAM_CHUNK_SIZE', 100))
+    app.config['TASK_STREAM_MAX_RECOMMENDATIONS'] = int(os.getenv('TASK_STREAM_MAX_RECOMMENDATIONS', 100))
+    app.config['TASK_STREAM_MAX_LINE_BYTES'] = int(os.getenv('TASK_STREAM_MAX_LINE_BYTES', 64 * 1024))
+    # Background analyses (/tasks/analyze_tasks?async=1): worker pool sized apart from web concurrency
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 4))
+    app.config['JOB_WORKER_MODE'] = os.getenv('JOB_WORKER_MODE', 'thread')
+    app.config['JOB_MAX_PENDING'] = int(os.getenv('JOB_MAX_PENDING', 100))
+    app.config['JOB_MAX_STORED'] = int(os.getenv('JOB_MAX_STORED', 1000))
+    app.config['JOB_RESULT_TTL'] = float(os.getenv('JOB_RESULT_TTL', 600.0))
+    app.config['JOB_TIMEOUT'] = float(os.getenv('JOB_TIMEOUT', 300.0))
+    # Server-side to-do list (/todos)
+    app.config['TODO_PAGE_SIZE'] = int(os.getenv('TODO_PAGE_SIZE', 50))
+    app.config['TODO_MAX_PAGE_SIZE'] = int(os.getenv('TODO_MAX_PAGE_SIZE', 200))
+    app.config['TODO_BULK_MAX_OPERATIONS'] = int(os.getenv('TODO_BULK_MAX_OPERATIONS', 500))
+    # Every NLP and Firestore call made while serving a request must finish within this budget
+    app.config['REQUEST_DEADLINE'] = float(os.getenv('REQUEST_DEADLINE', 15.0))
+    app.config['FIRESTORE_CREDENTIALS_PATH'] = r"C:\Users\eghaz\Downloads\ProductivePandaDoingAgain\server\config\productivepandacredentials.json"
+    # Overrides for tests and tools, e.g. a temporary database (see server.tools.load_test)
+    if test_config:
+        app.config.update(test_config)
     
     # Initialize extensions
     db.init_app(app)
     bcrypt.init_app(app)
     
     # Initialize Firestore
-    credentials_path = r"C:\Users\eghaz\Downloads\ProductivePandaDoingAgain\server\config\productivepandacredentials.json"
+    credentials_path = app.config['FIRESTORE_CREDENTIALS_PATH']
     if not os.path.exists(credentials_path):
         raise FileNotFoundError(f"Credentials file not found at {credentials_path}")
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_path
@@ -41,6 +77,14 @@ def create_app():
     def load_user(user_id):
         return User.query.get(int(user_id))
 
+    @app.before_request
+    def start_request_deadline():
+        set_request_deadline(app.config['REQUEST_DEADLINE'])
+
+    @app.teardown_request
+    def end_request_deadline(exception=None):
+        clear_request_deadline()
+
     # Register blueprint
     app.register_blueprint(task_controller, url_prefix='/tasks')
 
@@ -64,15 +108,19 @@ def create_app():
     @app.route('/dashboard', methods=['GET', 'POST'])
     @login_required
     def dashboard():
+        # Computed overnight by server.tools.nightly_recommendations
+        recommendations = get_recommendations(current_user.id, task_index)
         if request.method == 'POST':
             input_text = request.form.get('inputText')
             if input_text:
                 mood_user = MoodUser(user_id=current_user.id)
                 mood_analysis = mood_user.analyze_mood(input_text)
                 mood_user.store_mood_analysis(mood_analysis)
+                mood_user.record_latest_mood(mood_analysis['sentimentScore'])
                 flash('Mood analysis complete!', 'success')
-                return render_template('dashboard.html', name=current_user.username, mood_analysis=mood_analysis)
-        return render_template('dashboard.html', name=current_user.username)
+                return render_template('dashboard.html', name=current_user.username, mood_analysis=mood_analysis,
+                                       recommendations=recommendations)
+        return render_template('dashboard.html', name=current_user.username, recommendations=recommendations)
 
     @app.route('/logout', methods=['GET', 'POST'])
     @login_required
@@ -111,6 +159,48 @@ def create_app():
         mood_user.store_preferences()
         return jsonify({"message": "Preferences stored successfully"})
 
+    @app.route('/todos', methods=['GET'])
+    @login_required
+    def list_todos():
+        try:
+            limit = request.args.get('limit', app.config['TODO_PAGE_SIZE'], type=int)
+            page = list_todo_page(current_user.id, status=request.args.get('status'), cursor=request.args.get('cursor'),
+                                  limit=max(1, min(limit, app.config['TODO_MAX_PAGE_SIZE'])))
+            return jsonify(page)
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+
+    @app.route('/todos/bulk', methods=['POST'])
+    @login_required
+    def bulk_todos():
+        data = request.get_json(silent=True) or {}
+        try:
+            results, index_changes = apply_todo_operations(
+                current_user.id, data.get('operations'), max_operations=app.config['TODO_BULK_MAX_OPERATIONS'])
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+        except LookupError as le:
+            return jsonify({'error': str(le)}), 404
+        return jsonify({'results': results, 'version': sync_task_index(current_user.id, *index_changes)})
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Creates any missing tables, e.g. the task table on an existing database."""
+        db.create_all()
+
+    @app.route('/metrics/circuit_breakers', methods=['GET'])
+    def circuit_breakers():
+        return jsonify(circuit_breaker_stats())
+
+    @app.route('/metrics/jobs', methods=['GET'])
+    def job_queue_stats():
+        queue = app.extensions.get('task_jobs')
+        return jsonify(queue.stats() if queue is not None else {})
+
+    @app.route('/metrics/user_keys', methods=['GET'])
+    def user_key_stats():
+        return jsonify(user_keyring.stats())
+
     @app.route('/add_document', methods=['POST'])
     @login_required
     def add_document():
@@ -119,7 +209,7 @@ def create_app():
             data = request.json
             if not data or not isinstance(data, dict):
                 return jsonify({'status': 'Invalid data'}), 400
-            db_firestore.collection('test_collection').document('test_doc').set(data)
+            db_firestore.collection('test_collection').document('test_doc').set(data, **deadline_kwargs())
             return jsonify({'status': 'Document added'})
         except Exception as e:
             app.logger.error(f"ERROR adding document: {e}")
@@ -129,7 +219,7 @@ def create_app():
     @login_required
     def get_document():
         try:
-            doc = db_firestore.collection('test_collection').document('test_doc').get()
+            doc = db_firestore.collection('test_collection').document('test_doc').get(**deadline_kwargs())
             if doc.exists:
                 return jsonify(doc.to_dict())
             else:
@@ -147,6 +237,157 @@ class User(db.Model, UserMixin):
     username = db.Column(db.String(20), nullable=False, unique=True)
     password = db.Column(db.String(80), nullable=False)
 
+TODO_STATUSES = ('awaiting', 'finished')
+TODO_DESCRIPTION_MAX_LENGTH = 500
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# Define Task model for the server-side to-do list
+class TodoTask(db.Model):
+    __tablename__ = 'task'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    description = db.Column(db.String(TODO_DESCRIPTION_MAX_LENGTH), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='awaiting')
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    created = db.Column(db.DateTime, nullable=False, default=_utcnow)
+    updated = db.Column(db.DateTime, nullable=False, default=_utcnow)
+    # Serves status filtering and the (created, id) keyset order of list_todo_page
+    __table_args__ = (db.Index('ix_task_user_status_created', 'user_id', 'status', 'created', 'id'),)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'description': self.description,
+            'status': self.status,
+            'priority': self.priority,
+            'created': self.created.isoformat()
+        }
+
+def encode_todo_cursor(task):
+    return base64.urlsafe_b64encode(json.dumps([task.created.isoformat(), task.id]).encode()).decode()
+
+def decode_todo_cursor(cursor):
+    try:
+        created, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created), int(task_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def list_todo_page(user_id, status=None, cursor=None, limit=50):
+    """
+    One page of the user's tasks, oldest first, optionally only those with `status`.
+    Pages are keyset paginated: nextCursor marks the last task returned and is None on the last page.
+    """
+    query = TodoTask.query.filter(TodoTask.user_id == user_id)
+    if status is not None:
+        if status not in TODO_STATUSES:
+            raise ValueError(f"status should be one of {', '.join(TODO_STATUSES)}")
+        query = query.filter(TodoTask.status == status)
+    if cursor:
+        query = query.filter(tuple_(TodoTask.created, TodoTask.id) > tuple_(*decode_todo_cursor(cursor)))
+    tasks = query.order_by(TodoTask.created, TodoTask.id).limit(limit + 1).all()
+    return {
+        'tasks': [task.to_dict() for task in tasks[:limit]],
+        'nextCursor': encode_todo_cursor(tasks[limit - 1]) if len(tasks) > limit else None
+    }
+
+def validate_todo_operation(operation):
+    if not isinstance(operation, dict) or operation.get('op') not in ('create', 'update', 'delete'):
+        raise ValueError("Each operation must be an object with op 'create', 'update' or 'delete'")
+    if operation['op'] != 'create' and (not isinstance(operation.get('id'), int) or isinstance(operation['id'], bool)):
+        raise ValueError(f"{operation['op']} operations need an integer id")
+    if operation['op'] == 'create' and 'description' not in operation:
+        raise ValueError("create operations need a description")
+    description = operation.get('description')
+    if description is not None and (not isinstance(description, str) or not description.strip()
+                                    or len(description) > TODO_DESCRIPTION_MAX_LENGTH):
+        raise ValueError(f"description should be a non-empty string of at most {TODO_DESCRIPTION_MAX_LENGTH} characters")
+    if operation.get('status', 'awaiting') not in TODO_STATUSES:
+        raise ValueError(f"status should be one of {', '.join(TODO_STATUSES)}")
+    priority = operation.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError("priority should be an integer")
+
+def apply_todo_operations(user_id, operations, max_operations=500):
+    """
+    Applies a list of create/update/delete operations to the user's tasks in one transaction.
+    Nothing is applied if any operation is invalid (ValueError) or names a task the user
+    doesn't have (LookupError). Returns (results in operation order, (tasks to index, IDs to unindex)).
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("operations should be a non-empty list")
+    if len(operations) > max_operations:
+        raise ValueError(f"At most {max_operations} operations are allowed per request")
+    for operation in operations:
+        validate_todo_operation(operation)
+    target_ids = [operation['id'] for operation in operations if operation['op'] != 'create']
+    if len(set(target_ids)) != len(target_ids):
+        raise ValueError("Each task can only be updated or deleted once per request")
+
+    existing = {}
+    if target_ids:
+        existing = {task.id: task for task in TodoTask.query.filter(TodoTask.user_id == user_id, TodoTask.id.in_(target_ids))}
+    missing = [task_id for task_id in target_ids if task_id not in existing]
+    if missing:
+        raise LookupError(f"Tasks not found: {', '.join(map(str, missing))}")
+
+    now = _utcnow()
+    changed = []
+    for operation in operations:
+        if operation['op'] == 'create':
+            task = TodoTask(user_id=user_id, description=operation['description'], status=operation.get('status', 'awaiting'),
+                            priority=operation.get('priority', 0), created=now, updated=now)
+            db.session.add(task)
+        elif operation['op'] == 'update':
+            task = existing[operation['id']]
+            for field in ('description', 'status', 'priority'):
+                if field in operation:
+                    setattr(task, field, operation[field])
+            task.updated = now
+        else:
+            task = existing[operation['id']]
+            db.session.delete(task)
+        changed.append((operation, task))
+    db.session.commit()
+
+    results = []
+    to_index, to_unindex = [], []
+    for operation, task in changed:
+        if operation['op'] == 'delete':
+            results.append({'op': 'delete', 'id': operation['id']})
+            to_unindex.append(operation['id'])
+            continue
+        result = {'op': operation['op'], 'task': task.to_dict()}
+        if 'clientId' in operation:
+            result['clientId'] = operation['clientId']
+        results.append(result)
+        # Only open tasks are candidates for recommendations
+        if task.status == 'awaiting':
+            to_index.append(task)
+        else:
+            to_unindex.append(task.id)
+    return results, (to_index, to_unindex)
+
+def sync_task_index(user_id, tasks, deleted_ids):
+    """
+    Mirrors changed tasks into the task index so analyze_tasks can rank them by version
+    without the client resending them. Returns the new index version, or None if that failed.
+    """
+    if not tasks and not deleted_ids:
+        return None
+    try:
+        _, version = task_index.upsert(
+            str(user_id),
+            [{'id': str(task.id), 'description': task.description, 'priority': task.priority} for task in tasks],
+            delete_ids=[str(task_id) for task_id in deleted_ids]
+        )
+        return version
+    except Exception as e:
+        current_app.logger.error("Error syncing task index for user %s: %s", user_id, e)
+        return None
+
 # Define forms
 class RegisterForm(FlaskForm):
     username = StringField(validators=[InputRequired(), Length(min=4, max=20)], render_kw={"placeholder": "Username"})
@@ -1,28 +1,165 @@
 import os
+import atexit
+import logging
+import asyncio
+import inspect
+import threading
+import grpc
 from google.cloud import language_v1, firestore
+from google.cloud.language_v1.services.language_service.transports import (
+    LanguageServiceGrpcTransport, LanguageServiceGrpcAsyncIOTransport
+)
 from google.oauth2 import service_account
 
-def get_nlp_client():
-    # Load credentials from the environment variable
-    try:
+logger = logging.getLogger(__name__)
+
+# gRPC keepalive so idle pooled channels are not silently dropped by load balancers between requests
+NLP_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+]
+
+# Process-wide client registry: one client (and one channel) per name per process
+_clients = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+
+# Async clients live on one background event loop per process, so their channels outlive any single request
+_client_loop = None
+_client_loop_thread = None
+
+def _reset_clients_after_fork():
+    # Channels inherited from the parent must not be used or closed in the child; just forget them
+    global _clients, _clients_pid, _clients_lock, _client_loop, _client_loop_thread
+    _clients = {}
+    _clients_pid = os.getpid()
+    _clients_lock = threading.Lock()
+    _client_loop = None
+    _client_loop_thread = None
 
-        credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
 
-        if credentials_path:
-            credentials = service_account.Credentials.from_service_account_file(credentials_path)
-            print("Google NLP client initialized successfully with provided credentials.")
-            return language_v1.LanguageServiceClient(credentials=credentials)
+def get_client(name, factory):
+    """
+    Returns the process-wide client registered under name, creating it with factory() on first use.
+    Clients are created lazily, so pre-fork servers build them in each worker after the fork.
+    """
+    if _clients_pid != os.getpid():
+        _reset_clients_after_fork()
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+def _load_credentials():
+    credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+    if not credentials_path:
+        raise EnvironmentError("GOOGLE_APPLICATION_CREDENTIALS environment variable not set")
+    return service_account.Credentials.from_service_account_file(credentials_path)
+
+def nlp_api_endpoint():
+    """
+    host:port of a plaintext LanguageService to use instead of Google's, e.g. the fake server
+    from server.tools.fake_language_server. Unset means the real API.
+    """
+    return os.getenv('NLP_API_ENDPOINT') or None
+
+def create_nlp_client():
+    """Builds a new LanguageServiceClient on its own keepalive-enabled gRPC channel."""
+    try:
+        endpoint = nlp_api_endpoint()
+        if endpoint:
+            channel = grpc.insecure_channel(endpoint, options=NLP_CHANNEL_OPTIONS)
         else:
-            raise EnvironmentError("GOOGLE_APPLICATION_CREDENTIALS environment variable not set")
+            channel = LanguageServiceGrpcTransport.create_channel(credentials=_load_credentials(), options=NLP_CHANNEL_OPTIONS)
+        client = language_v1.LanguageServiceClient(transport=LanguageServiceGrpcTransport(channel=channel))
+        logger.info("Google NLP client initialized successfully with provided credentials.")
+        return client
     except Exception as e:
-        print(f"Error initializing Google NLP client: {e}")
+        logger.error("Error initializing Google NLP client: %s", e)
         raise
 
-def get_firestore_client():
-    credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-    if credentials_path:
-        credentials = service_account.Credentials.from_service_account_file(credentials_path)
-        return firestore.Client(credentials=credentials)
+def get_nlp_client():
+    # Load credentials from the environment variable once per process and reuse the channel
+    return get_client('nlp', create_nlp_client)
+
+def get_client_loop():
+    """Returns this process's background event loop for async clients, starting it on first use."""
+    global _client_loop, _client_loop_thread
+    if _clients_pid != os.getpid():
+        _reset_clients_after_fork()
+    with _clients_lock:
+        if _client_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="nlp-client-loop", daemon=True)
+            thread.start()
+            _client_loop, _client_loop_thread = loop, thread
+        return _client_loop
+
+def run_on_client_loop(coroutine):
+    """
+    Schedules coroutine on the client loop and returns an awaitable for the caller's own loop.
+    Use it for anything that touches get_async_nlp_client().
+    """
+    future = asyncio.run_coroutine_threadsafe(coroutine, get_client_loop())
+    return asyncio.wrap_future(future)
+
+def create_async_nlp_client():
+    endpoint = nlp_api_endpoint()
+    if endpoint:
+        channel = grpc.aio.insecure_channel(endpoint, options=NLP_CHANNEL_OPTIONS)
     else:
-        raise EnvironmentError("GOOGLE_APPLICATION_CREDENTIALS environment is not set")
+        channel = LanguageServiceGrpcAsyncIOTransport.create_channel(credentials=_load_credentials(), options=NLP_CHANNEL_OPTIONS)
+    return language_v1.LanguageServiceAsyncClient(transport=LanguageServiceGrpcAsyncIOTransport(channel=channel))
+
+def get_async_nlp_client():
+    # grpc.aio channels are bound to the loop they are created on, so only call this on the client loop
+    return get_client('nlp_async', create_async_nlp_client)
+
+def get_firestore_client():
+    def create_firestore_client():
+        return firestore.Client(credentials=_load_credentials())
+    return get_client('firestore', create_firestore_client)
+
+def warm_up_clients(send_request=False):
+    """
+    Creates the pooled clients ahead of the first request, e.g. from a gunicorn post_fork hook.
+    With send_request the NLP channel also completes its TLS handshake with a tiny request.
+    """
+    client = get_nlp_client()
+    if send_request:
+        document = language_v1.Document(content="ok", type_=language_v1.Document.Type.PLAIN_TEXT)
+        try:
+            client.analyze_sentiment(request={"document": document}, timeout=5)
+        except Exception as e:
+            logger.warning("NLP client warm-up request failed: %s", e)
+    return client
+
+def close_clients():
+    """Closes every pooled client owned by this process."""
+    global _clients
+    with _clients_lock:
+        clients, _clients = _clients, {}
+    if _clients_pid != os.getpid():
+        return
+    for name, client in clients.items():
+        try:
+            transport = getattr(client, 'transport', None)
+            result = transport.close() if transport is not None else client.close()
+            if inspect.isawaitable(result) and _client_loop is not None:
+                asyncio.run_coroutine_threadsafe(result, _client_loop).result(timeout=5)
+        except Exception as e:
+            logger.error("Error closing %s client: %s", name, e)
+    if _client_loop is not None:
+        _client_loop.call_soon_threadsafe(_client_loop.stop)
 
+atexit.register(close_clients)
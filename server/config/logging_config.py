@@ -0,0 +1,153 @@
+# Central logging setup.
+# Request threads only put log records on a queue; a single QueueListener thread formats them
+# and does the I/O, so a slow terminal or log shipper never holds up a request. DEBUG records
+# from chatty loggers can be sampled, and log messages never carry user text or request
+# payloads unless LOG_PAYLOADS=1 is set for local debugging.
+#
+# Settings (environment):
+#   LOG_LEVEL          root level, default INFO
+#   LOG_SAMPLE_RATES   per-logger share of DEBUG records kept, e.g.
+#                      "server.api_handler.api_services=0.01,server.api.task_controller=0.1"
+#   LOG_PAYLOADS       1 to include payloads (see payload()) in log messages
+
+import os
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s"
+
+_listener = None
+_lock = threading.Lock()
+
+
+def payload_logging_enabled():
+    return os.getenv('LOG_PAYLOADS') == '1'
+
+
+class _PayloadSummary:
+    """Formats as the value itself with LOG_PAYLOADS=1, otherwise as its type and size only."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        if payload_logging_enabled():
+            return repr(self.value)
+        try:
+            return f"<{type(self.value).__name__} len={len(self.value)}>"
+        except TypeError:
+            return f"<{type(self.value).__name__}>"
+
+    __repr__ = __str__
+
+
+def payload(value):
+    """
+    Wraps user data for a log argument, e.g. logger.debug("Request body: %s", payload(body)).
+    The value is only described (type and size) unless LOG_PAYLOADS=1.
+    """
+    return _PayloadSummary(value)
+
+
+def parse_sample_rates(spec):
+    """Parses "logger=rate,..." into {logger name: rate between 0 and 1}."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Keeps one in every 1/rate DEBUG records per configured logger (and its children);
+    records at INFO and above always pass. It runs on the calling thread, so it only counts:
+    a dict lookup and an increment per record.
+    """
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _rate_for(self, name):
+        while name:
+            if name in self.rates:
+                return name, self.rates[name]
+            name = name.rpartition(".")[0]
+        return None, 1.0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        name, rate = self._rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        interval = round(1 / rate)
+        with self._lock:
+            count = self._counters.get(name, 0)
+            self._counters[name] = count + 1
+        return count % interval == 0
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread. The stock handler merges
+    the message and arguments before enqueueing, which is the expensive part we want off
+    the request thread; log arguments should therefore be values that won't change later.
+    """
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level=None, sample_rates=None, handlers=None):
+    """
+    Routes all logging through a queue drained by one background listener thread.
+    handlers default to a stderr StreamHandler. Calling it again replaces the previous setup.
+    Returns the QueueListener.
+    """
+    global _listener
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES'))
+    if handlers is None:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers = [stream_handler]
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, DeferredQueueHandler):
+                root.removeHandler(handler)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        if sample_rates:
+            queue_handler.addFilter(DebugSamplingFilter(sample_rates))
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        return _listener
+
+
+def stop_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(stop_logging)
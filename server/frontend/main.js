@@ -3,23 +3,89 @@ const addTodoButton = document.querySelector(".todo-button");
 const todoList = document.querySelector(".todo-list");
 const filterDropdownMenu = document.querySelector(".filter-todo");
 
-document.addEventListener("DOMContentLoaded", getLocalTodos); 
+document.addEventListener("DOMContentLoaded", initializeTodos);
 addTodoButton.addEventListener("click", addTodoItem);
 todoList.addEventListener("click", handleTodoButtonClick);
 filterDropdownMenu.addEventListener("change", filterTodosByStatus);
 
-// Creates a new todo item and adds it to the local storage and DOM
-function addTodoItem() {
-    const todoItemDiv = document.createElement("div"); 
+// Restores the chosen filter, moves any todos left in local storage to the server and shows the list
+function initializeTodos() {
+    const dropdownStatus = localStorage.getItem("dropdownStatus");
+    if (dropdownStatus !== null) {
+        filterDropdownMenu.value = dropdownStatus;
+    }
+    migrateLocalTodos()
+        .catch(function (error) {
+            console.error("Could not move local todos to the server", error);
+        })
+        .then(loadTodos);
+}
+
+// Sends create/update/delete operations to the server in one request and returns their results
+function sendTodoOperations(operations) {
+    return fetch("/todos/bulk", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ operations: operations })
+    }).then(function (response) {
+        return response.json().then(function (data) {
+            if (!response.ok) {
+                throw new Error(data.error || "Request failed");
+            }
+            return data.results;
+        });
+    });
+}
+
+// Fetches every page of todos for the chosen filter; the server does the filtering
+function loadTodos() {
+    const status = filterDropdownMenu.value;
+    todoList.innerHTML = "";
+
+    function loadPage(cursor) {
+        const params = new URLSearchParams();
+        if (status !== "all") {
+            params.set("status", status);
+        }
+        if (cursor) {
+            params.set("cursor", cursor);
+        }
+        return fetch("/todos?" + params.toString())
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error("Could not load todos");
+                }
+                return response.json();
+            })
+            .then(function (page) {
+                page.tasks.forEach(function (task) {
+                    todoList.appendChild(createTodoElement(task));
+                });
+                if (page.nextCursor) {
+                    return loadPage(page.nextCursor);
+                }
+            });
+    }
+    return loadPage(null).catch(function (error) {
+        console.error(error);
+    });
+}
+
+// Builds the DOM element for a single todo
+function createTodoElement(task) {
+    const todoItemDiv = document.createElement("div");
     todoItemDiv.classList.add("todo");
+    todoItemDiv.id = task.id;
+    if (task.status === "finished") {
+        todoItemDiv.classList.add("finished");
+    }
+
     const newTodo = document.createElement("li");
-    newTodo.innerText = todoInput.value;
+    newTodo.innerText = task.description;
     newTodo.classList.add("todo-item");
-    todoItemDiv.appendChild(newTodo); 
-    const newTodoObject = addTodoToLocalStorage(todoInput.value); 
-    todoItemDiv.id = newTodoObject.id 
+    todoItemDiv.appendChild(newTodo);
 
-    const orangeCheckMarkButton = document.createElement("Button");
+    const orangeCheckMarkButton = document.createElement("button");
     orangeCheckMarkButton.innerHTML = '<i class="fas fa-check-circle"></i>';
     orangeCheckMarkButton.classList.add("check-mark-btn");
     todoItemDiv.appendChild(orangeCheckMarkButton);
@@ -28,146 +94,101 @@ function addTodoItem() {
     grayTrashButton.innerHTML = '<i class="fas fa-trash"></i>';
     grayTrashButton.classList.add("trash-btn");
     todoItemDiv.appendChild(grayTrashButton);
-    todoList.appendChild(todoItemDiv); 
-    todoInput.value = ""; // Clear the input field to prepare for the next entry
+    return todoItemDiv;
 }
-// Deletes or marks a to-do item as complete based on the button clicked
-function handleTodoButtonClick(e) {   
-    const clickedItem = e.target; 
-    if (clickedItem.classList[0] === "trash-btn") {
-        const todoItemDiv = clickedItem.parentElement; 
-        todoItemDiv.classList.add("slide"); 
-        removeLocalTodoItems(todoItemDiv.id); 
-        todoItemDiv.addEventListener("transitionend", function () {
-            todoItemDiv.remove(); 
+
+// Creates a new todo item on the server and adds it to the DOM
+function addTodoItem(e) {
+    e.preventDefault(); // The button submits the form, which would reload the page
+    const description = todoInput.value.trim();
+    if (!description) {
+        return;
+    }
+    sendTodoOperations([{ op: "create", description: description }])
+        .then(function (results) {
+            if (filterDropdownMenu.value !== "finished") {
+                todoList.appendChild(createTodoElement(results[0].task));
+            }
+            todoInput.value = ""; // Clear the input field to prepare for the next entry
+        })
+        .catch(function (error) {
+            console.error(error);
         });
+}
+
+// Deletes or marks a to-do item as complete based on the button clicked
+function handleTodoButtonClick(e) {
+    const clickedItem = e.target.closest("button");
+    if (!clickedItem) {
+        return;
     }
+    const todoItemDiv = clickedItem.parentElement;
+    const todoId = Number(todoItemDiv.id);
 
-    if (clickedItem.classList.contains("check-mark-btn")) {
-        const todo = clickedItem.parentElement;
-        updateLocalTodos(todo.id);
-        todo.classList.toggle("finished");
+    if (clickedItem.classList.contains("trash-btn")) {
+        sendTodoOperations([{ op: "delete", id: todoId }])
+            .then(function () {
+                todoItemDiv.classList.add("slide");
+                todoItemDiv.addEventListener("transitionend", function () {
+                    todoItemDiv.remove();
+                });
+            })
+            .catch(function (error) {
+                console.error(error);
+            });
     }
 
-}
-// This function manages the display of todo items based on the chosen dropdown option
-function filterTodosByStatus(e) { 
-    const todos = todoList.childNodes; 
-    localStorage.setItem("dropdownStatus", e.target.value)
-    todos.forEach(function (todo) {
-        switch (e.target.value) {  // Switch statement to handle different cases based on dropdownStatus(all, finished, or awaiting)
-            case "all":
-                todo.style.display = "flex";
-                break; 
-            case "finished":
-                if (todo.classList.contains("finished")) {
-                    todo.style.display = "flex";  // This line allows the CSS portion .finished to play out 
-                } else {
-                    todo.style.display = "none";
-                }
-                break;
-            case "awaiting":
-                if (!todo.classList.contains("finished")) {
-                    todo.style.display = "flex";
-                } else {
-                    todo.style.display = "none";
+    if (clickedItem.classList.contains("check-mark-btn")) {
+        const newStatus = todoItemDiv.classList.contains("finished") ? "awaiting" : "finished";
+        sendTodoOperations([{ op: "update", id: todoId, status: newStatus }])
+            .then(function () {
+                todoItemDiv.classList.toggle("finished");
+                // The item no longer matches the filter it was loaded with
+                if (filterDropdownMenu.value !== "all" && filterDropdownMenu.value !== newStatus) {
+                    todoItemDiv.remove();
                 }
-                break;
-        }
-    });
-}
-
-// Adds a new to-do item to local storage and returns the to-do object
-function addTodoToLocalStorage(todo) {
-    let todos;  
-    if (localStorage.getItem("todos") === null) {
-        todos = [];
-    } else {
-        todos = JSON.parse(localStorage.getItem("todos"));
+            })
+            .catch(function (error) {
+                console.error(error);
+            });
     }
-    const todoObject = { text: todo, status: "awaiting", id: new Date().getTime() } // Generates unique ID for each todo item based on the current timestamp
-    todos.push(todoObject);
-    localStorage.setItem("todos", JSON.stringify(todos));
-    return todoObject
 }
-// Retrieves to-do items from local storage and displays them based on dropdown status.
-function getLocalTodos() {
-    let todos; 
-    let dropdownStatus = localStorage.getItem("dropdownStatus");
-    if (dropdownStatus !== null) {
-        filterDropdownMenu.value = dropdownStatus;
-    }
-    if (localStorage.getItem("todos") === null) {
-        todos = [];
-    } else {
-        todos = JSON.parse(localStorage.getItem("todos"));
-    }
-    // Function to create and display a single to-do item
-    function createAndDisplayTodoItem(todoObject) {
-        const todoItemDiv = document.createElement("div");
-                todoItemDiv.classList.add("todo");
-                const newTodo = document.createElement("li");
-                if (dropdownStatus === null || dropdownStatus === "all" || dropdownStatus === todoObject.status) {
-                    todoItemDiv.style.display = "flex";
-                } else {
-                    todoItemDiv.style.display = "none";
-                }
-                newTodo.innerText = todoObject.text; 
-                newTodo.classList.add("todo-item");
-                todoItemDiv.appendChild(newTodo);
-                todoItemDiv.id = todoObject.id;
-                if (todoObject.status === "finished") {
-                    todoItemDiv.classList.add("finished");
-                }
-            const orangeCheckMarkButton = document.createElement("button");
-            orangeCheckMarkButton.innerHTML = '<i class="fas fa-check-circle"></i>';
-            orangeCheckMarkButton.classList.add("check-mark-btn");
-            todoItemDiv.appendChild(orangeCheckMarkButton);
 
-            const grayTrashButton = document.createElement("button");
-            grayTrashButton.innerHTML = '<i class="fas fa-trash"></i>';
-            grayTrashButton.classList.add("trash-btn");
-            todoItemDiv.appendChild(grayTrashButton);
-
-            todoList.appendChild(todoItemDiv);
-        }
-        todos.forEach(createAndDisplayTodoItem);
+// Reloads the list from the server for the chosen dropdown option (all, finished, or awaiting)
+function filterTodosByStatus(e) {
+    localStorage.setItem("dropdownStatus", e.target.value);
+    loadTodos();
 }
 
-// Removes a todo item from local storage based on its ID
-function removeLocalTodoItems(todoId) {
-    let todos;
-    if (localStorage.getItem("todos") === null) {
-        todos = [];
-    } else {
-        todos = JSON.parse(localStorage.getItem("todos"));
-    }
-    const updateTodos = todos.filter(function (todoObject) {
-        return todoId != todoObject.id
+// Matches the server's default TODO_BULK_MAX_OPERATIONS; larger requests are rejected
+const TODO_BULK_CHUNK_SIZE = 500;
 
+// Uploads todos saved by earlier versions of this page, which kept them only in local storage.
+// They go up in chunks the server accepts; after each chunk only the todos not yet uploaded stay
+// in local storage, so a failed migration resumes on the next load without creating duplicates.
+function migrateLocalTodos() {
+    const storedTodos = localStorage.getItem("todos");
+    if (storedTodos === null) {
+        return Promise.resolve();
+    }
+    const todoObjects = JSON.parse(storedTodos).filter(function (todoObject) {
+        return todoObject.text && todoObject.text.trim();
     });
 
-    localStorage.setItem("todos", JSON.stringify(updateTodos));
-}
-
-// Updates the status of a todo item in local storage based on its ID
-function updateLocalTodos(todoId) {
-    let todos;
-    if (localStorage.getItem("todos") === null) {
-        todos = [];
-    } else {
-        todos = JSON.parse(localStorage.getItem("todos"));
-    }
-    // Iterates through each todo item; if its ID matches the given ID, toggles its status, creating a new array with updated todo items.
-    const updatedTodos = todos.map(function (todoObject) {
-        if (todoId == todoObject.id) {
-            let currentStatus = todoObject.status;
-            todoObject.status = currentStatus === "awaiting" ? "finished" : "awaiting" 
-           
+    function uploadFrom(start) {
+        if (start >= todoObjects.length) {
+            localStorage.removeItem("todos");
+            return Promise.resolve();
         }
-        return todoObject 
-
-    });
-    localStorage.setItem("todos", JSON.stringify(updatedTodos)); 
+        const operations = todoObjects.slice(start, start + TODO_BULK_CHUNK_SIZE).map(function (todoObject) {
+            return { op: "create", description: todoObject.text, status: todoObject.status === "finished" ? "finished" : "awaiting" };
+        });
+        return sendTodoOperations(operations).then(function () {
+            const next = start + operations.length;
+            localStorage.setItem("todos", JSON.stringify(todoObjects.slice(next)));
+            return uploadFrom(next);
+        });
+    }
 
-}
\ No newline at end of file
+    return uploadFrom(0);
+}
@@ -1,6 +1,7 @@
 
 from ..api_services.api_services import preprocess_text
 from server.api_services.api_services import preprocess_text
+from server.api_handler.api_services import preprocess_texts
 
 
 
@@ -10,3 +11,12 @@ class Task:
 
     def preprocess(self):
         return preprocess_text(self.description)
+
+    @staticmethod
+    def preprocess_many(tasks, workers=None, chunksize=None):
+        """
+        Preprocesses the descriptions of many tasks, in order.
+        Large lists are spread across a process pool instead of running one at a time.
+        """
+        descriptions = (task.description for task in tasks)
+        return list(preprocess_texts(descriptions, workers=workers, chunksize=chunksize, preprocess=preprocess_text))
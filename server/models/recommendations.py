@@ -0,0 +1,217 @@
+# Precomputed task recommendations for every user.
+# A nightly job reads every enriched task from the task index and every user's latest mood
+# score into NumPy arrays, classifies all moods against each user's thresholds and picks
+# the matching and recommended tasks for all users in a few vectorized passes. These are the
+# batch counterparts of MoodUser.classify_mood, compare_mood_with_tasks and
+# recommend_tasks_based_on_analysis. It stores one small document of task IDs per user,
+# which the dashboard reads in the morning instead of analyzing anything itself.
+
+import logging
+import time
+
+import numpy as np
+from google.cloud import firestore
+
+from server.api_handler.resilience import deadline_kwargs
+from server.models.task_index import TASKS_COLLECTION, READY
+from server.models.user_sqlalchemy_firestore_models import DEFAULT_POSITIVE_THRESHOLD, DEFAULT_NEGATIVE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATIONS_COLLECTION = 'recommendations'
+USERS_COLLECTION = 'users'
+# Same cut-off as recommend_tasks_based_on_analysis
+RECOMMENDED_SENTIMENT_THRESHOLD = 0.5
+DEFAULT_RECOMMENDATIONS_PER_USER = 20
+MOOD_CATEGORIES = {-1: 'negative', 0: 'neutral', 1: 'positive'}
+# Firestore allows at most 500 writes per batch
+WRITE_BATCH_SIZE = 400
+
+
+def _number(value, default=0.0):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else default
+
+
+class TaskTable:
+    """
+    Every ready task as parallel arrays: task i belongs to user_ids[user[i]].
+    Positions keep each user's task order, which breaks ranking ties as in the live ranking.
+    """
+    def __init__(self, user_ids, user, task_ids, sentiment, priority, position):
+        self.user_ids = user_ids
+        self.user = user
+        self.task_ids = task_ids
+        self.sentiment = sentiment
+        self.priority = priority
+        self.position = position
+
+    def __len__(self):
+        return len(self.task_ids)
+
+
+class MoodTable:
+    """Latest mood score (NaN if none) and mood thresholds per user, aligned with TaskTable.user_ids."""
+    def __init__(self, score, positive_threshold, negative_threshold):
+        self.score = score
+        self.positive_threshold = positive_threshold
+        self.negative_threshold = negative_threshold
+
+
+def load_task_table(db):
+    """Reads the ranking fields of every enriched task; the sealed task text is never fetched."""
+    user_positions = {}
+    users, task_ids, sentiments, priorities, positions = [], [], [], [], []
+    query = db.collection(TASKS_COLLECTION).where('status', '==', READY).select(
+        ['userId', 'taskId', 'sentimentScore', 'priority', 'position'])
+    for doc in query.stream():
+        data = doc.to_dict()
+        users.append(user_positions.setdefault(data['userId'], len(user_positions)))
+        task_ids.append(data['taskId'])
+        sentiments.append(_number(data.get('sentimentScore')))
+        priorities.append(_number(data.get('priority')))
+        positions.append(data.get('position', 0))
+    return TaskTable(
+        list(user_positions),
+        np.array(users, dtype=np.int64),
+        np.array(task_ids, dtype=object),
+        np.array(sentiments, dtype=np.float64),
+        np.array(priorities, dtype=np.float64),
+        np.array(positions, dtype=np.int64)
+    )
+
+
+def load_mood_table(db, user_ids):
+    """Reads the latest mood score and any custom thresholds of the given users."""
+    count = len(user_ids)
+    moods = MoodTable(np.full(count, np.nan), np.full(count, DEFAULT_POSITIVE_THRESHOLD),
+                      np.full(count, DEFAULT_NEGATIVE_THRESHOLD))
+    user_positions = {str(user_id): index for index, user_id in enumerate(user_ids)}
+    query = db.collection(USERS_COLLECTION).select(['latestMoodScore', 'positiveThreshold', 'negativeThreshold'])
+    for doc in query.stream():
+        index = user_positions.get(doc.id)
+        if index is None:
+            continue
+        data = doc.to_dict()
+        moods.score[index] = _number(data.get('latestMoodScore'), np.nan)
+        moods.positive_threshold[index] = _number(data.get('positiveThreshold'), DEFAULT_POSITIVE_THRESHOLD)
+        moods.negative_threshold[index] = _number(data.get('negativeThreshold'), DEFAULT_NEGATIVE_THRESHOLD)
+    return moods
+
+
+def classify_moods(moods):
+    """Vectorized MoodUser.classify_mood: 1 positive, -1 negative, 0 neutral (also without a mood)."""
+    return np.where(moods.score > moods.positive_threshold, 1,
+                    np.where(moods.score < moods.negative_threshold, -1, 0))
+
+
+def _first_per_user(order, users, user_count, limit):
+    """Keeps the first `limit` entries of each user's run in a user-sorted selection, split per user."""
+    if limit is not None:
+        starts = np.searchsorted(users, np.arange(user_count))
+        keep = np.arange(len(users)) - starts[users] < limit
+        order, users = order[keep], users[keep]
+    return np.split(order, np.cumsum(np.bincount(users, minlength=user_count))[:-1])
+
+
+def compute_recommendations(tasks, moods, limit=DEFAULT_RECOMMENDATIONS_PER_USER):
+    """
+    Returns (mood codes per user, matching task indexes per user, recommended task indexes per user).
+    Both task lists are in the order reorganize_tasks_based_on_mood_and_sentiment ranks the
+    user's tasks in for a mood score of that category (a user without a mood counts as neutral),
+    capped at `limit` tasks each (None for all of them).
+    """
+    user_count = len(tasks.user_ids)
+    mood_codes = classify_moods(moods)
+    task_mood = mood_codes[tasks.user]
+
+    # Sort by user, then by the mood's ranking keys (see task_ranking_keys), then by position
+    primary = np.where(task_mood >= 0, -tasks.priority, tasks.priority)
+    secondary = np.where(task_mood == 0, 0.0, -tasks.sentiment)
+    order = np.lexsort((tasks.position, secondary, primary, tasks.user))
+    ordered_users = tasks.user[order]
+
+    # compare_mood_with_tasks: the task's sentiment has the same sign as the mood
+    matching = np.sign(tasks.sentiment[order]) == task_mood[order]
+    recommended = tasks.sentiment[order] > RECOMMENDED_SENTIMENT_THRESHOLD
+    return (
+        mood_codes,
+        _first_per_user(order[matching], ordered_users[matching], user_count, limit),
+        _first_per_user(order[recommended], ordered_users[recommended], user_count, limit)
+    )
+
+
+def recommendation_documents(tasks, moods, limit=DEFAULT_RECOMMENDATIONS_PER_USER):
+    """Yields (user ID, recommendation document) for every user with ready tasks."""
+    mood_codes, matching, recommended = compute_recommendations(tasks, moods, limit)
+    task_counts = np.bincount(tasks.user, minlength=len(tasks.user_ids))
+    for index, user_id in enumerate(tasks.user_ids):
+        score = moods.score[index]
+        yield user_id, {
+            'moodCategory': MOOD_CATEGORIES[int(mood_codes[index])],
+            'moodScore': None if np.isnan(score) else float(score),
+            'matchingTaskIds': tasks.task_ids[matching[index]].tolist(),
+            'recommendedTaskIds': tasks.task_ids[recommended[index]].tolist(),
+            'taskCount': int(task_counts[index]),
+            'generatedAt': firestore.SERVER_TIMESTAMP
+        }
+
+
+def store_recommendations(db, documents):
+    """Writes the documents in batches; returns how many were written."""
+    written = 0
+    batch = db.batch()
+    for user_id, document in documents:
+        batch.set(db.collection(RECOMMENDATIONS_COLLECTION).document(str(user_id)), document)
+        written += 1
+        if written % WRITE_BATCH_SIZE == 0:
+            batch.commit()
+            batch = db.batch()
+    if written % WRITE_BATCH_SIZE:
+        batch.commit()
+    return written
+
+
+def run_nightly_recommendations(db=None, limit=DEFAULT_RECOMMENDATIONS_PER_USER):
+    """Loads, computes and stores everyone's recommendations. Returns counts and timings."""
+    db = db or firestore.Client()
+    started = time.perf_counter()
+    tasks = load_task_table(db)
+    moods = load_mood_table(db, tasks.user_ids)
+    loaded = time.perf_counter()
+    written = store_recommendations(db, recommendation_documents(tasks, moods, limit))
+    finished = time.perf_counter()
+    stats = {
+        'users': written,
+        'tasks': len(tasks),
+        'load_seconds': loaded - started,
+        'compute_and_store_seconds': finished - loaded
+    }
+    logger.info("Nightly recommendations: %s", stats)
+    return stats
+
+
+def get_recommendations(user_id, task_index, db=None):
+    """
+    The user's precomputed recommendations with task descriptions, or None if the nightly
+    job hasn't produced any yet. Tasks deleted since the job ran are left out.
+    """
+    db = db or task_index.db
+    try:
+        doc = db.collection(RECOMMENDATIONS_COLLECTION).document(str(user_id)).get(**deadline_kwargs())
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        entries = task_index.load(str(user_id)).entries
+
+        def descriptions(task_ids):
+            return [entries[task_id]['task']['description'] for task_id in task_ids if task_id in entries]
+
+        return {
+            'moodCategory': data.get('moodCategory'),
+            'matchingTasks': descriptions(data.get('matchingTaskIds', [])),
+            'recommendedTasks': descriptions(data.get('recommendedTaskIds', [])),
+            'generatedAt': data.get('generatedAt')
+        }
+    except Exception as e:
+        logger.error("Error loading recommendations for user %s: %s", user_id, e)
+        return None
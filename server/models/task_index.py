@@ -0,0 +1,268 @@
+# Per-user task index.
+# Tasks are stored once in Firestore (one document per task, the user's text sealed with the user's key)
+# and enriched in the background right after each write: preprocessed text and sentiment score
+# are computed then, not on every analysis. A version token per user changes with every edit,
+# so clients can send the token (or task IDs) instead of resending their whole task list, and a
+# process keeps the decrypted index in memory until the token moves on.
+# User IDs are always handled as strings, so an integer ID and its string form share one index.
+
+import json
+import hashlib
+import logging
+import os
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import firestore
+
+from server.api_handler.api_services import preprocess_texts
+from server.api_handler.resilience import deadline_kwargs
+from server.api_handler.user_keys import user_keyring
+
+logger = logging.getLogger(__name__)
+
+TASKS_COLLECTION = 'taskIndex'
+VERSIONS_COLLECTION = 'taskIndexVersions'
+PENDING = 'pending'
+READY = 'ready'
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+
+class StaleTaskIndexVersion(Exception):
+    """The client's version token no longer matches the user's task index."""
+    def __init__(self, current_version):
+        super().__init__("Task index version is stale")
+        self.current_version = current_version
+
+
+class UserTaskIndex:
+    """One user's decrypted tasks as held in memory, keyed by task ID in insertion order."""
+    def __init__(self, version, entries=None):
+        self.version = version
+        self.entries = entries if entries is not None else OrderedDict()
+
+    def pending_ids(self):
+        return [task_id for task_id, entry in self.entries.items() if entry['status'] != READY]
+
+    def tasks_and_scores(self, task_ids=None):
+        """Returns (tasks, scores by description) for ranking, in index order or task_ids order."""
+        if task_ids is None:
+            entries = list(self.entries.values())
+        else:
+            missing = [task_id for task_id in task_ids if task_id not in self.entries]
+            if missing:
+                raise ValueError(f"Unknown task IDs: {', '.join(map(str, missing))}")
+            entries = [self.entries[task_id] for task_id in task_ids]
+        tasks = [dict(entry['task'], id=entry['id'], priority=entry['priority']) for entry in entries]
+        scores = {entry['task']['description']: entry['sentimentScore'] for entry in entries}
+        return tasks, scores
+
+
+class TaskIndex:
+    """
+    Stores each user's tasks with their precomputed ranking keys.
+    score_descriptions(descriptions) -> {description: score} scores descriptions at write time
+    (the task controller passes build_sentiment_plan, so packing and the sentiment cache apply).
+    """
+    def __init__(self, score_descriptions, db=None, max_cached_users=1024, workers=None):
+        self.score_descriptions = score_descriptions
+        self.db = db or firestore.Client()
+        self.max_cached_users = max_cached_users
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # A user's lock lives only while some thread holds or waits for it
+        self._user_locks = weakref.WeakValueDictionary()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv('TASK_INDEX_WORKERS', 2)), thread_name_prefix="task-index"
+        )
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.Lock()
+            return lock
+
+    def _document_id(self, user_id, task_id):
+        # Hashing both parts length-prefixed keeps IDs unique whatever characters the IDs contain
+        key = f"{len(user_id)}:{user_id}:{task_id}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _seal(self, user_id, task, preprocessed_text):
+        payload = json.dumps({'task': task, 'preprocessedText': preprocessed_text})
+        return user_keyring.cipher(user_id).encrypt(payload.encode()).decode()
+
+    def _unseal(self, document):
+        payload = json.loads(user_keyring.cipher(document['userId']).decrypt(document['payload'].encode()).decode('utf-8'))
+        return {
+            'id': document['taskId'],
+            'task': payload['task'],
+            'preprocessedText': payload['preprocessedText'],
+            'priority': document.get('priority', 0),
+            'position': document.get('position', 0),
+            'sentimentScore': document.get('sentimentScore'),
+            'status': document.get('status', PENDING)
+        }
+
+    def _task_reference(self, user_id, task_id):
+        return self.db.collection(TASKS_COLLECTION).document(self._document_id(user_id, task_id))
+
+    def _entry_write(self, user_id, entry):
+        """The (reference, document) write that stores an entry."""
+        return self._task_reference(user_id, entry['id']), {
+            'userId': user_id,
+            'taskId': entry['id'],
+            'payload': self._seal(user_id, entry['task'], entry['preprocessedText']),
+            'priority': entry['priority'],
+            'position': entry['position'],
+            'sentimentScore': entry['sentimentScore'],
+            'status': entry['status'],
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        }
+
+    def _commit(self, writes):
+        """
+        Applies (reference, document) writes, a None document meaning a delete, in as few
+        batches as Firestore allows, so syncing many tasks costs a round trip per batch.
+        """
+        for start in range(0, len(writes), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for reference, document in writes[start:start + MAX_BATCH_WRITES]:
+                if document is None:
+                    batch.delete(reference)
+                else:
+                    batch.set(reference, document)
+            batch.commit(**deadline_kwargs())
+
+    def _remember(self, user_id, index):
+        with self._lock:
+            self._cache[user_id] = index
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.max_cached_users:
+                self._cache.popitem(last=False)
+
+    def current_version(self, user_id):
+        doc = self.db.collection(VERSIONS_COLLECTION).document(str(user_id)).get(**deadline_kwargs())
+        return doc.to_dict().get('version') if doc.exists else None
+
+    def load(self, user_id):
+        """Returns the user's UserTaskIndex, from memory while its version is still current."""
+        user_id = str(user_id)
+        version = self.current_version(user_id)
+        with self._lock:
+            index = self._cache.get(user_id)
+        if index is not None and index.version == version:
+            return index
+        entries = OrderedDict()
+        query = self.db.collection(TASKS_COLLECTION).where('userId', '==', user_id)
+        for doc in query.stream(**deadline_kwargs()):
+            entry = self._unseal(doc.to_dict())
+            entries[entry['id']] = entry
+        # Keep the order tasks were added in; ranking ties are broken by it
+        index = UserTaskIndex(version, OrderedDict(sorted(entries.items(), key=lambda item: item[1]['position'])))
+        self._remember(user_id, index)
+        return index
+
+    def upsert(self, user_id, tasks, delete_ids=()):
+        """
+        Adds or replaces tasks (dicts with a description, optional id and priority) and deletes
+        delete_ids. New and edited tasks are enriched in the background.
+        Returns (task IDs in the order given, new version token).
+        """
+        for task in tasks:
+            if not isinstance(task, dict) or not isinstance(task.get('description'), str):
+                raise ValueError("Each task must be a dictionary with a 'description' string")
+        user_id = str(user_id)
+        with self._user_lock(user_id):
+            index = self.load(user_id)
+            entries = OrderedDict(index.entries)
+            changed = []
+            task_ids = []
+            writes = []
+            next_position = max((entry['position'] for entry in entries.values()), default=-1) + 1
+            for task in tasks:
+                task_id = str(task.get('id') or uuid.uuid4().hex)
+                stored_task = {key: value for key, value in task.items() if key not in ('id', 'priority', 'sentiment_score')}
+                previous = entries.get(task_id)
+                if previous is None:
+                    position, next_position = next_position, next_position + 1
+                else:
+                    position = previous['position']
+                entry = {
+                    'id': task_id,
+                    'task': stored_task,
+                    'priority': task.get('priority', 0),
+                    'position': position,
+                    'preprocessedText': None,
+                    'sentimentScore': None,
+                    'status': PENDING
+                }
+                if previous is not None and previous['task']['description'] == stored_task['description']:
+                    # Same text: keep the enrichment, only the other fields changed
+                    entry.update(preprocessedText=previous['preprocessedText'], sentimentScore=previous['sentimentScore'],
+                                 status=previous['status'])
+                entries[task_id] = entry
+                task_ids.append(task_id)
+                writes.append(self._entry_write(user_id, entry))
+                if entry['status'] != READY:
+                    changed.append(task_id)
+            for task_id in map(str, delete_ids):
+                if entries.pop(task_id, None) is not None:
+                    writes.append((self._task_reference(user_id, task_id), None))
+
+            version = uuid.uuid4().hex
+            # Last, so the version only moves once every task write has been committed
+            writes.append((self.db.collection(VERSIONS_COLLECTION).document(user_id),
+                           {'version': version, 'updatedAt': firestore.SERVER_TIMESTAMP}))
+            self._commit(writes)
+            self._remember(user_id, UserTaskIndex(version, entries))
+
+        if changed:
+            self._executor.submit(self._enrich_logged, user_id, changed)
+        return task_ids, version
+
+    def _enrich_logged(self, user_id, task_ids):
+        try:
+            self.enrich(user_id, task_ids)
+        except Exception as e:
+            logger.error("Error enriching tasks for user %s: %s", user_id, e)
+
+    def enrich(self, user_id, task_ids):
+        """Computes preprocessed text and sentiment for the given tasks that still need them."""
+        user_id = str(user_id)
+        with self._user_lock(user_id):
+            index = self.load(user_id)
+            entries = [index.entries[task_id] for task_id in task_ids
+                       if task_id in index.entries and index.entries[task_id]['status'] != READY]
+            if not entries:
+                return index
+            descriptions = [entry['task']['description'] for entry in entries]
+            scores = self.score_descriptions(descriptions)
+            enriched = [dict(entry, preprocessedText=preprocessed_text, sentimentScore=scores[entry['task']['description']],
+                             status=READY)
+                        for entry, preprocessed_text in zip(entries, preprocess_texts(descriptions))]
+            self._commit([self._entry_write(user_id, entry) for entry in enriched])
+            # Only show the entries as ready once they are stored; readers seeing them pending wait on the lock
+            for entry in enriched:
+                index.entries[entry['id']] = entry
+            return index
+
+    def ranking_input(self, user_id, task_ids=None, version=None):
+        """
+        Returns (tasks, scores by description, version) for ranking the user's indexed tasks.
+        Raises StaleTaskIndexVersion if version is given and no longer current. Tasks whose
+        background enrichment hasn't finished yet are enriched on the spot.
+        """
+        user_id = str(user_id)
+        index = self.load(user_id)
+        if version is not None and version != index.version:
+            raise StaleTaskIndexVersion(index.version)
+        pending = index.pending_ids()
+        if pending:
+            index = self.enrich(user_id, pending)
+        tasks, scores = index.tasks_and_scores(task_ids)
+        return tasks, scores, index.version
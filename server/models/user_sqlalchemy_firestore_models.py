@@ -7,46 +7,144 @@
 
 from server.api_handler.api_services import (
     preprocess_text, send_to_google_nlp_api, parse_api_response,
-    extract_sentiment_score, extract_keywords
+    extract_sentiment_score, extract_keywords, fast_tokenize
 )
+from server.api_handler.sentiment_model import get_user_sentiment_model, update_user_sentiment_model
+from server.api_handler.resilience import deadline_kwargs, nlp_breaker
+from server.api_handler.bulk_crypto import decrypt_many
+from server.api_handler.user_keys import encryption_key, master_cipher as cipher_suite, user_keyring
+from server.config.logging_config import payload
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from google.cloud import firestore
 import bcrypt
-from cryptography.fernet import Fernet
 import os
+import hmac
+import json
+import zlib
+import base64
+import functools
+import hashlib
 import logging
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
 db = SQLAlchemy()
-encryption_key = os.getenv('ENCRYPTION_KEY').encode()
-cipher_suite = Fernet(encryption_key)
-logging.basicConfig(level=logging.DEBUG)
+DEFAULT_POSITIVE_THRESHOLD = 0.25
+DEFAULT_NEGATIVE_THRESHOLD = -0.25
 logger = logging.getLogger(__name__)
 
-def encrypt_data(data):
-    """Encrypt data with basic logging."""
+def encrypt_data(data, cipher=None):
+    """Encrypt data with basic logging; with the master key unless a (user) cipher is given."""
     if isinstance(data, str):
         try:
-            logger.debug(f"Encrypting string data: {data}")
-            encrypted_data = cipher_suite.encrypt(data.encode())
-            encrypted_text = encrypted_data.decode()
-            logger.debug(f"Encrypted data: {encrypted_text}")
-            return encrypted_text
+            return (cipher or cipher_suite).encrypt(data.encode()).decode()
         except Exception as e:
-            logger.error(f"Error encrypting string data '{data}': {e}")
+            logger.error("Error encrypting string data %s: %s", payload(data), e)
             raise
     elif isinstance(data, dict):
         try:
-            logger.debug(f"Encrypting dictionary data: {data}")
-            encrypted_dict = {k: encrypt_data(v) for k, v in data.items()}
-            return encrypted_dict
+            return {k: encrypt_data(v, cipher) for k, v in data.items()}
         except Exception as e:
-            logger.error(f"Error encrypting dictionary data '{data}': {e}")
+            logger.error("Error encrypting dictionary data %s: %s", payload(data), e)
             raise
     else:
-        logger.debug(f"Data of unsupported type: {data}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Data of unsupported type left unencrypted: %s", type(data).__name__)
         return data
 
+# Mood analysis records keep their sensitive fields in one sealed envelope: a single Fernet
+# token (one IV, one HMAC) over a version byte, a codec byte and the JSON-encoded fields,
+# zlib-compressed when that makes it smaller. Documents written before this format encrypted
+# each field separately; open_mood_record() reads both.
+MOOD_RECORD_VERSION = 1
+MOOD_RECORD_SEALED_FIELDS = ('inputText', 'keywords', 'moodCategory')
+CODEC_JSON = 0
+CODEC_ZLIB_JSON = 1
+# Shorter bodies rarely shrink enough to pay for compressing them
+MOOD_RECORD_COMPRESS_MIN_BYTES = 256
+
+def seal_mood_record(fields, cipher=None):
+    """Seals the given fields into one authenticated token (a str, as Firestore stores it)."""
+    body = json.dumps(fields, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    codec = CODEC_JSON
+    if len(body) >= MOOD_RECORD_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body, codec = compressed, CODEC_ZLIB_JSON
+    return (cipher or cipher_suite).encrypt(bytes([MOOD_RECORD_VERSION, codec]) + body).decode()
+
+def unseal_mood_record(token, cipher=None):
+    """Inverse of seal_mood_record. Raises ValueError for an unknown version or codec."""
+    envelope = (cipher or cipher_suite).decrypt(token.encode())
+    version, codec, body = envelope[0], envelope[1], envelope[2:]
+    if version != MOOD_RECORD_VERSION:
+        raise ValueError(f"Unsupported mood record version: {version}")
+    if codec == CODEC_ZLIB_JSON:
+        body = zlib.decompress(body)
+    elif codec != CODEC_JSON:
+        raise ValueError(f"Unsupported mood record codec: {codec}")
+    return json.loads(body.decode('utf-8'))
+
+def open_mood_record(document, cipher=None):
+    """
+    Returns a stored mood analysis document with its sensitive fields decrypted, whether it
+    is sealed or in the legacy format with every field encrypted on its own
+    """
+    record = {k: v for k, v in document.items() if k != 'sealed'}
+    if 'sealed' in document:
+        record.update(unseal_mood_record(document['sealed'], cipher))
+        return record
+    cipher = cipher or cipher_suite
+
+    def decrypt(value):
+        return cipher.decrypt(value.encode()).decode('utf-8')
+
+    for field in ('inputText', 'moodCategory'):
+        if isinstance(record.get(field), str):
+            record[field] = decrypt(record[field])
+    if 'keywords' in record:
+        record['keywords'] = [decrypt(k) for k in record['keywords']]
+    return record
+
+# Blind keyword index: next to the sealed keywords, each mood record stores a keyed HMAC of
+# every keyword, so a user's entries can be searched with one array_contains query without
+# decrypting anything. The user ID is part of the HMAC input, so the same word gives
+# different tokens for different users. The key is BLIND_INDEX_KEY (urlsafe base64) or,
+# without it, derived from ENCRYPTION_KEY; changing it makes existing tokens unsearchable.
+BLIND_INDEX_TOKEN_BYTES = 16
+
+def _load_blind_index_key():
+    configured = os.getenv('BLIND_INDEX_KEY')
+    if configured:
+        return base64.urlsafe_b64decode(configured)
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                info=b'productivepanda mood keyword blind index').derive(base64.urlsafe_b64decode(encryption_key))
+
+blind_index_key = _load_blind_index_key()
+
+def normalize_keyword(keyword):
+    return keyword.strip().lower()
+
+def blind_index_token(user_id, keyword):
+    """The searchable token for one of the user's keywords"""
+    message = f"{user_id}\x00{normalize_keyword(keyword)}".encode('utf-8')
+    return hmac.new(blind_index_key, message, hashlib.sha256).digest()[:BLIND_INDEX_TOKEN_BYTES].hex()
+
+def blind_index_tokens(user_id, keywords):
+    """Distinct tokens for the keywords, in first-seen order"""
+    return list(dict.fromkeys(blind_index_token(user_id, keyword) for keyword in keywords if normalize_keyword(keyword)))
+
+# Firestore accepts at most 30 values in an array_contains_any filter
+MAX_SEARCH_TERMS = 30
+
+def keyword_search_terms(keyword):
+    """
+    The search keyword normalized the way stored keywords are: preprocessed (punctuation and
+    stop words dropped, nouns lemmatized) and tokenized, so "Meetings!" finds "meeting".
+    """
+    return list(dict.fromkeys(fast_tokenize(preprocess_text(keyword))))[:MAX_SEARCH_TERMS]
+
 # SQLAlchemy User model for authentication
 class User(db.Model, UserMixin):
     __tablename__ = 'user'
@@ -62,7 +160,7 @@ class User(db.Model, UserMixin):
 
 # Firestore MoodUser class for mood analysis and preferences
 class MoodUser:
-    def __init__(self, user_id, preferences=None, created_at=None, last_login=None, positive_threshold=0.25, negative_threshold=-0.25):
+    def __init__(self, user_id, preferences=None, created_at=None, last_login=None, positive_threshold=DEFAULT_POSITIVE_THRESHOLD, negative_threshold=DEFAULT_NEGATIVE_THRESHOLD):
         self.user_id = user_id
         self.preferences = preferences or {}
         self.created_at = created_at
@@ -71,57 +169,75 @@ class MoodUser:
         self.positive_threshold = positive_threshold
         self.negative_threshold = negative_threshold
 
+    @property
+    def cipher(self):
+        """The user's own cipher (see server.api_handler.user_keys); it also reads master-key data"""
+        return user_keyring.cipher(self.user_id)
+
     def decrypt_data(self, data):
-        """Decrypt data with detailed logging."""
-        logger.debug(f"Data before decryption: {data}")
-        logger.debug(f"Type of data before decryption: {type(data)}")
-        
+        """Decrypt data with basic logging."""
         if isinstance(data, str):
             try:
                 # Assuming the data is base64 encoded
-                logger.debug(f"Attempting to decrypt string data.")
-                decrypted_data = cipher_suite.decrypt(data.encode()).decode('utf-8')
-                logger.debug(f"Decrypted data: {decrypted_data}")
-                return decrypted_data
+                return self.cipher.decrypt(data.encode()).decode('utf-8')
             except Exception as e:
-                logger.error(f"Decryption error: {e}")
+                logger.error("Decryption error: %s", e)
                 raise
         elif isinstance(data, dict):
             try:
-                logger.debug(f"Decrypting dictionary data.")
-                decrypted_dict = {k: self.decrypt_data(v) for k, v in data.items()}
-                return decrypted_dict
+                return {k: self.decrypt_data(v) for k, v in data.items()}
             except Exception as e:
-                logger.error(f"Error decrypting dictionary data: {e}")
+                logger.error("Error decrypting dictionary data: %s", e)
                 raise
         else:
-            logger.debug(f"Data type not supported for decryption: {type(data)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Data type not supported for decryption: %s", type(data).__name__)
             return data
 
+    def decrypt_many(self, items):
+        """
+        decrypt_data for many documents at once, spread over the bulk decryption pool.
+        Returns a BulkResult (value, error) per item, in order; a failed item doesn't fail the rest.
+        """
+        return decrypt_many(items, self.decrypt_data)
+
     def store_preferences(self):
         """
         Stores user preferences securely in Firestore
         """
         try:
-            encrypted_preferences = encrypt_data(self.preferences)
-            self.db.collection('users').document(self.user_id).set({
+            encrypted_preferences = encrypt_data(self.preferences, self.cipher)
+            self.db.collection('users').document(str(self.user_id)).set({
                 'preferences': encrypted_preferences,
                 'createdAt': self.created_at,
                 'lastLogin': self.last_login
-            })
-            print(f"Preferences for user {self.user_id} successfully stored.")
+            }, **deadline_kwargs())
+            logger.info("Preferences for user %s successfully stored.", self.user_id)
         except Exception as e:
-            print(f"An error occurred while storing user preferences: {e}")
+            logger.error("An error occurred while storing user preferences: %s", e)
 
-    def analyze_mood(self, text):
+    def analyze_mood(self, text, use_local_model=None):
         """
-        Analyzes the user's mood based on input text
+        Analyzes the user's mood based on input text.
+        With use_local_model (default: USE_LOCAL_SENTIMENT_MODEL=1) a sufficiently trained
+        personal model scores the text without any network call; otherwise the remote
+        score is used and also trains the personal model.
         """
+        if use_local_model is None:
+            use_local_model = os.getenv('USE_LOCAL_SENTIMENT_MODEL') == '1'
         preprocessed_text = preprocess_text(text)
-        response = send_to_google_nlp_api(preprocessed_text)
-        parsed_response = parse_api_response(response)
-        sentiment_score = extract_sentiment_score(parsed_response)
-        keywords = extract_keywords(parsed_response)
+        model = get_user_sentiment_model(self.user_id) if use_local_model else None
+        if model is not None and model.is_trained():
+            sentiment_score = model.predict_one(preprocessed_text)
+            keywords = fast_tokenize(preprocessed_text)
+        else:
+            response = send_to_google_nlp_api(preprocessed_text)
+            parsed_response = parse_api_response(response)
+            sentiment_score = extract_sentiment_score(parsed_response)
+            keywords = extract_keywords(parsed_response)
+            # While the breaker is open the score came from the local fallback, not Google
+            if nlp_breaker.state == nlp_breaker.CLOSED:
+                self.train_sentiment_model([preprocessed_text], [sentiment_score])
         mood_category = self.classify_mood(sentiment_score)
         return {
             'inputText': text,
@@ -130,38 +246,131 @@ class MoodUser:
             'moodCategory': mood_category
         }
 
-    def store_mood_analysis(self, mood_analysis, encrypt_func=encrypt_data):
+    def train_sentiment_model(self, preprocessed_texts, sentiment_scores, sample_weight=1.0):
+        """
+        Updates the user's personal sentiment model with scored examples.
+        Training problems are logged and never fail the caller.
+        """
+        try:
+            update_user_sentiment_model(self.user_id, preprocessed_texts, sentiment_scores,
+                                        [sample_weight] * len(preprocessed_texts))
+        except Exception as e:
+            logger.error("Error updating sentiment model for user %s: %s", self.user_id, e)
+
+    def record_mood_feedback(self, text, sentiment_score):
+        """
+        Learns from a score the user gave their own entry; these count more than remote scores
+        """
+        self.train_sentiment_model([preprocess_text(text)], [sentiment_score], sample_weight=2.0)
+
+    def store_mood_analysis(self, mood_analysis, seal_func=None):
         """
-        Stores the mood analysis result in Firestore
+        Stores the mood analysis result in Firestore, its text, keywords and category sealed together
         """
+        seal_func = seal_func or functools.partial(seal_mood_record, cipher=self.cipher)
         try:
             encrypted_mood_analysis = {
-                'inputText': encrypt_func(mood_analysis['inputText']),
+                'userId': self.user_id,
+                'sealed': seal_func({field: mood_analysis[field] for field in MOOD_RECORD_SEALED_FIELDS}),
+                'keywordIndex': blind_index_tokens(self.user_id, mood_analysis['keywords']),
                 'sentimentScore': mood_analysis['sentimentScore'],
-                'keywords': [encrypt_func(k) for k in mood_analysis['keywords']],
-                'moodCategory': encrypt_func(mood_analysis['moodCategory']),
-                'timestamp': firestore.SERVER_TIMESTAMP                         
+                'timestamp': firestore.SERVER_TIMESTAMP
             }
 
-            self.db.collection('moodAnalysis').document().set(encrypted_mood_analysis)
-            print(f"Mood analysis for user {self.user_id} successfully stored")
+            self.db.collection('moodAnalysis').document().set(encrypted_mood_analysis, **deadline_kwargs())
+            logger.info("Mood analysis for user %s successfully stored", self.user_id)
+        except Exception as e:
+            logger.error("An error occurred while storing mood analysis: %s", e)
+
+    def retrieve_mood_analysis(self, document_id):
+        """
+        Retrieves and decrypts one stored mood analysis, in either record format
+        """
+        try:
+            doc = self.db.collection('moodAnalysis').document(document_id).get(**deadline_kwargs())
+            if doc.exists:
+                return open_mood_record(doc.to_dict(), self.cipher)
+            logger.info("No mood analysis found with ID %s", document_id)
+            return None
+        except Exception as e:
+            logger.error("An error occurred while retrieving mood analysis: %s", e)
+            return None
+
+    def _open_mood_documents(self, docs):
+        """Decrypts mood analysis snapshots in bulk, leaving out (and logging) the ones that fail"""
+        docs = list(docs)
+        results = decrypt_many([doc.to_dict() for doc in docs], lambda document: open_mood_record(document, self.cipher))
+        records = [dict(result.value, id=doc.id) for doc, result in zip(docs, results) if result.ok]
+        if len(records) < len(docs):
+            logger.error("Could not decrypt %d of %d mood analyses for user %s",
+                         len(docs) - len(records), len(docs), self.user_id)
+        return records
+
+    def retrieve_mood_history(self, limit=31):
+        """
+        Retrieves and decrypts the user's latest mood analyses, newest first. Entries that
+        can't be decrypted are left out and logged; None if the history can't be read at all.
+        Analyses stored before records carried a userId have none and never appear here;
+        the re-encryption tool (server.tools.reencrypt_user_data) counts them as unowned.
+        """
+        try:
+            # Needs the composite index on moodAnalysis (userId ascending, timestamp descending)
+            # defined in firestore.indexes.json; deploy it with `firebase deploy --only firestore:indexes`
+            query = (self.db.collection('moodAnalysis').where('userId', '==', self.user_id)
+                     .order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit))
+            return self._open_mood_documents(query.stream(**deadline_kwargs()))
+        except Exception as e:
+            logger.error("An error occurred while retrieving mood history: %s", e)
+            return None
+
+    def search_mood_analyses(self, keyword, limit=50):
+        """
+        Retrieves and decrypts the user's mood analyses that have the keyword, through the
+        blind keyword index; only matching entries are read. A keyword that preprocesses to
+        several words matches entries with any of them. None if the search fails.
+        """
+        try:
+            tokens = [blind_index_token(self.user_id, term) for term in keyword_search_terms(keyword)]
+            if not tokens:
+                return []
+            # The token already identifies the user, so no userId filter (or composite index) is needed
+            if len(tokens) == 1:
+                condition = ('keywordIndex', 'array_contains', tokens[0])
+            else:
+                condition = ('keywordIndex', 'array_contains_any', tokens)
+            query = self.db.collection('moodAnalysis').where(*condition).limit(limit)
+            return self._open_mood_documents(query.stream(**deadline_kwargs()))
+        except Exception as e:
+            logger.error("An error occurred while searching mood analyses: %s", e)
+            return None
+
+    def record_latest_mood(self, sentiment_score):
+        """
+        Keeps the latest mood score on the user's profile, where the nightly
+        recommendations job reads it (see server.models.recommendations)
+        """
+        try:
+            self.db.collection('users').document(str(self.user_id)).set({
+                'latestMoodScore': sentiment_score,
+                'latestMoodAt': firestore.SERVER_TIMESTAMP
+            }, merge=True, **deadline_kwargs())
         except Exception as e:
-            print(f"An error occurred while storing mood analysis: {e}")
+            logger.error("Error recording latest mood for user %s: %s", self.user_id, e)
 
     def retrieve_preferences(self):
         """
         Retrieves and decrypts user preferences from Firestore
         """
         try:
-            doc = self.db.collection('users').document(self.user_id).get()
+            doc = self.db.collection('users').document(str(self.user_id)).get(**deadline_kwargs())
             if doc.exists:
                 decrypted_preferences = self.decrypt_data(doc.to_dict().get('preferences', {}))
                 return decrypted_preferences
             else:
-                print(f"No preferences found for user {self.user_id}")
+                logger.info("No preferences found for user %s", self.user_id)
                 return None
         except Exception as e:
-            print(f"An error occurred while retrieving user preferences: {e}")
+            logger.error("An error occurred while retrieving user preferences: %s", e)
             return None
 
     def update_last_login(self):
@@ -170,12 +379,12 @@ class MoodUser:
         """
         self.last_login = firestore.SERVER_TIMESTAMP
         try:
-            self.db.collection('users').document(self.user_id).update({
+            self.db.collection('users').document(str(self.user_id)).update({
                 'lastLogin': self.last_login
-            })
-            print(f"Last login for user {self.user_id} successfully updated.")
+            }, **deadline_kwargs())
+            logger.info("Last login for user %s successfully updated.", self.user_id)
         except Exception as e:
-            print(f"An error occurred while updating last login: {e}")
+            logger.error("An error occurred while updating last login: %s", e)
 
     def classify_mood(self, sentiment_score):
         if sentiment_score > self.positive_threshold:
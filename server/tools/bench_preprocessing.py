@@ -0,0 +1,229 @@
+# Corpus-scale benchmark for the text preprocessing pipelines.
+# Runs every stage of the api_handler pipeline (and the legacy api_services one) over a large
+# synthetic corpus of mood-journal entries and task descriptions and reports texts/sec,
+# p50/p99 per-text latency for each stage plus peak traced memory for the whole run.
+# The entry points callers use, preprocess_text per text and preprocess_texts over the whole
+# corpus, are timed end to end as well, so overhead between the stages shows up too.
+#
+# Usage: python -m server.tools.bench_preprocessing [--size 20000] [--corpus file.txt] [--json out.json]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+STAGE_ORDER = ["contractions", "lowercase", "punctuation", "negation", "tokenize", "stopwords", "lemmatize"]
+END_TO_END_ORDER = ["preprocess_text", "preprocess_texts"]
+
+JOURNAL_OPENERS = [
+    "Today I'm feeling", "I can't stop feeling", "Honestly I was", "This morning I felt", "I'm not",
+    "We're all", "It's been a day and I'm", "Ain't gonna lie, I'm", "I didn't expect to be", "Lately I've been"
+]
+JOURNAL_MOODS = [
+    "happy", "stressed", "overwhelmed", "calm", "anxious", "grateful", "tired", "excited", "frustrated",
+    "hopeful", "lonely", "proud", "nervous", "content", "burned out"
+]
+JOURNAL_REASONS = [
+    "because the deadline moved up again.", "after a long walk in the park!", "since my meetings never end...",
+    "but the team shipped the release.", "and I wanna rest, but I cannot.", "(no sleep, too much coffee)",
+    "- the commute was terrible, never again.", "because my friends checked in on me.",
+    "though nothing really went wrong.", "and I'll try to do better tomorrow."
+]
+TASK_VERBS = ["Finish", "Review", "Write", "Call", "Clean", "Plan", "Email", "Prepare", "Fix", "Read"]
+TASK_OBJECTS = [
+    "the quarterly report", "mom about Sunday", "the kitchen", "next week's sprint", "the landlord",
+    "slides for Monday's meeting", "the leaking faucet", "two chapters of my book", "invoices #42-#57",
+    "notes from the 1:1"
+]
+TASK_SUFFIXES = ["", " ASAP!", " before 5pm", " (low priority)", " - don't forget", " if there's time"]
+
+
+def generate_corpus(size, seed=0):
+    """Builds a deterministic mix of journal entries (about 60%) and short task descriptions."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        if rng.random() < 0.6:
+            sentences = [
+                f"{rng.choice(JOURNAL_OPENERS)} {rng.choice(JOURNAL_MOODS)} {rng.choice(JOURNAL_REASONS)}"
+                for _ in range(rng.randint(1, 5))
+            ]
+            corpus.append(' '.join(sentences))
+        else:
+            corpus.append(f"{rng.choice(TASK_VERBS)} {rng.choice(TASK_OBJECTS)}{rng.choice(TASK_SUFFIXES)}")
+    return corpus
+
+
+def load_corpus(path):
+    """Reads an anonymized corpus with one text per line."""
+    with open(path, encoding="utf-8") as corpus_file:
+        return [line.rstrip("\n") for line in corpus_file if line.strip()]
+
+
+def load_legacy_module():
+    # The legacy module imports "config.config", so it expects server/ itself on sys.path
+    server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if server_dir not in sys.path:
+        sys.path.append(server_dir)
+    from server.api_services import api_services as legacy_services
+    return legacy_services
+
+
+def handler_stages():
+    from server.api_handler.api_services import get_text_preprocessor
+    return get_text_preprocessor().stages()
+
+
+def handler_entry_points():
+    from server.api_handler.api_services import preprocess_text, preprocess_texts
+    return preprocess_text, lambda texts: list(preprocess_texts(texts))
+
+
+def legacy_entry_points():
+    legacy_services = load_legacy_module()
+    # The legacy module has no batch function; callers mapped preprocess_text over their texts
+    return legacy_services.preprocess_text, lambda texts: [legacy_services.preprocess_text(text) for text in texts]
+
+
+def legacy_stages():
+    legacy_services = load_legacy_module()
+    return [
+        ("lowercase", legacy_services.to_lowercase),
+        ("punctuation", legacy_services.remove_punctuation),
+        ("tokenize", legacy_services.tokenize_text),
+        ("stopwords", legacy_services.remove_stop_words),
+        ("lemmatize", lambda tokens: ' '.join(legacy_services.lemmatize_tokens(tokens))),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_stages(stages, corpus):
+    """Times each stage separately for every text and returns per-stage and end-to-end stats."""
+    timings = {name: [] for name, _ in stages}
+    totals = []
+    clock = time.perf_counter_ns
+    for text in corpus:
+        value = text
+        text_start = clock()
+        for name, stage in stages:
+            stage_start = clock()
+            value = stage(value)
+            timings[name].append(clock() - stage_start)
+        totals.append(clock() - text_start)
+
+    timings["total"] = totals
+    report = {}
+    for name, samples in timings.items():
+        samples.sort()
+        elapsed_seconds = sum(samples) / 1e9
+        report[name] = {
+            "texts_per_sec": round(len(samples) / elapsed_seconds, 1) if elapsed_seconds else None,
+            "p50_us": round(percentile(samples, 0.50) / 1e3, 2),
+            "p99_us": round(percentile(samples, 0.99) / 1e3, 2),
+        }
+    return report
+
+
+def run_end_to_end(preprocess_one, preprocess_many, corpus):
+    """Times preprocess_text for every text and one preprocess_texts call over the corpus."""
+    samples = []
+    clock = time.perf_counter_ns
+    for text in corpus:
+        text_start = clock()
+        preprocess_one(text)
+        samples.append(clock() - text_start)
+    samples.sort()
+    elapsed_seconds = sum(samples) / 1e9
+
+    batch_start = clock()
+    preprocess_many(corpus)
+    batch_seconds = (clock() - batch_start) / 1e9
+    return {
+        "preprocess_text": {
+            "texts_per_sec": round(len(samples) / elapsed_seconds, 1) if elapsed_seconds else None,
+            "p50_us": round(percentile(samples, 0.50) / 1e3, 2),
+            "p99_us": round(percentile(samples, 0.99) / 1e3, 2),
+        },
+        # One call over the whole corpus, so there is no per-text latency
+        "preprocess_texts": {
+            "texts_per_sec": round(len(corpus) / batch_seconds, 1) if batch_seconds else None,
+            "p50_us": None,
+            "p99_us": None,
+        },
+    }
+
+
+def measure_peak_memory(stages, corpus):
+    """Runs the pipeline once more under tracemalloc; kept separate so tracing doesn't skew the timings."""
+    tracemalloc.start()
+    try:
+        for text in corpus:
+            value = text
+            for _, stage in stages:
+                value = stage(value)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def benchmark(name, stages, entry_points, corpus, warmup=200):
+    # Warm regex, stop word and lemma caches so the first texts don't dominate p99
+    for text in corpus[:warmup]:
+        value = text
+        for _, stage in stages:
+            value = stage(value)
+    report = run_stages(stages, corpus)
+    return {
+        "pipeline": name,
+        "texts": len(corpus),
+        "stages": report,
+        "end_to_end": run_end_to_end(*entry_points, corpus),
+        "peak_memory_kb": round(measure_peak_memory(stages, corpus) / 1024, 1),
+    }
+
+
+def print_report(results):
+    for result in results:
+        print(f"\n{result['pipeline']} pipeline: {result['texts']} texts, peak memory {result['peak_memory_kb']} KB")
+        print(f"{'stage':<18}{'texts/sec':>14}{'p50 (us)':>12}{'p99 (us)':>12}")
+        rows = [(name, result["stages"].get(name)) for name in STAGE_ORDER + ["total"]]
+        rows += [(name, result["end_to_end"].get(name)) for name in END_TO_END_ORDER]
+        for row_name, stats in rows:
+            stats = {key: ('n/a' if value is None else value) for key, value in (stats or {}).items()}
+            print(f"{row_name:<18}{stats.get('texts_per_sec', 'n/a'):>14}{stats.get('p50_us', 'n/a'):>12}"
+                  f"{stats.get('p99_us', 'n/a'):>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark preprocess_text stage by stage")
+    parser.add_argument("--size", type=int, default=20000, help="number of synthetic texts to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="file with one anonymized text per line, used instead of the synthetic corpus")
+    parser.add_argument("--skip-legacy", action="store_true", help="only benchmark the api_handler pipeline")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus) if args.corpus else generate_corpus(args.size, args.seed)
+    results = [benchmark("api_handler", handler_stages(), handler_entry_points(), corpus)]
+    if not args.skip_legacy:
+        results.append(benchmark("legacy api_services", legacy_stages(), legacy_entry_points(), corpus))
+
+    print_report(results)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as json_file:
+            json.dump(results, json_file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
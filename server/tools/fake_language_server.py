@@ -0,0 +1,193 @@
+# Local stand-in for the Google Cloud Natural Language gRPC service.
+# Implements LanguageService.AnalyzeSentiment and AnnotateText on a real gRPC server, scoring
+# text deterministically with the lexicon engine, with configurable latency and error rates,
+# so load tests can exercise the full NLP round trip without network access or credentials.
+#
+# Usage: python -m server.tools.fake_language_server [--port 50051] [--latency lognormal:0.08,0.5]
+#            [--error-rate 0.01] [--error-code UNAVAILABLE] [--seed 0]
+# then point the app at it with NLP_API_ENDPOINT=127.0.0.1:50051
+
+import argparse
+import math
+import random
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from google.cloud import language_v1
+
+from server.api_handler.lexicon_sentiment import LexiconSentimentEngine
+
+SERVICE_NAME = "google.cloud.language.v1.LanguageService"
+
+
+class LatencyModel:
+    """
+    Per-call latency in seconds drawn from a distribution given as "kind:params":
+    "none", "fixed:SECONDS", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA".
+    """
+    def __init__(self, spec="none", rng=None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(param) for param in params.split(",")] if params else []
+        expected = {"none": 0, "fixed": 1, "uniform": 2, "lognormal": 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+
+    def sample(self):
+        if self.kind == "none":
+            return 0.0
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        median, sigma = self.params
+        return self.rng.lognormvariate(math.log(median), sigma)
+
+
+def _offset_converter(content, encoding_type):
+    """Returns a function mapping code point offsets in content to offsets in encoding_type."""
+    if encoding_type == language_v1.EncodingType.UTF8:
+        return lambda offset: len(content[:offset].encode("utf-8"))
+    if encoding_type == language_v1.EncodingType.UTF16:
+        return lambda offset: len(content[:offset].encode("utf-16-le")) // 2
+    if encoding_type == language_v1.EncodingType.UTF32:
+        return lambda offset: offset
+    # Like the real service, offsets are -1 when no encoding is requested
+    return lambda offset: -1
+
+
+class FakeLanguageService:
+    """
+    Request handlers for the fake server. Scores come from the lexicon engine, so the same
+    text always gets the same result; latency and failures are drawn from a seeded RNG.
+    """
+    def __init__(self, latency="none", error_rate=0.0, error_code=grpc.StatusCode.UNAVAILABLE,
+                 seed=0, engine=None):
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.engine = engine or LexiconSentimentEngine()
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "errors": 0, "deadline_exceeded": 0}
+
+    def _begin_call(self, context):
+        # One draw each for latency and failure, under the lock so a seed gives a fixed sequence
+        with self._lock:
+            self.counters["requests"] += 1
+            delay = self.latency.sample()
+            fail = self.error_rate > 0 and self.rng.random() < self.error_rate
+        remaining = context.time_remaining()
+        if remaining is not None and delay > remaining:
+            time.sleep(max(remaining, 0))
+            with self._lock:
+                self.counters["deadline_exceeded"] += 1
+            context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, "Fake latency exceeded the deadline")
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            with self._lock:
+                self.counters["errors"] += 1
+            context.abort(self.error_code, "Injected fake LanguageService error")
+
+    def _sentiment(self, document, encoding_type):
+        content = document.content
+        parsed = self.engine.analyze(content, include_offsets=True)
+        to_offset = _offset_converter(content, encoding_type)
+        sentences = [
+            {
+                "text": {"content": sentence["content"], "begin_offset": to_offset(sentence["begin_offset"])},
+                "sentiment": {"score": sentence["sentiment"], "magnitude": sentence["magnitude"]}
+            } for sentence in parsed["sentences"]
+        ]
+        return parsed["overall_sentiment"], sentences
+
+    def analyze_sentiment(self, request, context):
+        self._begin_call(context)
+        overall, sentences = self._sentiment(request.document, request.encoding_type)
+        return language_v1.AnalyzeSentimentResponse(
+            document_sentiment=overall, language=request.document.language or "en", sentences=sentences
+        )
+
+    def annotate_text(self, request, context):
+        self._begin_call(context)
+        overall, sentences = self._sentiment(request.document, request.encoding_type)
+        response = language_v1.AnnotateTextResponse(sentences=sentences, language=request.document.language or "en")
+        if request.features.extract_document_sentiment:
+            response.document_sentiment = overall
+        if request.features.extract_syntax:
+            to_offset = _offset_converter(request.document.content, request.encoding_type)
+            offset = 0
+            tokens = []
+            for word in request.document.content.split():
+                offset = request.document.content.index(word, offset)
+                tokens.append({"text": {"content": word, "begin_offset": to_offset(offset)}, "lemma": word.lower()})
+                offset += len(word)
+            response.tokens = tokens
+        return response
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def handler(self):
+        """The grpc generic handler serving this instance."""
+        return grpc.method_handlers_generic_handler(SERVICE_NAME, {
+            "AnalyzeSentiment": grpc.unary_unary_rpc_method_handler(
+                self.analyze_sentiment,
+                request_deserializer=language_v1.AnalyzeSentimentRequest.deserialize,
+                response_serializer=language_v1.AnalyzeSentimentResponse.serialize
+            ),
+            "AnnotateText": grpc.unary_unary_rpc_method_handler(
+                self.annotate_text,
+                request_deserializer=language_v1.AnnotateTextRequest.deserialize,
+                response_serializer=language_v1.AnnotateTextResponse.serialize
+            )
+        })
+
+
+def start_fake_language_server(address="127.0.0.1:0", max_workers=32, **service_kwargs):
+    """
+    Starts a fake LanguageService server in the background.
+    Returns (server, endpoint, service); stop it with server.stop(grace=None).
+    """
+    service = FakeLanguageService(**service_kwargs)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fake-nlp"))
+    server.add_generic_rpc_handlers((service.handler(),))
+    port = server.add_insecure_port(address)
+    server.start()
+    host = address.rsplit(":", 1)[0]
+    return server, f"{host}:{port}", service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a fake Google Cloud Natural Language gRPC server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--latency", default="lognormal:0.08,0.5",
+                        help="none, fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls that fail (0-1)")
+    parser.add_argument("--error-code", default="UNAVAILABLE", help="grpc status code of injected failures")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=32, help="server threads, i.e. max concurrent calls")
+    args = parser.parse_args(argv)
+
+    server, endpoint, service = start_fake_language_server(
+        f"{args.host}:{args.port}", max_workers=args.workers, latency=args.latency,
+        error_rate=args.error_rate, error_code=grpc.StatusCode[args.error_code], seed=args.seed
+    )
+    print(f"Fake LanguageService listening on {endpoint}")
+    print(f"Point the app at it with NLP_API_ENDPOINT={endpoint}")
+    try:
+        server.wait_for_termination()
+    except KeyboardInterrupt:
+        print(f"Stopping; served {service.stats()}")
+        server.stop(grace=1)
+
+
+if __name__ == "__main__":
+    main()
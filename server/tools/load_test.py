@@ -0,0 +1,332 @@
+# HTTP load generator for the dashboard and /tasks/analyze_tasks endpoints.
+# By default it serves create_app() in-process on a threaded WSGI server backed by the local
+# fakes (in-memory Firestore, fake LanguageService), logs in a test user and drives a mix of
+# authenticated /dashboard mood entries and analyze_tasks JSON requests, either closed-loop at
+# a fixed concurrency or open-loop at a target rate. Reports throughput, p50/p95/p99/p999
+# latency and error rates per endpoint, optionally as JSON to compare across commits.
+#
+# Usage: python -m server.tools.load_test [--concurrency 16 | --rps 50] [--duration 30]
+#            [--dashboard-share 0.2] [--nlp-latency lognormal:0.08,0.5] [--json out.json]
+#            [--compare baseline.json] [--url http://host:port --username USER --password PASS]
+
+import argparse
+import http.client
+import json
+import math
+import os
+import queue
+import random
+import subprocess
+import threading
+import time
+import urllib.parse
+from collections import Counter
+
+from server.tools.bench_preprocessing import (
+    JOURNAL_OPENERS, JOURNAL_MOODS, JOURNAL_REASONS, TASK_VERBS, TASK_OBJECTS, TASK_SUFFIXES, percentile
+)
+
+ENDPOINTS = ["dashboard", "analyze_tasks"]
+LOAD_TEST_USERNAME = "loadtester"
+LOAD_TEST_PASSWORD = "loadtest-password"
+
+
+def task_list_size(rng, median=8, sigma=0.9, max_tasks=500):
+    """Task list sizes are long-tailed: most users have a handful, a few import hundreds."""
+    return max(1, min(max_tasks, int(rng.lognormvariate(math.log(median), sigma))))
+
+
+def make_tasks(rng, size):
+    return [
+        {
+            "description": f"{rng.choice(TASK_VERBS)} {rng.choice(TASK_OBJECTS)}{rng.choice(TASK_SUFFIXES)}",
+            "priority": rng.randint(1, 5)
+        } for _ in range(size)
+    ]
+
+
+def make_journal_entry(rng):
+    return ' '.join(
+        f"{rng.choice(JOURNAL_OPENERS)} {rng.choice(JOURNAL_MOODS)} {rng.choice(JOURNAL_REASONS)}"
+        for _ in range(rng.randint(1, 5))
+    )
+
+
+class LoadClient:
+    """One keep-alive HTTP connection with its own session cookie; used by a single worker."""
+    def __init__(self, base_url, timeout=30.0):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=timeout)
+        self.cookies = {}
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            # Drop the broken connection; it is reopened on the next request
+            self.connection.close()
+            raise
+        for header in response.headers.get_all("Set-Cookie") or []:
+            name, _, value = header.split(";", 1)[0].partition("=")
+            self.cookies[name.strip()] = value.strip()
+        if response.will_close:
+            self.connection.close()
+        return response.status
+
+    def login(self, username, password):
+        body = urllib.parse.urlencode({"username": username, "password": password})
+        status = self.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+        if status != 302:
+            raise RuntimeError(f"Login as {username} failed with HTTP {status}")
+
+    def post_dashboard(self, rng):
+        body = urllib.parse.urlencode({"inputText": make_journal_entry(rng)})
+        return self.request("POST", "/dashboard", body, {"Content-Type": "application/x-www-form-urlencoded"})
+
+    def post_analyze_tasks(self, rng, user_id):
+        body = json.dumps({"user_id": user_id, "tasks": make_tasks(rng, task_list_size(rng))})
+        return self.request("POST", "/tasks/analyze_tasks", body, {"Content-Type": "application/json"})
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.statuses = {endpoint: Counter() for endpoint in ENDPOINTS}
+
+    def record(self, endpoint, latency, status):
+        with self._lock:
+            self.latencies[endpoint].append(latency)
+            self.statuses[endpoint][status] += 1
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    requests = sum(statuses.values())
+    errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 400)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1e3, 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1e3, 2),
+            "p95": round(percentile(latencies, 0.95) * 1e3, 2),
+            "p99": round(percentile(latencies, 0.99) * 1e3, 2),
+            "p999": round(percentile(latencies, 0.999) * 1e3, 2),
+            "max": round(latencies[-1] * 1e3, 2) if latencies else 0.0,
+        },
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }
+
+
+def run_load(base_url, username, password, user_id, concurrency=16, rps=None, duration=30.0, warmup=5.0,
+             dashboard_share=0.2, seed=0):
+    """
+    Drives the endpoints for warmup + duration seconds and returns the per-endpoint summary
+    of the measured part. In open-loop mode (rps) latency counts from each request's scheduled
+    start, so a backed-up server isn't flattered by requests that were sent late.
+    """
+    recorder = Recorder()
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+    arrivals = queue.Queue() if rps else None
+    errors = []
+
+    def pick_endpoint(rng):
+        return "dashboard" if rng.random() < dashboard_share else "analyze_tasks"
+
+    def send(client, rng, endpoint, scheduled):
+        try:
+            if endpoint == "dashboard":
+                status = client.post_dashboard(rng)
+            else:
+                status = client.post_analyze_tasks(rng, user_id)
+        except Exception as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        if scheduled >= measure_from:
+            recorder.record(endpoint, finished - scheduled, status)
+
+    def worker(worker_id):
+        rng = random.Random(seed * 1000003 + worker_id)
+        client = LoadClient(base_url)
+        try:
+            client.login(username, password)
+        except Exception as e:
+            errors.append(e)
+            return
+        while True:
+            if arrivals is None:
+                scheduled = time.perf_counter()
+                if scheduled >= stop_at:
+                    return
+                send(client, rng, pick_endpoint(rng), scheduled)
+            else:
+                item = arrivals.get()
+                if item is None:
+                    return
+                scheduled, endpoint = item
+                send(client, rng, endpoint, scheduled)
+
+    threads = [threading.Thread(target=worker, args=(worker_id,), daemon=True) for worker_id in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    if arrivals is not None:
+        rng = random.Random(seed)
+        interval = 1.0 / rps
+        scheduled = time.perf_counter()
+        while scheduled < stop_at:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            arrivals.put((scheduled, pick_endpoint(rng)))
+            scheduled += interval
+        for _ in threads:
+            arrivals.put(None)
+
+    for thread in threads:
+        thread.join()
+    if errors and len(errors) == len(threads):
+        raise errors[0]
+    elapsed = max(time.perf_counter(), stop_at) - measure_from
+
+    report = {endpoint: summarize(recorder.latencies[endpoint], recorder.statuses[endpoint], elapsed)
+              for endpoint in ENDPOINTS}
+    all_statuses = sum(recorder.statuses.values(), Counter())
+    report["overall"] = summarize(sum(recorder.latencies.values(), []), all_statuses, elapsed)
+    return report
+
+
+def start_local_app(args):
+    """Serves create_app() with local fakes on a free port; returns (base_url, user_id, fakes, server)."""
+    from server.tools.local_fakes import install_local_fakes
+    fakes = install_local_fakes(
+        nlp_latency=args.nlp_latency, nlp_error_rate=args.nlp_error_rate,
+        firestore_latency=args.firestore_latency, seed=args.seed
+    )
+    credentials_path = os.path.join(fakes.workdir, "credentials.json")
+    with open(credentials_path, "w", encoding="utf-8") as credentials_file:
+        json.dump({"type": "fake"}, credentials_file)
+
+    from werkzeug.serving import make_server
+    from server.app import create_app, db, bcrypt, User
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(fakes.workdir, "load_test.db"),
+        "FIRESTORE_CREDENTIALS_PATH": credentials_path,
+        "WTF_CSRF_ENABLED": False,
+    })
+    with app.app_context():
+        db.create_all()
+        user = User(username=LOAD_TEST_USERNAME,
+                    password=bcrypt.generate_password_hash(LOAD_TEST_PASSWORD).decode("utf-8"))
+        db.session.add(user)
+        db.session.commit()
+        user_id = str(user.id)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="load-test-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", user_id, fakes, server
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    print(f"\n{'endpoint':<15}{'requests':>10}{'rps':>10}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'p999 ms':>10}")
+    for endpoint in ENDPOINTS + ["overall"]:
+        stats = report[endpoint]
+        latency = stats["latency_ms"]
+        print(f"{endpoint:<15}{stats['requests']:>10}{stats['throughput_rps']:>10}{stats['error_rate']:>9.2%}"
+              f"{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}{latency['p999']:>10}")
+
+
+def print_comparison(report, baseline):
+    print(f"\nChange against {baseline.get('commit') or 'baseline'}:")
+    for endpoint in ENDPOINTS + ["overall"]:
+        old, new = baseline["results"].get(endpoint), report[endpoint]
+        if not old:
+            continue
+        changes = []
+        for name, old_value, new_value in [
+            ("rps", old["throughput_rps"], new["throughput_rps"]),
+            ("p50", old["latency_ms"]["p50"], new["latency_ms"]["p50"]),
+            ("p99", old["latency_ms"]["p99"], new["latency_ms"]["p99"]),
+        ]:
+            change = f"{(new_value - old_value) / old_value:+.1%}" if old_value else "n/a"
+            changes.append(f"{name} {old_value} -> {new_value} ({change})")
+        print(f"  {endpoint:<15}" + ", ".join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the dashboard and analyze_tasks endpoints")
+    parser.add_argument("--concurrency", type=int, default=16, help="worker threads (closed loop unless --rps)")
+    parser.add_argument("--rps", type=float, help="open-loop target request rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds before the run")
+    parser.add_argument("--dashboard-share", type=float, default=0.2, help="share of requests sent to /dashboard")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="test an already running server instead of an in-process one")
+    parser.add_argument("--username", default=LOAD_TEST_USERNAME)
+    parser.add_argument("--password", default=LOAD_TEST_PASSWORD)
+    parser.add_argument("--user-id", help="user_id sent to analyze_tasks (with --url)")
+    parser.add_argument("--nlp-latency", default="lognormal:0.08,0.5", help="fake NLP latency distribution")
+    parser.add_argument("--nlp-error-rate", type=float, default=0.0)
+    parser.add_argument("--firestore-latency", type=float, default=0.0, help="fake Firestore seconds per call")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this JSON file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    fakes = server = None
+    if args.url:
+        base_url, user_id = args.url, args.user_id or args.username
+    else:
+        base_url, user_id, fakes, server = start_local_app(args)
+
+    try:
+        results = run_load(base_url, args.username, args.password, user_id, concurrency=args.concurrency,
+                           rps=args.rps, duration=args.duration, warmup=args.warmup,
+                           dashboard_share=args.dashboard_share, seed=args.seed)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if fakes is not None:
+            fakes.stop()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {key: value for key, value in vars(args).items() if key not in ("password", "json_path", "compare")},
+        "results": results,
+    }
+    if fakes is not None:
+        from server.api_handler.resilience import circuit_breaker_stats
+        report["fakes"] = fakes.stats()
+        report["circuit_breakers"] = circuit_breaker_stats()
+
+    print_report(results)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            print_comparison(results, json.load(baseline_file))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as json_file:
+            json.dump(report, json_file, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
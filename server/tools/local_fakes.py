@@ -0,0 +1,268 @@
+# Local fakes that let create_app() run without cloud credentials or network access:
+# an in-memory, thread-safe stand-in for the parts of the Firestore client the app uses, and
+# the fake LanguageService gRPC server for NLP. Meant for load tests and capacity planning.
+#
+# install_local_fakes() must run before anything under server.* is imported, because several
+# modules create their Firestore clients and read their settings at import time.
+
+import copy
+import datetime
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from google.api_core import exceptions as core_exceptions
+from google.cloud import firestore
+
+from server.tools.fake_language_server import start_fake_language_server
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection_name, document_id):
+        self._client = client
+        self.collection_name = collection_name
+        self.id = document_id
+
+    @property
+    def _key(self):
+        return (self.collection_name, self.id)
+
+    def set(self, document_data, merge=False, retry=None, timeout=None):
+        data = self._client._resolve(document_data)
+        with self._client._write():
+            if merge and self._key in self._client._documents:
+                self._client._documents[self._key].update(data)
+            else:
+                self._client._documents[self._key] = data
+
+    def update(self, field_updates, retry=None, timeout=None):
+        data = self._client._resolve(field_updates)
+        with self._client._write():
+            if self._key not in self._client._documents:
+                raise core_exceptions.NotFound(f"No document to update: {self.collection_name}/{self.id}")
+            self._client._documents[self._key].update(data)
+
+    def get(self, field_paths=None, transaction=None, retry=None, timeout=None):
+        self._client._simulate_latency()
+        with self._client._lock:
+            data = copy.deepcopy(self._client._documents.get(self._key))
+        return FakeDocumentSnapshot(self, data)
+
+    def delete(self, retry=None, timeout=None):
+        with self._client._write():
+            self._client._documents.pop(self._key, None)
+
+
+class FakeQuery:
+    OPERATORS = {
+        "==": lambda value, target: value == target,
+        "!=": lambda value, target: value != target,
+        "<": lambda value, target: value is not None and value < target,
+        "<=": lambda value, target: value is not None and value <= target,
+        ">": lambda value, target: value is not None and value > target,
+        ">=": lambda value, target: value is not None and value >= target,
+        "in": lambda value, target: value in target,
+        "array_contains": lambda value, target: isinstance(value, list) and target in value,
+        "array_contains_any": lambda value, target: isinstance(value, list) and any(item in value for item in target),
+    }
+
+    def __init__(self, collection, filters=(), limit=None, fields=None, orders=()):
+        self._collection = collection
+        self._filters = list(filters)
+        self._limit = limit
+        self._fields = fields
+        self._orders = list(orders)
+
+    def _copy(self, **changes):
+        settings = dict(filters=self._filters, limit=self._limit, fields=self._fields, orders=self._orders)
+        settings.update(changes)
+        return FakeQuery(self._collection, **settings)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in self.OPERATORS:
+            raise ValueError(f"Unsupported operator: {op_string}")
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction=firestore.Query.ASCENDING):
+        return self._copy(orders=self._orders + [(field_path, direction == firestore.Query.DESCENDING)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def stream(self, transaction=None, retry=None, timeout=None):
+        client = self._collection._client
+        client._simulate_latency()
+        with client._lock:
+            matches = [
+                (document_id, copy.deepcopy(data))
+                for (collection_name, document_id), data in client._documents.items()
+                if collection_name == self._collection.id and all(
+                    self.OPERATORS[op](data.get(field), value) for field, op, value in self._filters)
+            ]
+        # Like Firestore, ordering leaves out documents without the field
+        for field, descending in reversed(self._orders):
+            matches = sorted((match for match in matches if field in match[1]),
+                             key=lambda match: match[1][field], reverse=descending)
+        for document_id, data in itertools.islice(matches, self._limit):
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield FakeDocumentSnapshot(self._collection.document(document_id), data)
+
+    def get(self, transaction=None, retry=None, timeout=None):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, collection_name):
+        self._client = client
+        self.id = collection_name
+        super().__init__(self)
+
+    def document(self, document_id=None):
+        if document_id is not None and not isinstance(document_id, str):
+            # Same check as the real client, so a non-string ID fails here too
+            raise ValueError("A path element must be a string.")
+        return FakeDocumentReference(self._client, self.id, document_id if document_id is not None else uuid.uuid4().hex)
+
+    def add(self, document_data, document_id=None, retry=None, timeout=None):
+        reference = self.document(document_id)
+        reference.set(document_data)
+        return datetime.datetime.now(datetime.timezone.utc), reference
+
+
+class FakeWriteBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(lambda: reference.set(document_data, merge=merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(lambda: reference.update(field_updates))
+
+    def delete(self, reference):
+        self._writes.append(reference.delete)
+
+    def commit(self, retry=None, timeout=None):
+        for write in self._writes:
+            write()
+        self._writes = []
+
+
+class FakeFirestoreClient:
+    """
+    Dict-backed Firestore client with collection/document set, update, get, delete, add,
+    where/order_by/limit/select/stream queries, get_all and write batches. SERVER_TIMESTAMP is stored as the current UTC time. Every
+    read and write can be delayed by `latency` seconds to mimic the network round trip.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        # Installed in place of firestore.Client, so every "new" client shares this store
+        return self
+
+    def _simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _write(self):
+        self._simulate_latency()
+        return self._lock
+
+    def _resolve(self, data):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return {key: now if value is firestore.SERVER_TIMESTAMP else copy.deepcopy(value) for key, value in data.items()}
+
+    def collection(self, collection_name):
+        return FakeCollectionReference(self, collection_name)
+
+    def batch(self):
+        return FakeWriteBatch()
+
+    def get_all(self, references, field_paths=None, transaction=None, retry=None, timeout=None):
+        self._simulate_latency()
+        for reference in references:
+            with self._lock:
+                data = copy.deepcopy(self._documents.get(reference._key))
+            yield FakeDocumentSnapshot(reference, data)
+
+    def document_count(self, collection_name=None):
+        with self._lock:
+            return sum(1 for key in self._documents if collection_name is None or key[0] == collection_name)
+
+    def close(self):
+        pass
+
+
+class LocalFakes:
+    def __init__(self, firestore_client, nlp_server, nlp_endpoint, nlp_service, workdir):
+        self.firestore_client = firestore_client
+        self.nlp_server = nlp_server
+        self.nlp_endpoint = nlp_endpoint
+        self.nlp_service = nlp_service
+        self.workdir = workdir
+
+    def stats(self):
+        return {
+            "nlp": self.nlp_service.stats(),
+            "firestore_documents": self.firestore_client.document_count()
+        }
+
+    def stop(self):
+        self.nlp_server.stop(grace=None)
+
+
+def install_local_fakes(nlp_latency="lognormal:0.08,0.5", nlp_error_rate=0.0, firestore_latency=0.0,
+                        seed=0, workdir=None):
+    """
+    Starts the fake NLP server, swaps firestore.Client for a shared FakeFirestoreClient and
+    points the app's settings (NLP endpoint, caches, models, encryption key) at local files.
+    Returns a LocalFakes; pass its workdir-based paths to create_app through test_config.
+    """
+    already_imported = [name for name in ("server.app", "server.api.task_controller") if name in sys.modules]
+    if already_imported:
+        raise RuntimeError(f"install_local_fakes must run before importing {', '.join(already_imported)}")
+
+    workdir = workdir or tempfile.mkdtemp(prefix="productivepanda_fakes_")
+    nlp_server, nlp_endpoint, nlp_service = start_fake_language_server(
+        latency=nlp_latency, error_rate=nlp_error_rate, seed=seed, max_workers=64
+    )
+    firestore_client = FakeFirestoreClient(latency=firestore_latency)
+    firestore.Client = firestore_client
+
+    os.environ["NLP_API_ENDPOINT"] = nlp_endpoint
+    os.environ["SENTIMENT_CACHE_PATH"] = os.path.join(workdir, "sentiment_cache.sqlite3")
+    os.environ["SENTIMENT_MODEL_DIR"] = os.path.join(workdir, "sentiment_models")
+    if not os.getenv("ENCRYPTION_KEY"):
+        from cryptography.fernet import Fernet
+        os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+    return LocalFakes(firestore_client, nlp_server, nlp_endpoint, nlp_service, workdir)
@@ -0,0 +1,66 @@
+# Runs the nightly recommendations job (server.models.recommendations) for every user.
+# Meant for a scheduler such as cron or Cloud Scheduler, once a night before users wake up.
+# With --synthetic it instead times the vectorized pass over generated data, without Firestore.
+#
+# Usage: python -m server.tools.nightly_recommendations [--limit 20]
+#        python -m server.tools.nightly_recommendations --synthetic 1000000 [--users 100000]
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from server.models.recommendations import (
+    TaskTable, MoodTable, DEFAULT_RECOMMENDATIONS_PER_USER, compute_recommendations, run_nightly_recommendations
+)
+from server.models.user_sqlalchemy_firestore_models import DEFAULT_POSITIVE_THRESHOLD, DEFAULT_NEGATIVE_THRESHOLD
+
+
+def synthetic_tables(task_count, user_count, seed=0):
+    """Random tasks spread over users, with a few users lacking a mood score."""
+    rng = np.random.default_rng(seed)
+    user = np.sort(rng.integers(0, user_count, task_count))
+    tasks = TaskTable(
+        [f"user-{index}" for index in range(user_count)],
+        user,
+        np.array([f"task-{index}" for index in range(task_count)], dtype=object),
+        np.round(rng.uniform(-1, 1, task_count), 2),
+        rng.integers(0, 4, task_count).astype(np.float64),
+        np.arange(task_count)
+    )
+    score = rng.uniform(-1, 1, user_count)
+    score[rng.random(user_count) < 0.05] = np.nan
+    moods = MoodTable(score, np.full(user_count, DEFAULT_POSITIVE_THRESHOLD), np.full(user_count, DEFAULT_NEGATIVE_THRESHOLD))
+    return tasks, moods
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute task recommendations for every user")
+    parser.add_argument("--limit", type=int, default=DEFAULT_RECOMMENDATIONS_PER_USER,
+                        help="tasks kept per list and user")
+    parser.add_argument("--synthetic", type=int, metavar="TASKS",
+                        help="time the computation on this many generated tasks instead of running the job")
+    parser.add_argument("--users", type=int, default=100000, help="number of users for --synthetic")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        tasks, moods = synthetic_tables(args.synthetic, args.users, args.seed)
+        started = time.perf_counter()
+        _, matching, recommended = compute_recommendations(tasks, moods, args.limit)
+        stats = {
+            "tasks": len(tasks),
+            "users": args.users,
+            "compute_seconds": round(time.perf_counter() - started, 3),
+            "matching_tasks": int(sum(len(indexes) for indexes in matching)),
+            "recommended_tasks": int(sum(len(indexes) for indexes in recommended))
+        }
+    else:
+        stats = run_nightly_recommendations(limit=args.limit)
+    print(json.dumps(stats, indent=2))
+    return stats
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# Moves stored user data from the master key to the per-user keys (server.api_handler.user_keys).
+# It walks the users, moodAnalysis and taskIndex collections and rewrites every document that
+# still has a token the user's own key can't open; documents already on the user's key are
+# left alone, so the tool can be stopped and rerun at any time. Mood analyses are rewritten in
+# the sealed format with a blind keyword index. Mood analyses without a userId (written before
+# records had one) can't be attributed to a user and are counted as unowned.
+# Writes are batched and the scan is throttled to --rate documents per second so a migration
+# doesn't eat the Firestore quota the app itself needs.
+#
+# Usage: python -m server.tools.reencrypt_user_data [--rate 200] [--batch-size 200] [--dry-run]
+#                                                   [--collection users --collection taskIndex ...]
+
+import argparse
+import json
+import time
+
+from cryptography.fernet import InvalidToken
+from google.cloud import firestore
+
+from server.api_handler.user_keys import UserKeyring, user_keyring
+from server.models.task_index import TASKS_COLLECTION
+from server.models.user_sqlalchemy_firestore_models import (
+    MOOD_RECORD_SEALED_FIELDS, open_mood_record, seal_mood_record, blind_index_tokens
+)
+
+# Firestore allows at most 500 writes per batch
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_RATE = 200.0
+
+# The migration has to open master-key data even where the app has the master fallback turned off
+migration_keyring = user_keyring if user_keyring.master_fallback else UserKeyring(
+    user_keyring.master_key, max_users=user_keyring.max_users)
+
+
+class Throttle:
+    """Spaces calls to wait() at least 1/rate seconds apart on average; no limit for rate None or 0."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.scheduled = time.perf_counter()
+
+    def wait(self):
+        if not self.interval:
+            return
+        delay = self.scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        # Don't bank time spent waiting on Firestore as a burst allowance
+        self.scheduled = max(self.scheduled, time.perf_counter() - self.interval) + self.interval
+
+
+def _on_user_key(user_id, token, keyring):
+    try:
+        keyring.user_cipher(user_id).decrypt(token.encode())
+        return True
+    except InvalidToken:
+        return False
+
+
+def _rotate_tokens(user_id, data, keyring):
+    """Re-encrypts every token in a nested dict of them; returns (new data, whether anything changed)"""
+    if isinstance(data, dict):
+        changed = False
+        rotated = {}
+        for key, value in data.items():
+            rotated[key], value_changed = _rotate_tokens(user_id, value, keyring)
+            changed = changed or value_changed
+        return rotated, changed
+    if isinstance(data, str) and not _on_user_key(user_id, data, keyring):
+        return keyring.cipher(user_id).rotate(data.encode()).decode(), True
+    return data, False
+
+
+def migrate_user(doc_id, data, keyring):
+    """users/<user ID>: the encrypted preferences"""
+    preferences, changed = _rotate_tokens(doc_id, data.get('preferences') or {}, keyring)
+    return {'preferences': preferences} if changed else None
+
+
+def migrate_mood_analysis(doc_id, data, keyring):
+    """moodAnalysis: resealed under the user's key, with a keyword index if the record lacks one"""
+    user_id = data.get('userId')
+    if user_id is None:
+        raise LookupError("unowned")
+    if 'sealed' in data and _on_user_key(user_id, data['sealed'], keyring) and 'keywordIndex' in data:
+        return None
+    record = open_mood_record(data, keyring.cipher(user_id))
+    document = {k: v for k, v in record.items() if k not in MOOD_RECORD_SEALED_FIELDS}
+    document['sealed'] = seal_mood_record({field: record[field] for field in MOOD_RECORD_SEALED_FIELDS if field in record},
+                                          keyring.cipher(user_id))
+    document['keywordIndex'] = blind_index_tokens(user_id, record.get('keywords', []))
+    return document
+
+
+def migrate_task(doc_id, data, keyring):
+    """taskIndex: the sealed task payload"""
+    payload, changed = _rotate_tokens(data['userId'], data['payload'], keyring)
+    return {'payload': payload} if changed else None
+
+
+# collection: (migration, whether its result replaces the document rather than updating fields)
+MIGRATIONS = {
+    'users': (migrate_user, False),
+    'moodAnalysis': (migrate_mood_analysis, True),
+    TASKS_COLLECTION: (migrate_task, False),
+}
+
+
+def reencrypt_collection(db, collection_name, keyring=migration_keyring, rate=DEFAULT_RATE,
+                         batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """Migrates one collection; returns counts of scanned, migrated, current, unowned and failed documents."""
+    migrate, replace = MIGRATIONS[collection_name]
+    stats = {'scanned': 0, 'migrated': 0, 'current': 0, 'unowned': 0, 'failed': 0}
+    throttle = Throttle(rate)
+    batch, pending = db.batch(), 0
+    for doc in db.collection(collection_name).stream():
+        throttle.wait()
+        stats['scanned'] += 1
+        try:
+            result = migrate(doc.id, doc.to_dict(), keyring)
+        except LookupError:
+            stats['unowned'] += 1
+            continue
+        except Exception:
+            stats['failed'] += 1
+            continue
+        if result is None:
+            stats['current'] += 1
+            continue
+        stats['migrated'] += 1
+        if dry_run:
+            continue
+        if replace:
+            batch.set(doc.reference, result)
+        else:
+            batch.update(doc.reference, result)
+        pending += 1
+        if pending >= batch_size:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-encrypt stored user data with per-user keys")
+    parser.add_argument("--collection", action="append", choices=sorted(MIGRATIONS),
+                        help="collection to migrate (repeatable); all of them by default")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="documents scanned per second, 0 for no limit")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="writes per Firestore batch")
+    parser.add_argument("--dry-run", action="store_true", help="only count the documents that need migrating")
+    args = parser.parse_args(argv)
+
+    db = firestore.Client()
+    stats = {}
+    for collection_name in args.collection or sorted(MIGRATIONS):
+        started = time.perf_counter()
+        stats[collection_name] = reencrypt_collection(db, collection_name, rate=args.rate,
+                                                      batch_size=args.batch_size, dry_run=args.dry_run)
+        stats[collection_name]['seconds'] = round(time.perf_counter() - started, 3)
+    stats['keyring'] = migration_keyring.stats()
+    print(json.dumps(stats, indent=2))
+    return stats
+
+
+if __name__ == "__main__":
+    main()
@@ -8,16 +8,47 @@ from flask import Flask, jsonify
 from dotenv import load_dotenv
 from pytest_socket import disable_socket, enable_socket
 import logging
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 from server.app import create_app
-from server.api.task_controller import task_controller, decrypt_data ,compare_mood_with_tasks, recommend_general_uplifting_tasks, store_user_data_securely, retrieve_user_data_securely, delete_no_longer_needed_data
+from server.app import db as app_db, bcrypt as app_bcrypt, User as AppUser
+from server.api.task_controller import task_controller, decrypt_data ,compare_mood_with_tasks, recommend_general_uplifting_tasks, store_user_data_securely, retrieve_user_data_securely, retrieve_many_user_data_securely, delete_no_longer_needed_data
 from server.app import create_app 
 from server.config.config import get_nlp_client
+import server.config.config as config_module
 from server.models.user_sqlalchemy_firestore_models import User
-from server.models.user_sqlalchemy_firestore_models import MoodUser
+from server.models.user_sqlalchemy_firestore_models import MoodUser, seal_mood_record, unseal_mood_record, blind_index_token, blind_index_tokens
+import server.models.user_sqlalchemy_firestore_models
 from server.models.Task import Task
-from server.api_handler.api_services import preprocess_text, send_to_google_nlp_api
-from server.api.task_controller import reorganize_tasks_based_on_mood_and_sentiment
+from server.api_handler.api_services import preprocess_text, send_to_google_nlp_api, TextPreprocessor, preprocess_texts, fast_tokenize
+from server.api.task_controller import reorganize_tasks_based_on_mood_and_sentiment, build_sentiment_plan, build_sentiment_plan_async, StreamingTaskRanker
+from server.api.task_controller import compare_mood_with_tasks, recommend_tasks_based_on_analysis, analyze_task_sentiment, rank_indexed_tasks
+from server.models.recommendations import run_nightly_recommendations, get_recommendations
+import asyncio
+from server.api_handler.lemma_table import build_lemma_table, MappedLemmatizer, DEFAULT_LEMMA_TABLE_PATH
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+import re
+from google.cloud import language_v1
+from server.api_handler.sentiment_cache import SentimentCache, get_cached_response, cache_response
+from server.api_handler.lexicon_sentiment import LexiconSentimentEngine
+from server.api_handler.sentiment_model import OnlineSentimentModel, update_user_sentiment_model, flush_user_sentiment_models
+from server.api_handler.resilience import CircuitBreaker, CircuitOpenError, request_deadline
+from server.tools.fake_language_server import start_fake_language_server
+from google.api_core import exceptions as core_exceptions
+from server.tools.local_fakes import FakeFirestoreClient
+from server.models.task_index import TaskIndex, StaleTaskIndexVersion
+from server.api_handler.job_queue import JobStore, JobQueueFull
+from server.config.logging_config import configure_logging, stop_logging, payload
+from server.api_handler.bulk_crypto import decrypt_many
+from server.api_handler.user_keys import UserKeyring
+from server.tools.reencrypt_user_data import reencrypt_collection, Throttle
+from server.tools.load_test import run_load
+from werkzeug.serving import make_server
+import threading
+import time
+import sqlite3
+import random
+import json
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -176,6 +207,79 @@ def test_preprocessing_text():
         preprocessed = preprocess_text(original)
         assert preprocessed == expected, f"Failed for {original}: got {preprocessed}, expected {expected}"
 
+def test_text_preprocessor_is_reusable():
+    preprocessor = TextPreprocessor()
+    texts = ["I'm not happy with this service.", "Terrible service, never   coming back!", "Let's go!"]
+    for text in texts:
+        assert preprocessor(text) == preprocess_text(text)
+    # A second pass over the same texts must give the same result from the warmed caches
+    assert [preprocessor(text) for text in texts] == [preprocess_text(text) for text in texts]
+
+def test_preprocess_texts_preserves_order(mocker):
+    texts = ["I'm not happy with this service.", "I love it!", "It's ok.", "Let's go!"] * 5
+    expected = [preprocess_text(text) for text in texts]
+    # Serial path for small batches
+    assert list(preprocess_texts(texts, workers=2)) == expected
+    # Process pool path once the batch crosses the threshold
+    mocker.patch('server.api_handler.api_services.PARALLEL_MIN_BATCH', 4)
+    assert list(preprocess_texts(iter(texts), workers=2, chunksize=3)) == expected
+
+def test_preprocess_texts_share_one_pool_without_breaking_running_generators(mocker):
+    mocker.patch('server.api_handler.api_services.PARALLEL_MIN_BATCH', 4)
+    texts = [f"task {i}" for i in range(40)]
+    two_workers = preprocess_texts(texts, workers=2, chunksize=2, preprocess=str.upper)
+    first = next(two_workers)
+    # A different worker count reuses the pool in use instead of replacing it
+    three_workers = list(preprocess_texts(texts, workers=3, chunksize=2, preprocess=str.upper))
+    assert [first] + list(two_workers) == three_workers == [text.upper() for text in texts]
+    # Once idle the pool is resized, never beyond the CPU count
+    assert list(preprocess_texts(texts, workers=10_000, chunksize=2, preprocess=str.upper)) == three_workers
+    assert server.api_handler.api_services._process_pool_workers <= (os.cpu_count() or 1)
+
+def test_mapped_lemmatizer_matches_wordnet(tmp_path):
+    wordnet_lemmatizer = WordNetLemmatizer()
+    table_path = str(tmp_path / "lemma_table.bin")
+    assert build_lemma_table(table_path, wordnet_lemmatizer) > 0
+
+    mapped_lemmatizer = MappedLemmatizer(table_path)
+    try:
+        for word in ["dogs", "churches", "wolves", "abaci", "geese", "women", "service", "happy", "us", "xyzzyqs"]:
+            assert mapped_lemmatizer.lemmatize(word) == wordnet_lemmatizer.lemmatize(word), word
+    finally:
+        mapped_lemmatizer.close()
+
+def test_lemma_table_stays_out_of_the_source_tree_and_needs_the_exception_list(mocker, tmp_path):
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(server.api_handler.__file__)))
+    assert not os.path.abspath(DEFAULT_LEMMA_TABLE_PATH).startswith(package_dir + os.sep)
+    mocker.patch('nltk.corpus.wordnet', mocker.Mock(spec=['ensure_loaded', 'NOUN'], NOUN='n'))
+    with pytest.raises(RuntimeError, match="_exception_map"):
+        build_lemma_table(str(tmp_path / "lemma_table.bin"))
+
+# Reference corpus for tokenizer parity: journal-style entries plus the Treebank special cases
+TOKENIZER_PARITY_CORPUS = [
+    "I'm not happy with this service.",
+    "The movie was good, but the ending was not.",
+    "Terrible service, never coming back!",
+    "I cannot focus today, I'm gonna take a walk and then I wanna finish the report.",
+    "Gotta remember: gimme five minutes, lemme breathe... CANNOT keep up!!",
+    "Deadline at 5pm -- 3 tasks left (ugh) & 2 meetings; feeling 50/50 about it",
+    "Café visit was naïve fun; über tired, 日本語 practice done",
+    "wannabe writers cannotx snake_case_words\tand\ttabs\nnew lines   extra   spaces",
+    "",
+]
+
+def test_fast_tokenize_matches_word_tokenize():
+    for text in TOKENIZER_PARITY_CORPUS:
+        normalized = re.sub(r'[^\w\s]', '', text.lower())
+        assert fast_tokenize(normalized) == word_tokenize(normalized), normalized
+        # Text that still has punctuation goes through word_tokenize unchanged
+        assert fast_tokenize(text) == word_tokenize(text), text
+
+def test_preprocess_text_unchanged_by_fast_tokenizer():
+    punkt_preprocessor = TextPreprocessor(tokenizer=word_tokenize)
+    for text in TOKENIZER_PARITY_CORPUS:
+        assert preprocess_text(text) == punkt_preprocessor(text), text
+
 def test_preprocessing_and_sentiment_analysis():
     test_cases = [
         ("I'm not happy with this service.", -0.8),
@@ -193,11 +297,296 @@ def test_preprocessing_and_sentiment_analysis():
         logger.debug(f"Actual Score: {actual_score} for Preprocessed Text: '{preprocessed}'")
         assert actual_score == pytest.approx(expected_score, abs=0.1)
 
+@pytest.fixture(autouse=True)
+def isolated_sentiment_cache(mocker, tmp_path):
+    # Every test gets its own cache file instead of sharing cached scores with other tests and runs
+    mocker.patch('server.api_handler.sentiment_cache.sentiment_cache',
+                 SentimentCache(path=str(tmp_path / "sentiment_cache.sqlite3")))
+
+@pytest.fixture(autouse=True)
+def isolated_sentiment_models(monkeypatch, tmp_path):
+    monkeypatch.setenv("SENTIMENT_MODEL_DIR", str(tmp_path / "sentiment_models"))
+
+def test_sentiment_cache_tiers_and_ttl(tmp_path):
+    cache = SentimentCache(path=str(tmp_path / "sentiment.sqlite3"), max_memory_entries=1, ttl=60)
+    assert cache.get("finish the report") is None
+    cache.set("finish the report", "cached-1")
+    cache.set("call mom", "cached-2")
+
+    # The first entry was evicted from memory but is still served from SQLite
+    assert cache.get("call mom") == "cached-2"
+    assert cache.get("finish the report") == "cached-1"
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["disk_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["evictions"] >= 1
+
+    # A different backend version never sees these entries
+    other_version = SentimentCache(path=str(tmp_path / "sentiment.sqlite3"), version="other")
+    assert other_version.get("call mom") is None
+
+    expired = SentimentCache(path=str(tmp_path / "expired.sqlite3"), ttl=0)
+    expired.set("call mom", "cached")
+    assert expired.get("call mom") is None
+
+def test_send_to_google_nlp_api_uses_cache(mocker, tmp_path):
+    cache = SentimentCache(path=str(tmp_path / "sentiment.sqlite3"))
+    mocker.patch('server.api_handler.sentiment_cache.sentiment_cache', cache)
+    response = language_v1.AnalyzeSentimentResponse(document_sentiment={"score": 0.7, "magnitude": 0.9})
+    mock_client = mocker.Mock()
+    mock_client.analyze_sentiment.return_value = response
+    mocker.patch('server.api_handler.api_services.get_nlp_client', return_value=mock_client)
+
+    first = send_to_google_nlp_api("love weekend")
+    second = send_to_google_nlp_api("love weekend")
+
+    assert mock_client.analyze_sentiment.call_count == 1
+    assert second.document_sentiment.score == pytest.approx(first.document_sentiment.score)
+
+def test_sentiment_cache_stores_scores_only_in_a_private_file(tmp_path):
+    path = tmp_path / "cache" / "sentiment.sqlite3"
+    cache = SentimentCache(path=str(path))
+    response = language_v1.AnalyzeSentimentResponse(
+        document_sentiment={"score": -0.6, "magnitude": 1.2},
+        sentences=[{"text": {"content": "my private journal entry"}, "sentiment": {"score": -0.6}}])
+    cache_response("my private journal entry", response, cache=cache)
+
+    assert oct(path.stat().st_mode & 0o777) == oct(0o600)
+    with sqlite3.connect(str(path)) as connection:
+        stored = [row[0] for row in connection.execute("SELECT value FROM sentiment_cache")]
+    assert stored and all("journal" not in value for value in stored)
+
+    cached = get_cached_response("my private journal entry", cache=SentimentCache(path=str(path)))
+    assert cached.document_sentiment.score == pytest.approx(-0.6)
+    assert cached.document_sentiment.magnitude == pytest.approx(1.2)
+    assert [sentence.text.content for sentence in cached.sentences] == ["my private journal entry"]
+    assert SentimentCache(path=None).get("my private journal entry") is None
+
+def test_lexicon_engine_rules_and_shape():
+    engine = LexiconSentimentEngine()
+    happy = engine.analyze("happy")["overall_sentiment"]["score"]
+    assert happy > 0
+    assert engine.analyze("not happy")["overall_sentiment"]["score"] < 0
+    assert engine.analyze("really happy")["overall_sentiment"]["score"] > happy
+    # The clause after "but" outweighs the one before it
+    assert engine.analyze("movie good but ending awful")["overall_sentiment"]["score"] < 0
+
+    texts = ["I love it!", "Terrible service, never coming back!", "It's ok.", ""]
+    batch = engine.analyze_batch(texts)
+    assert batch == [engine.analyze(text) for text in texts]
+    for result in batch:
+        assert set(result) == {"overall_sentiment", "sentences"}
+        assert set(result["overall_sentiment"]) == {"score", "magnitude"}
+        assert -1 <= result["overall_sentiment"]["score"] <= 1
+        for sentence in result["sentences"]:
+            assert set(sentence) == {"content", "sentiment", "magnitude"}
+
+def test_send_to_google_nlp_api_with_local_backend(mocker):
+    disable_socket()
+    try:
+        mocker.patch.dict(os.environ, {"SENTIMENT_BACKEND": "lexicon"})
+        mock_get_client = mocker.patch('server.api_handler.api_services.get_nlp_client')
+        preprocessed = preprocess_text("I'm not happy with this service.")
+        parsed = parse_api_response(send_to_google_nlp_api(preprocessed))
+        expected = LexiconSentimentEngine().analyze(preprocessed)
+        # Scores travel through float32 proto fields, so compare approximately
+        assert parsed["overall_sentiment"]["score"] == pytest.approx(expected["overall_sentiment"]["score"], abs=1e-6)
+        assert [sentence["content"] for sentence in parsed["sentences"]] == [sentence["content"] for sentence in expected["sentences"]]
+        assert extract_sentiment_score(parsed) < 0
+        mock_get_client.assert_not_called()
+    finally:
+        enable_socket()
+
+def test_analyze_task_sentiment_falls_back_when_the_client_cannot_be_created(mocker):
+    mocker.patch('server.api.task_controller.get_nlp_client', side_effect=FileNotFoundError("credentials"))
+    mocker.patch('server.api.task_controller.nlp_breaker', CircuitBreaker("test-client"))
+    fallback = mocker.Mock()
+    fallback.analyze_sentiment.return_value = language_v1.AnalyzeSentimentResponse(document_sentiment={"score": 0.4})
+    mocker.patch('server.api.task_controller.fallback_sentiment_backend', return_value=fallback)
+
+    assert analyze_task_sentiment("Plan a picnic") == pytest.approx(0.4)
+    fallback.analyze_sentiment.assert_called_once_with("Plan a picnic")
+
+def test_circuit_breaker_opens_on_failures_and_latency(mocker):
+    clock = {"now": 100.0}
+    mocker.patch('server.api_handler.resilience.time.monotonic', side_effect=lambda: clock["now"])
+    breaker = CircuitBreaker("test", window_size=4, min_calls=4, failure_rate_threshold=0.5,
+                             slow_call_threshold=1.0, open_duration=30.0)
+
+    def slow_call():
+        clock["now"] += 2.0
+        return "remote"
+
+    def failing_call():
+        raise RuntimeError("upstream down")
+
+    assert breaker.call(lambda: "remote") == "remote"
+    assert breaker.call(slow_call) == "remote"
+    assert breaker.call(failing_call, fallback=lambda: "local", fallback_on_error=True) == "local"
+    assert breaker.state == breaker.CLOSED
+    with pytest.raises(RuntimeError):
+        breaker.call(failing_call, fallback=lambda: "local")
+    assert breaker.state == breaker.OPEN
+
+    # Open: the upstream is not called at all
+    upstream = MagicMock(return_value="remote")
+    assert breaker.call(upstream, fallback=lambda: "local") == "local"
+    upstream.assert_not_called()
+    with pytest.raises(CircuitOpenError):
+        breaker.call(upstream)
+
+    # After open_duration one trial call goes through and closes the breaker
+    clock["now"] += 31.0
+    assert breaker.call(upstream, fallback=lambda: "local") == "remote"
+    assert breaker.state == breaker.CLOSED
+    stats = breaker.stats()
+    assert stats["opened"] == 1
+    assert stats["slow_calls"] == 1
+    assert stats["failures"] == 2
+    assert stats["short_circuits"] == 2
+
+def test_send_to_google_nlp_api_respects_deadline_and_breaker(mocker, tmp_path):
+    mocker.patch('server.api_handler.sentiment_cache.sentiment_cache', SentimentCache(path=str(tmp_path / "sentiment.sqlite3")))
+    mock_client = mocker.Mock()
+    mock_client.analyze_sentiment.return_value = language_v1.AnalyzeSentimentResponse(document_sentiment={"score": 0.5})
+    mocker.patch('server.api_handler.api_services.get_nlp_client', return_value=mock_client)
+    breaker = CircuitBreaker("test-nlp")
+    mocker.patch('server.api_handler.api_services.nlp_breaker', breaker)
+
+    with request_deadline(3.0):
+        send_to_google_nlp_api("finish report")
+    # The call goes through the configured backend, with the deadline passed to the client
+    call_kwargs = mock_client.analyze_sentiment.call_args.kwargs
+    assert "document" in call_kwargs["request"]
+    assert 0 < call_kwargs["timeout"] <= 3.0
+
+    breaker._transition(breaker.OPEN)
+    mock_client.analyze_sentiment.reset_mock()
+    response = send_to_google_nlp_api("love sunny weekend")
+    mock_client.analyze_sentiment.assert_not_called()
+    assert response.document_sentiment.score > 0
+
 # config.py tests
 def test_get_nlp_client():
     client = get_nlp_client()
     assert client is not None
 
+def test_get_nlp_client_is_pooled_per_process(mocker):
+    mocker.patch('server.config.config._clients', {})
+    mock_create = mocker.patch('server.config.config.create_nlp_client', side_effect=lambda: MagicMock())
+    first = config_module.get_nlp_client()
+    second = config_module.get_nlp_client()
+    assert first is second
+    mock_create.assert_called_once()
+
+    # A forked worker must build its own channel instead of reusing the parent's
+    config_module._reset_clients_after_fork()
+    assert config_module.get_nlp_client() is not first
+    assert mock_create.call_count == 2
+
+def test_nlp_client_talks_to_fake_language_server(mocker):
+    server, endpoint, service = start_fake_language_server(latency="fixed:0.01")
+    failing_server, failing_endpoint, _ = start_fake_language_server(error_rate=1.0)
+    try:
+        mocker.patch.dict(os.environ, {"NLP_API_ENDPOINT": endpoint})
+        client = config_module.create_nlp_client()
+        document = language_v1.Document(content="Finish report. I love it!", type_=language_v1.Document.Type.PLAIN_TEXT)
+        response = client.analyze_sentiment(request={"document": document, "encoding_type": language_v1.EncodingType.UTF32})
+        expected = LexiconSentimentEngine().analyze("Finish report. I love it!", include_offsets=True)
+        assert response.document_sentiment.score == pytest.approx(expected["overall_sentiment"]["score"], abs=1e-6)
+        assert [sentence.text.begin_offset for sentence in response.sentences] == [0, 15]
+        assert service.stats()["requests"] == 1
+
+        mocker.patch.dict(os.environ, {"NLP_API_ENDPOINT": failing_endpoint})
+        with pytest.raises(core_exceptions.ServiceUnavailable):
+            config_module.create_nlp_client().analyze_sentiment(request={"document": document}, retry=None, timeout=5)
+    finally:
+        server.stop(grace=None)
+        failing_server.stop(grace=None)
+
+def test_fake_firestore_client_round_trip():
+    fake_firestore = FakeFirestoreClient()
+    assert fake_firestore() is fake_firestore
+    fake_firestore.collection('moodAnalysis').document('a').set({'keywords': ['deadline'], 'timestamp': firestore.SERVER_TIMESTAMP})
+    fake_firestore.collection('moodAnalysis').document().set({'keywords': ['walk']})
+    fake_firestore.collection('moodAnalysis').document('a').update({'moodCategory': 'negative'})
+
+    snapshot = fake_firestore.collection('moodAnalysis').document('a').get()
+    assert snapshot.exists and snapshot.get('moodCategory') == 'negative'
+    assert snapshot.get('timestamp') is not firestore.SERVER_TIMESTAMP
+    assert [doc.id for doc in fake_firestore.collection('moodAnalysis').where('keywords', 'array_contains', 'deadline').stream()] == ['a']
+    fake_firestore.collection('moodAnalysis').document('a').delete()
+    assert not fake_firestore.collection('moodAnalysis').document('a').get().exists
+    assert fake_firestore.document_count('moodAnalysis') == 1
+
+def test_todo_bulk_operations_and_keyset_pages(tmp_path, mocker):
+    credentials_path = tmp_path / "credentials.json"
+    credentials_path.write_text("{}")
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'todos.db'}",
+                      "FIRESTORE_CREDENTIALS_PATH": str(credentials_path), "WTF_CSRF_ENABLED": False})
+    mock_index = mocker.patch('server.app.task_index')
+    mock_index.upsert.return_value = (['1'], 'v1')
+    with app.app_context():
+        app_db.create_all()
+        app_db.session.add(AppUser(username="todouser", password=app_bcrypt.generate_password_hash("secret").decode()))
+        app_db.session.commit()
+    client = app.test_client()
+    client.post('/login', data={"username": "todouser", "password": "secret"})
+
+    response = client.post('/todos/bulk', json={"operations": [
+        {"op": "create", "description": f"task {i}", "clientId": i} for i in range(5)]})
+    assert response.status_code == 200 and response.json['version'] == 'v1'
+    ids = [result['task']['id'] for result in response.json['results']]
+    response = client.post('/todos/bulk', json={"operations": [
+        {"op": "update", "id": ids[1], "status": "finished"}, {"op": "delete", "id": ids[2]}]})
+    assert [result['op'] for result in response.json['results']] == ['update', 'delete']
+    assert mock_index.upsert.call_args.kwargs['delete_ids'] == [str(ids[1]), str(ids[2])]
+
+    # Invalid or foreign IDs reject the whole request
+    assert client.post('/todos/bulk', json={"operations": [{"op": "delete", "id": ids[0]}, {"op": "delete", "id": 999}]}).status_code == 404
+    assert client.post('/todos/bulk', json={"operations": [{"op": "update", "id": ids[0], "status": "done"}]}).status_code == 400
+
+    seen, cursor = [], None
+    while True:
+        page = client.get('/todos', query_string={"status": "awaiting", "limit": 2, **({"cursor": cursor} if cursor else {})}).json
+        seen += [task['id'] for task in page['tasks']]
+        cursor = page['nextCursor']
+        if cursor is None:
+            break
+    assert seen == [ids[0], ids[3], ids[4]]
+    assert [task['id'] for task in client.get('/todos', query_string={"status": "finished"}).json['tasks']] == [ids[1]]
+
+def test_run_load_reports_per_endpoint_latency():
+    load_app = Flask(__name__)
+    load_app.secret_key = 'load-test'
+
+    @load_app.route('/login', methods=['POST'])
+    def login():
+        return '', 302, {'Location': '/dashboard'}
+
+    @load_app.route('/dashboard', methods=['POST'])
+    def dashboard():
+        return 'ok'
+
+    @load_app.route('/tasks/analyze_tasks', methods=['POST'])
+    def analyze_tasks():
+        return jsonify({"status": "success"})
+
+    server = make_server('127.0.0.1', 0, load_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        report = run_load(f"http://127.0.0.1:{server.server_port}", "loadtester", "secret", "1",
+                          concurrency=2, duration=0.5, warmup=0.1, dashboard_share=0.5)
+    finally:
+        server.shutdown()
+
+    assert report["overall"]["requests"] == report["dashboard"]["requests"] + report["analyze_tasks"]["requests"]
+    assert report["overall"]["requests"] > 0
+    assert report["overall"]["errors"] == 0
+    latency = report["overall"]["latency_ms"]
+    assert 0 < latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["p999"] <= latency["max"]
+
 # User.py tests
 def test_mood_user_creation():
     mood_user = MoodUser(user_id="testuser", preferences={"theme": "dark"})
@@ -260,10 +649,53 @@ def test_analyze_mood(mocker):
     finally:
         enable_socket()
     
+def test_online_sentiment_model_learns_and_persists(tmp_path):
+    model = OnlineSentimentModel()
+    examples = [("love productive day", 0.8), ("stressed tired deadline", -0.8)] * 50
+    model.partial_fit([text for text, _ in examples], [score for _, score in examples])
+    assert model.is_trained()
+    predictions = model.predict(["love productive day", "stressed tired deadline"])
+    assert predictions[0] > 0.3
+    assert predictions[1] < -0.3
+
+    path = str(tmp_path / "model.npz")
+    model.save(path)
+    restored = OnlineSentimentModel.load(path)
+    assert restored.updates == model.updates
+    assert restored.predict_one("love productive day") == pytest.approx(predictions[0], abs=1e-2)
+
+def test_user_sentiment_models_are_saved_in_the_background_under_hashed_names(mocker, tmp_path):
+    saving_threads = []
+    save = OnlineSentimentModel.save
+    mocker.patch.object(OnlineSentimentModel, 'save', autospec=True,
+                        side_effect=lambda model, path: saving_threads.append(threading.current_thread()) or save(model, path))
+    update_user_sentiment_model("a.b", ["happy day"], [0.9])
+    update_user_sentiment_model("ab", ["sad day"], [-0.9])
+    # Training never writes the model file on the request thread
+    assert threading.current_thread() not in saving_threads
+
+    flush_user_sentiment_models()
+    files = sorted(os.listdir(tmp_path / "sentiment_models"))
+    assert len(files) == 2 and all(len(name) == len("0" * 64 + ".npz") for name in files)
+    assert sorted(OnlineSentimentModel.load(str(tmp_path / "sentiment_models" / name)).updates for name in files) == [1, 1]
+
+def test_analyze_mood_uses_trained_local_model(mocker, tmp_path):
+    mocker.patch('google.cloud.firestore.Client', return_value=MagicMock())
+    mocker.patch.dict(os.environ, {"SENTIMENT_MODEL_DIR": str(tmp_path)})
+    mock_send = mocker.patch('server.models.user_sqlalchemy_firestore_models.send_to_google_nlp_api')
+    mood_user = MoodUser(user_id="localmodeluser")
+    mood_user.train_sentiment_model(["feeling happy calm"] * 30, [0.9] * 30)
+
+    mood_analysis = mood_user.analyze_mood("Feeling happy and calm", use_local_model=True)
+
+    mock_send.assert_not_called()
+    assert mood_analysis['sentimentScore'] > 0
+    assert mood_analysis['moodCategory'] == 'positive'
+
 # Tests the store_mood_analysis method with mocking
 def test_store_mood_analysis_with_mock_encryption(mocker):
     mocker.patch('google.cloud.firestore.Client', return_value=MagicMock())
-    mock_encrypt = lambda x: f'encrypted_{x}'
+    mock_seal = lambda fields: f'sealed_{sorted(fields.items())}'
 
     mood_user = MoodUser(user_id="testuser")
     mood_analysis = {
@@ -274,18 +706,174 @@ def test_store_mood_analysis_with_mock_encryption(mocker):
     }
 
     expected_encrypted_mood_analysis = {
-        'inputText': 'encrypted_I am feeling very stressed out today',
+        'userId': "testuser",
+        'keywordIndex': blind_index_tokens("testuser", ["stressed", "today"]),
+        'sealed': "sealed_[('inputText', 'I am feeling very stressed out today'), ('keywords', ['stressed', 'today']), ('moodCategory', 'negative')]",
         'sentimentScore': mood_analysis['sentimentScore'],
-        'keywords': ['encrypted_stressed', 'encrypted_today'],
-        'moodCategory': 'encrypted_negative',
         'timestamp': mocker.ANY
     }
-    
-    mood_user.store_mood_analysis(mood_analysis, encrypt_func=mock_encrypt)
+
+    mood_user.store_mood_analysis(mood_analysis, seal_func=mock_seal)
 
     mood_user.db.collection('moodAnalysis').document.assert_called_once()
     mood_user.db.collection('moodAnalysis').document().set.assert_called_once_with(expected_encrypted_mood_analysis)
 
+def test_mood_records_round_trip_and_read_legacy_documents(mocker):
+    fake_firestore = FakeFirestoreClient()
+    mocker.patch('google.cloud.firestore.Client', return_value=fake_firestore)
+    mood_user = MoodUser(user_id="testuser")
+    keywords = [f"keyword{i}" for i in range(40)]
+    mood_user.store_mood_analysis({'inputText': "Stressed about the deadline " * 20, 'sentimentScore': -0.6,
+                                   'keywords': keywords, 'moodCategory': 'negative'})
+    document_id, document = next((doc.id, doc.to_dict()) for doc in fake_firestore.collection('moodAnalysis').stream())
+    assert set(document) == {'userId', 'sealed', 'keywordIndex', 'sentimentScore', 'timestamp'}
+    # Compressed: far smaller than the text alone, let alone 42 separate tokens
+    assert len(document['sealed']) < len("Stressed about the deadline " * 20)
+
+    record = mood_user.retrieve_mood_analysis(document_id)
+    assert record['inputText'] == "Stressed about the deadline " * 20
+    assert record['keywords'] == keywords and record['moodCategory'] == 'negative' and record['sentimentScore'] == -0.6
+
+    legacy_encrypt = cipher_suite.encrypt
+    fake_firestore.collection('moodAnalysis').document('legacy').set({
+        'inputText': legacy_encrypt(b"Calm morning").decode(), 'sentimentScore': 0.4,
+        'keywords': [legacy_encrypt(b"calm").decode(), legacy_encrypt(b"morning").decode()],
+        'moodCategory': legacy_encrypt(b"positive").decode()})
+    assert mood_user.retrieve_mood_analysis('legacy') == {
+        'inputText': "Calm morning", 'sentimentScore': 0.4, 'keywords': ["calm", "morning"], 'moodCategory': "positive"}
+
+    with pytest.raises(ValueError):
+        unseal_mood_record(cipher_suite.encrypt(b"\x09\x00{}").decode())
+    assert unseal_mood_record(seal_mood_record({'inputText': "hi"})) == {'inputText': "hi"}
+
+def test_bulk_decryption_keeps_order_and_isolates_failures(mocker, monkeypatch):
+    monkeypatch.setenv('BULK_DECRYPT_WORKERS', '4')
+    tokens = [cipher_suite.encrypt(f"value {i}".encode()).decode() for i in range(200)]
+    tokens[17] = "not a token"
+    results = decrypt_many(tokens, lambda token: cipher_suite.decrypt(token.encode()).decode(), min_parallel_items=0)
+    assert [result.value for result in results[:3]] == ["value 0", "value 1", "value 2"]
+    assert not results[17].ok and results[17].value is None
+    assert all(result.ok for i, result in enumerate(results) if i != 17) and results[199].value == "value 199"
+
+    fake_firestore = FakeFirestoreClient()
+    mocker.patch('google.cloud.firestore.Client', return_value=fake_firestore)
+    mood_user = MoodUser(user_id="historyuser")
+    for day in range(5):
+        mood_user.store_mood_analysis({'inputText': f"Day {day}", 'sentimentScore': day / 10,
+                                       'keywords': [f"day{day}"], 'moodCategory': 'neutral'})
+        time.sleep(0.001)
+    fake_firestore.collection('moodAnalysis').document('corrupt').set(
+        {'userId': "historyuser", 'sealed': "garbage", 'timestamp': firestore.SERVER_TIMESTAMP})
+    MoodUser(user_id="someoneelse").store_mood_analysis({'inputText': "Not mine", 'sentimentScore': 0.0,
+                                                         'keywords': [], 'moodCategory': 'neutral'})
+    history = mood_user.retrieve_mood_history(limit=4)
+    assert [entry['inputText'] for entry in history] == ["Day 4", "Day 3", "Day 2"]
+
+    mocker.patch('server.api.task_controller.firestore_client', fake_firestore)
+    fake_firestore.collection('secure').document('a').set({'field1': tokens[0], 'field2': tokens[1]})
+    fake_firestore.collection('secure').document('b').set({'field1': "not a token"})
+    assert retrieve_many_user_data_securely('secure', ['a', 'missing', 'b']) == [
+        {'field1': "value 0", 'field2': "value 1"}, None, None]
+
+def test_record_latest_mood_with_an_integer_user_id(mocker):
+    fake_firestore = FakeFirestoreClient()
+    mocker.patch('google.cloud.firestore.Client', return_value=fake_firestore)
+    # Flask-Login users have integer IDs; Firestore document IDs must be strings
+    MoodUser(user_id=5).record_latest_mood(0.6)
+    assert fake_firestore.collection('users').document('5').get().to_dict()['latestMoodScore'] == 0.6
+    with pytest.raises(ValueError):
+        fake_firestore.collection('users').document(5)
+
+def test_search_mood_analyses_reads_only_matching_entries(mocker):
+    fake_firestore = FakeFirestoreClient()
+    mocker.patch('google.cloud.firestore.Client', return_value=fake_firestore)
+    mood_user, other_user = MoodUser(user_id="searcher"), MoodUser(user_id="other")
+    for user, text, keywords in [(mood_user, "Deadline looming", ["deadline", "looming"]),
+                                 (mood_user, "Nice walk", ["nice", "walk"]),
+                                 (mood_user, "Another deadline", ["another", "deadline", "deadline"]),
+                                 (other_user, "Their deadline", ["deadline"])]:
+        user.store_mood_analysis({'inputText': text, 'sentimentScore': 0.0, 'keywords': keywords, 'moodCategory': 'neutral'})
+
+    assert blind_index_token("searcher", "deadline") != blind_index_token("other", "deadline")
+    assert len(blind_index_tokens("searcher", ["another", "deadline", "deadline"])) == 2
+    decrypt = mocker.spy(server.models.user_sqlalchemy_firestore_models, 'open_mood_record')
+    found = mood_user.search_mood_analyses("  Deadline ")
+    assert sorted(entry['inputText'] for entry in found) == ["Another deadline", "Deadline looming"]
+    assert decrypt.call_count == 2
+    assert mood_user.search_mood_analyses("holiday") == []
+
+def test_search_mood_analyses_normalizes_the_query_like_stored_keywords(mocker):
+    fake_firestore = FakeFirestoreClient()
+    mocker.patch('google.cloud.firestore.Client', return_value=fake_firestore)
+    mood_user = MoodUser(user_id="searcher")
+    # Stored keywords come from the preprocessed text, so they are lowercase and lemmatized
+    for text in ["Too many meetings today", "I feel stressed!", "Quiet day"]:
+        mood_user.store_mood_analysis({'inputText': text, 'sentimentScore': 0.0, 'moodCategory': 'neutral',
+                                       'keywords': fast_tokenize(preprocess_text(text))})
+
+    assert [entry['inputText'] for entry in mood_user.search_mood_analyses("Meetings")] == ["Too many meetings today"]
+    assert [entry['inputText'] for entry in mood_user.search_mood_analyses("Stressed!")] == ["I feel stressed!"]
+    assert sorted(entry['inputText'] for entry in mood_user.search_mood_analyses("meetings, quiet")) == [
+        "Quiet day", "Too many meetings today"]
+    assert mood_user.search_mood_analyses("the") == []
+
+def test_per_user_keys_are_cached_and_reencryption_migrates_master_key_data(mocker):
+    keyring = UserKeyring(os.getenv('ENCRYPTION_KEY').encode(), max_users=2)
+    token = keyring.cipher("alice").encrypt(b"secret")
+    assert keyring.user_cipher("alice").decrypt(token) == b"secret"
+    with pytest.raises(InvalidToken):
+        keyring.user_cipher("bob").decrypt(token)
+    with pytest.raises(InvalidToken):
+        cipher_suite.decrypt(token)
+    # Data written under the master key stays readable through the user's cipher
+    assert keyring.cipher("alice").decrypt(cipher_suite.encrypt(b"old")) == b"old"
+    keyring.cipher("carol")
+    stats = keyring.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['cached']) == (2, 3, 1, 2)
+    assert stats['deriveMillisecondsTotal'] > 0
+
+    fake_firestore = FakeFirestoreClient()
+    mocker.patch('google.cloud.firestore.Client', return_value=fake_firestore)
+    mocker.patch('server.models.user_sqlalchemy_firestore_models.user_keyring', keyring)
+    mood_user = MoodUser(user_id="alice")
+    fake_firestore.collection('users').document("alice").set(
+        {'preferences': {'theme': cipher_suite.encrypt(b"dark").decode(), 'maxDistance': 10}})
+    fake_firestore.collection('moodAnalysis').document('old').set(
+        {'userId': "alice", 'sealed': seal_mood_record({'inputText': "Old entry", 'keywords': ["old"], 'moodCategory': 'neutral'}),
+         'sentimentScore': 0.0, 'timestamp': firestore.SERVER_TIMESTAMP})
+    fake_firestore.collection('moodAnalysis').document('unowned').set({'inputText': cipher_suite.encrypt(b"?").decode()})
+    mood_user.store_mood_analysis({'inputText': "New entry", 'sentimentScore': 0.5, 'keywords': ["new"], 'moodCategory': 'positive'})
+    assert mood_user.retrieve_preferences() == {'theme': "dark", 'maxDistance': 10}
+
+    first = {name: reencrypt_collection(fake_firestore, name, keyring=keyring, rate=0) for name in ('users', 'moodAnalysis')}
+    assert first['users']['migrated'] == 1
+    assert (first['moodAnalysis']['migrated'], first['moodAnalysis']['current'], first['moodAnalysis']['unowned']) == (1, 1, 1)
+    second = reencrypt_collection(fake_firestore, 'moodAnalysis', keyring=keyring, rate=0)
+    assert (second['migrated'], second['current']) == (0, 2)
+
+    preferences = fake_firestore.collection('users').document("alice").get().to_dict()['preferences']
+    assert keyring.user_cipher("alice").decrypt(preferences['theme'].encode()) == b"dark"
+    assert mood_user.retrieve_mood_analysis('old')['inputText'] == "Old entry"
+    assert [entry['id'] for entry in mood_user.search_mood_analyses("old")] == ['old']
+
+    throttle = Throttle(rate=200)
+    started = time.perf_counter()
+    for _ in range(21):
+        throttle.wait()
+    assert time.perf_counter() - started >= 0.09
+
+def test_user_keyring_master_fallback_can_be_turned_off():
+    master_token = cipher_suite.encrypt(b"old")
+    with_fallback = UserKeyring(os.getenv('ENCRYPTION_KEY').encode())
+    without_fallback = UserKeyring(os.getenv('ENCRYPTION_KEY').encode(), master_fallback=False)
+    assert with_fallback.cipher("alice").decrypt(master_token) == b"old"
+    with pytest.raises(InvalidToken):
+        without_fallback.cipher("alice").decrypt(master_token)
+    # Both modes derive the same user key, so data already on it opens either way
+    token = with_fallback.cipher("alice").encrypt(b"secret")
+    assert without_fallback.cipher("alice").decrypt(token) == b"secret"
+    assert with_fallback.cipher("alice").decrypt(without_fallback.cipher("alice").encrypt(b"new")) == b"new"
+
 # Tests the update_last_login method with mocking
 def test_update_last_login(mocker):
     mocker.patch('google.cloud.firestore.Client', return_value=MagicMock())
@@ -645,6 +1233,280 @@ def test_reorganize_tasks_based_on_mood_and_sentiment_positive(mocker):
         assert reorganize_tasks_based_on_mood_and_sentiment(tasks, mood_score) == expected_result
 
 
+def test_reorganize_tasks_window_matches_full_ranking(mocker):
+    mocker.patch('server.api.task_controller.analyze_task_sentiment', side_effect=AssertionError("scores are given"))
+    rng = random.Random(7)
+    descriptions = [f"Task {i}" for i in range(40)]
+    scores = {description: rng.choice([-0.5, 0.0, 0.25, 0.5]) for description in descriptions}
+    for size in (30, 600):
+        for mood_score in (0.6, -0.6, 0.0):
+            tasks = [{"id": i, "description": rng.choice(descriptions), "priority": rng.randint(1, 3)} for i in range(size)]
+            full = [task["id"] for task in reorganize_tasks_based_on_mood_and_sentiment(
+                [dict(task) for task in tasks], mood_score, sentiment_scores=dict(scores))]
+            window = reorganize_tasks_based_on_mood_and_sentiment(
+                [dict(task) for task in tasks], mood_score, sentiment_scores=dict(scores), limit=5, offset=3)
+            assert [task["id"] for task in window] == full[3:8]
+            assert all(task["sentiment_score"] == scores[task["description"]] for task in window)
+
+def test_large_rankings_with_string_priorities_keep_sorted_order(mocker):
+    mocker.patch('server.api.task_controller.analyze_task_sentiment', side_effect=AssertionError("scores are given"))
+    # As strings "9" sorts above "10"; the NumPy path must not rank them numerically
+    tasks = [{"id": i, "description": "Task", "priority": "10" if i % 2 else "9"} for i in range(300)]
+    ranked = reorganize_tasks_based_on_mood_and_sentiment(tasks, 0.6, sentiment_scores={"Task": 0.1}, limit=4)
+    assert [task["id"] for task in ranked] == [0, 2, 4, 6]
+
+def test_large_rankings_with_huge_integer_priorities_keep_sorted_order(mocker):
+    mocker.patch('server.api.task_controller.analyze_task_sentiment', side_effect=AssertionError("scores are given"))
+    # 2**53 + 1 is 2**53 as a float64, and 10**400 doesn't fit one at all
+    tasks = [{"id": i, "description": "Task", "priority": 2 ** 53 + i % 2} for i in range(300)]
+    ranked = reorganize_tasks_based_on_mood_and_sentiment(tasks, 0.6, sentiment_scores={"Task": 0.1}, limit=4)
+    assert [task["id"] for task in ranked] == [1, 3, 5, 7]
+    tasks[10]["priority"] = 10 ** 400
+    ranked = reorganize_tasks_based_on_mood_and_sentiment(tasks, -0.6, sentiment_scores={"Task": 0.1})
+    assert ranked[-1]["id"] == 10 and [task["id"] for task in ranked[:3]] == [0, 2, 4]
+
+def test_streaming_task_ranker_matches_full_ranking():
+    rng = random.Random(7)
+    tasks = [{'description': f'task {i}', 'priority': rng.choice([0, 1, 2])} for i in range(200)]
+    scores = {task['description']: rng.choice([-0.5, 0.0, 0.5]) for task in tasks}
+    for mood_score in (0.6, -0.6, 0.0):
+        for limit, offset in ((10, 0), (15, 30), (0, 5)):
+            ranker = StreamingTaskRanker(limit, offset)
+            for task in tasks:
+                ranker.add(dict(task), scores[task['description']])
+            expected = reorganize_tasks_based_on_mood_and_sentiment(
+                [dict(task) for task in tasks], mood_score, sentiment_scores=dict(scores), limit=limit, offset=offset)
+            assert ranker.finish(mood_score) == expected and ranker.count == len(tasks)
+
+def test_analyze_tasks_streams_ndjson(client, mocker):
+    mocker.patch('server.api.task_controller.build_sentiment_plan',
+                 side_effect=lambda descriptions: {d: (0.5 if 'walk' in d.lower() else -0.5) for d in descriptions})
+    lines = [{"user_id": "testuser", "limit": 1}, {"description": "Go for a walk"},
+             {"description": "Do the dishes", "priority": 1}, {"description": "Walk the dog"}]
+    response = client.post('/tasks/analyze_tasks', data=''.join(json.dumps(line) + '\n' for line in lines),
+                           content_type='application/x-ndjson')
+
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [result['type'] for result in results] == ['taskSentiment'] * 3 + ['mood', 'recommendedTask', 'done']
+    assert results[3]['moodScore'] == pytest.approx(0.5 / 3)
+    assert results[4]['task']['description'] == 'Do the dishes' and results[5]['totalTasks'] == 3
+
+def test_job_store_is_bounded_and_expires_finished_jobs(mocker):
+    store = JobStore(max_jobs=2, ttl=60)
+    first, second = store.create(), store.create()
+    with pytest.raises(JobQueueFull):
+        store.create()
+    store.update(first['jobId'], status='succeeded', result={})
+    third = store.create()
+    assert store.get(first['jobId']) is None and store.get(third['jobId'])['status'] == 'queued'
+
+    store.update(second['jobId'], status='failed', error='boom')
+    mocker.patch('server.api_handler.job_queue.time.time', return_value=time.time() + 61)
+    assert store.get(second['jobId']) is None and store.counts()['queued'] == 1
+
+def test_analyze_tasks_async_job_can_be_polled_and_streamed(client, mocker):
+    release = threading.Event()
+    async def slow_analysis(request_data, concurrency, deadline):
+        await asyncio.to_thread(release.wait, 5)
+        return {"status": "success", "recommendedTasks": request_data['tasks']}
+    mocker.patch('server.api.task_controller.run_task_analysis', side_effect=slow_analysis)
+
+    response = client.post('/tasks/analyze_tasks?async=1', json={"user_id": "testuser", "tasks": [{"description": "task 1"}]})
+    assert response.status_code == 202
+    job_id = response.json['jobId']
+    assert response.headers['Location'].endswith(f'/tasks/jobs/{job_id}')
+    assert client.get(f'/tasks/jobs/{job_id}').json['status'] in ('queued', 'running')
+
+    release.set()
+    events = client.get(f'/tasks/jobs/{job_id}', headers={'Accept': 'text/event-stream'}).get_data(as_text=True)
+    assert 'event: result' in events
+    job = client.get(f'/tasks/jobs/{job_id}').json
+    assert job['status'] == 'succeeded' and job['result']['recommendedTasks'] == [{"description": "task 1"}]
+    assert client.get('/tasks/jobs/unknown').status_code == 404
+    assert client.post('/tasks/analyze_tasks?async=1', json={"tasks": []}).status_code == 400
+
+def test_task_index_scores_tasks_once_and_reranks_from_stored_scores():
+    scored = []
+    def score_descriptions(descriptions):
+        scored.extend(descriptions)
+        return {description: (0.8 if 'party' in description else -0.4) for description in descriptions}
+
+    fake_firestore = FakeFirestoreClient()
+    index = TaskIndex(score_descriptions, db=fake_firestore, workers=1)
+    task_ids, version = index.upsert('user-1', [
+        {'id': 'a', 'description': 'Plan the party', 'priority': 1},
+        {'id': 'b', 'description': 'File the taxes', 'priority': 1}
+    ])
+    tasks, scores, current = index.ranking_input('user-1', version=version)
+    assert task_ids == ['a', 'b'] and current == version
+    assert scores == {'Plan the party': 0.8, 'File the taxes': -0.4}
+    assert sorted(scored) == ['File the taxes', 'Plan the party']
+
+    # Another process reads the enriched index back without scoring anything again
+    tasks, scores, _ = TaskIndex(score_descriptions, db=fake_firestore).ranking_input('user-1', task_ids=['b', 'a'])
+    assert [task['id'] for task in tasks] == ['b', 'a'] and len(scored) == 2
+    ranked = reorganize_tasks_based_on_mood_and_sentiment(tasks, 0.5, sentiment_scores=scores)
+    assert [task['id'] for task in ranked] == ['a', 'b']
+
+    # Changing only the priority keeps the stored score; the old version token is now stale
+    _, new_version = index.upsert('user-1', [{'id': 'b', 'description': 'File the taxes', 'priority': 5}], delete_ids=['a'])
+    with pytest.raises(StaleTaskIndexVersion) as stale:
+        index.ranking_input('user-1', version=version)
+    assert stale.value.current_version == new_version
+    tasks, scores, _ = index.ranking_input('user-1', version=new_version)
+    assert [(task['id'], task['priority']) for task in tasks] == [('b', 5)] and len(scored) == 2
+
+def test_task_index_keeps_users_apart_and_ranks_without_scoring_the_mood(mocker):
+    fake_firestore = FakeFirestoreClient()
+    index = TaskIndex(lambda descriptions: {d: (0.8 if 'party' in d else 0.6) for d in descriptions},
+                      db=fake_firestore, workers=1)
+    # These pairs used to share a document ID
+    index.upsert('a__b', [{'id': 'c', 'description': 'Plan the party'}])
+    index.upsert('a', [{'id': 'b__c', 'description': 'File the taxes'}])
+    index.upsert(7, [{'id': 'd', 'description': 'Book the party venue'}])
+    assert [task['id'] for task in index.ranking_input('a__b')[0]] == ['c']
+    assert [task['id'] for task in index.ranking_input('a')[0]] == ['b__c']
+    assert [task['id'] for task in index.ranking_input('7')[0]] == ['d']
+
+    # Without a mood_score the mood comes from the stored scores, not another API call
+    mocker.patch('server.api.task_controller.task_index', index)
+    mock_analyze_sentiment = mocker.patch('server.api.task_controller.analyze_sentiment')
+    result = asyncio.run(rank_indexed_tasks({'task_ids': ['d']}, '7', None, 0))
+    mock_analyze_sentiment.assert_not_called()
+    assert result['userMoodCategory'] == 'positive'
+
+    # Per-user locks don't outlive their use
+    index._executor.shutdown(wait=True)
+    assert len(index._user_locks) == 0
+
+def test_task_index_writes_in_batches(mocker):
+    fake_firestore = FakeFirestoreClient()
+    index = TaskIndex(lambda descriptions: {d: 0.1 for d in descriptions}, db=fake_firestore, workers=1)
+    index._executor.submit = mocker.Mock()
+    batch = mocker.spy(fake_firestore, 'batch')
+    task_ids, version = index.upsert('bulk', [{'id': str(i), 'description': f'Task {i}'} for i in range(1200)])
+    # 1200 tasks and the version token: three batches instead of 1201 single writes
+    assert batch.call_count == 3
+    tasks, scores, current = index.ranking_input('bulk')
+    assert batch.call_count == 6 and current == version and len(tasks) == 1200
+    assert TaskIndex(None, db=fake_firestore).ranking_input('bulk')[0] == tasks
+
+def test_nightly_recommendations_match_per_request_analysis():
+    rng = random.Random(3)
+    fake_firestore = FakeFirestoreClient()
+    index = TaskIndex(lambda descriptions: {d: rng.choice([-0.8, -0.2, 0.0, 0.3, 0.9]) for d in descriptions},
+                      db=fake_firestore, workers=1)
+    moods = {'u1': 0.7, 'u2': -0.6, 'u3': None}
+    for user_id, mood_score in moods.items():
+        index.upsert(user_id, [{'description': f'{user_id} task {i}', 'priority': rng.randint(0, 2)} for i in range(12)])
+        if mood_score is not None:
+            fake_firestore.collection('users').document(user_id).set({'latestMoodScore': mood_score})
+        index.ranking_input(user_id)
+
+    stats = run_nightly_recommendations(db=fake_firestore, limit=None)
+    assert stats['users'] == 3 and stats['tasks'] == 36
+
+    for user_id, mood_score in moods.items():
+        tasks, scores, _ = index.ranking_input(user_id)
+        ranked = reorganize_tasks_based_on_mood_and_sentiment(tasks, mood_score or 0, sentiment_scores=scores)
+        task_sentiments = [{'task': task['id'], 'sentimentScore': task['sentiment_score']} for task in ranked]
+        category = {0.7: 'positive', -0.6: 'negative', None: 'neutral'}[mood_score]
+        stored = fake_firestore.collection('recommendations').document(user_id).get().to_dict()
+        assert stored['moodCategory'] == category
+        assert stored['matchingTaskIds'] == compare_mood_with_tasks(category, task_sentiments)
+        assert stored['recommendedTaskIds'] == [task['task'] for task in recommend_tasks_based_on_analysis(task_sentiments)]
+
+    recommendations = get_recommendations('u1', index, db=fake_firestore)
+    assert recommendations['recommendedTasks'] == [task['description'] for task in reorganize_tasks_based_on_mood_and_sentiment(
+        index.ranking_input('u1')[0], 0.7, sentiment_scores=index.ranking_input('u1')[1]) if task['sentiment_score'] > 0.5]
+
+def test_logging_pipeline_samples_debug_records_and_hides_payloads(monkeypatch):
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append((record.name, record.levelno, self.format(record), threading.current_thread().name))
+
+    monkeypatch.delenv('LOG_PAYLOADS', raising=False)
+    handler = ListHandler()
+    configure_logging(level='DEBUG', sample_rates={'sampled': 0.25}, handlers=[handler])
+    try:
+        sampled = logging.getLogger('sampled.child')
+        for i in range(8):
+            sampled.debug("debug %d", i)
+        sampled.info("always kept")
+        logging.getLogger('other').debug("Task text: %s", payload("call mom about the biopsy"))
+    finally:
+        # Stopping drains the queue, so every kept record has been handled afterwards
+        stop_logging()
+        configure_logging()
+
+    messages = [message for _, _, message, _ in handler.messages]
+    assert [m for m in messages if m.startswith("debug")] == ["debug 0", "debug 4"]
+    assert "always kept" in messages
+    assert "Task text: <str len=25>" in messages
+    assert all(thread != threading.current_thread().name for _, _, _, thread in handler.messages)
+
+def test_build_sentiment_plan_scores_each_description_once(mocker):
+    mocker.patch('server.api.task_controller.get_cached_response', return_value=None)
+    mock_cache_response = mocker.patch('server.api.task_controller.cache_response')
+    mock_analyze_sentiment = mocker.patch('server.api.task_controller.analyze_task_sentiment', return_value=-0.3)
+    packed_response = language_v1.AnalyzeSentimentResponse(sentences=[
+        {"text": {"content": "Finish report.", "begin_offset": 0}, "sentiment": {"score": 0.25}},
+        {"text": {"content": "Call mom!", "begin_offset": 15}, "sentiment": {"score": 0.75}},
+    ])
+    mock_client = mocker.patch('server.api.task_controller.get_nlp_client').return_value
+    mock_client.analyze_sentiment.return_value = packed_response
+
+    descriptions = ["Finish report", "Call mom!", "Finish report", "", "Plan the trip. Book hotels"]
+    plan = build_sentiment_plan(descriptions)
+
+    assert plan == {"Finish report": 0.25, "Call mom!": 0.75, "": 0, "Plan the trip. Book hotels": -0.3}
+    mock_client.analyze_sentiment.assert_called_once()
+    assert mock_client.analyze_sentiment.call_args.kwargs["request"]["document"].content == "Finish report. Call mom!"
+    mock_analyze_sentiment.assert_called_once_with("Plan the trip. Book hotels")
+    # Scores from a packed request stay in the plan; only whole-description responses are cached
+    mock_cache_response.assert_not_called()
+
+def test_build_sentiment_plan_scores_tasks_individually_when_the_client_cannot_be_created(mocker):
+    mocker.patch('server.api.task_controller.get_cached_response', return_value=None)
+    mocker.patch('server.api.task_controller.nlp_breaker', CircuitBreaker("test-nlp"))
+    mocker.patch('server.api.task_controller.get_nlp_client', side_effect=FileNotFoundError("credentials"))
+    mock_analyze_sentiment = mocker.patch('server.api.task_controller.analyze_task_sentiment', return_value=0.2)
+
+    plan = build_sentiment_plan(["Finish report", "Call mom!"])
+
+    assert plan == {"Finish report": 0.2, "Call mom!": 0.2}
+    assert mock_analyze_sentiment.call_count == 2
+
+def test_build_sentiment_plan_async_bounds_concurrency_and_deadline(mocker):
+    mocker.patch('server.api.task_controller.get_cached_response', return_value=None)
+    mocker.patch('server.api.task_controller.cache_response', side_effect=lambda text, response: response)
+    in_flight = {"now": 0, "max": 0}
+
+    async def fake_analyze_sentiment(request, timeout):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        try:
+            content = request["document"].content
+            await asyncio.sleep(1.0 if content.startswith("Slow") else 0.01)
+            return language_v1.AnalyzeSentimentResponse(document_sentiment={"score": 0.4})
+        finally:
+            in_flight["now"] -= 1
+
+    mock_client = mocker.Mock(analyze_sentiment=fake_analyze_sentiment)
+    mocker.patch('server.api.task_controller.get_async_nlp_client', return_value=mock_client)
+
+    descriptions = [f"Task {i}. Has two sentences" for i in range(6)] + ["Slow task. Never finishes in time"]
+    plan = asyncio.run(build_sentiment_plan_async(descriptions, concurrency=2, deadline=0.3))
+
+    assert in_flight["max"] <= 2
+    assert all(plan[f"Task {i}. Has two sentences"] == pytest.approx(0.4) for i in range(6))
+    assert plan["Slow task. Never finishes in time"] == 0
+
 def test_reorganize_tasks_based_on_mood_and_sentiment_neutral(mocker):
     tasks = [
         {"description": "Task 1", "priority": 1},